@@ -1,260 +1,213 @@
-from .trace import Camera
-from .shapes import *
-from .material import *
-from .texture import *
-from .randfloat import randfloat
-from .vec3 import Vec3
-from .bvh import BVH
-import random
+import argparse
+import os
 import sys
-import numpy as np
 
-def render_main():
-    world = HittableList()
-    """
-    world.add(Sphere(Vec3(-1, 0, -1), 0.5, Dielectric(1.5)))
-    world.add(Sphere(Vec3(-1, 0, -1), 0.4, Dielectric(1 / 1.5)))
-
-    world.add(Sphere(Vec3(1, 0, -1), 0.5, Metal(Vec3(1, 0, 0), 0.05)))
-    world.add(Sphere(Vec3(0, 0, -1), 0.5, Lambertian(Vec3(0.1, 0.2, 0.5))))
-    world.add(Sphere(Vec3(0, -100.5, -1), 100, Lambertian(Vec3(0.8, 0.8, 0.0))))
-    """
-    cam = Camera(
-        vfov=20,
-        lookfrom=Vec3(13, 2, 3),
-        lookat=Vec3(0, 0.2, 0),
-        samples_per_pixel=5,
-        image_width=800,
-        defocus_angle=0,
-        focus_dist=10,
-    )
-    world.add(
-        Sphere(
-            Vec3(0, -1000, 0),
-            1000,
-            Lambertian(
-                Checkered(
-                    0.32,
-                    SolidColor(Vec3(0.2, 0.3, 0.1)),
-                    SolidColor(Vec3(0.9, 0.9, 0.9)),
-                )
-            ),
-        )
-    )
-    for a in range(-5, 5):
-        for b in range(-5, 5):
-            mat = random.random()
-            center = Vec3(a + 0.9 * random.random(), 0.2, b + 0.9 * random.random())
-            if (center - Vec3(4, 0.2, 0)).length > 0.9:
-                if mat < 0.8:
-                    albedo = Vec3.random().item_mul(Vec3.random())
-                    sphere_material = Lambertian(albedo)
-                elif mat < 0.95:
-                    albedo = Vec3.random(0.5, 1)
-                    fuzz = randfloat(0, 0.5)
-                    sphere_material = Metal(albedo, fuzz)
-                else:
-                    sphere_material = Dielectric(1.5)
-                world.add(Sphere(center, 0.23, sphere_material))
-    world.add(Sphere(Vec3(0, 1, 0), 1.0, Dielectric(1.5)))
-    world.add(Sphere(Vec3(-4, 1, 0), 1.0, Lambertian(Vec3(0.4, 0.2, 0.1))))
-    world.add(Sphere(Vec3(4, 1, 0), 1.0, Metal(Vec3(0.7, 0.6, 0.5), 0.0)))
-    #world = BVH.from_hittable_list(world)
-    cam.render(world)
-
-
-def render_checkered_balls():
-    world = HittableList()
-    checker_texture = Checkered(
-        0.32, SolidColor(Vec3(0.2, 0.3, 0.1)), SolidColor(Vec3(0.9, 0.9, 0.9))
-    )
-    world.add(Sphere(Vec3(0, -10, 0), 10, Lambertian(checker_texture)))
-    world.add(Sphere(Vec3(0, 10, 0), 10, Lambertian(checker_texture)))
-    cam = Camera(
-        vfov=20,
-        lookfrom=Vec3(13, 2, 3),
-        lookat=Vec3(0, 0, 0),
-        samples_per_pixel=100,
-        image_width=400,
-        defocus_angle=0,
-    )
-    cam.render(world)
-
-
-def render_globe():
-    world_texture = Image("world.png")
-    world = Sphere(vec3.Vec3(0, 0, -3), 0.5, Lambertian(world_texture))
-    cam = Camera(
-        vfov=20,
-        samples_per_pixel=1,
-        image_width=1024,
-        defocus_angle=0,
-    )
-    cam.render(world)
-
-
-def render_noise():
-    noise_texture = Noise(
-        scale=4, mode="sine", turb_depth=12, albedo=Vec3(0.5, 0.5, 0.5)
-    )
-    world = HittableList()
-    world.add(Sphere(Vec3(0, -1000, 0), 1000, Lambertian(noise_texture)))
-    world.add(Sphere(Vec3(0, 2, 0), 2, Lambertian(noise_texture)))
-    cam = Camera(
-        vfov=20,
-        lookfrom=Vec3(13, 2, 3),
-        lookat=Vec3(0, 0, 0),
-        samples_per_pixel=30,
-        image_width=400,
-        defocus_angle=0,
-    )
-    cam.render(world)
-
-
-def render_s():
-    world = HittableList()
-    world.add(Sphere(Vec3(-1, 0, -1), 0.5, Dielectric(1.5)))
-    world.add(Sphere(Vec3(-1, 0, -1), 0.4, Dielectric(1 / 1.5)))
-
-    world.add(Sphere(Vec3(1, 0, -1), 0.5, Metal(Vec3(1, 0, 0), 0.05)))
-    world.add(Sphere(Vec3(0, 0, -1), 0.5, Lambertian(Vec3(0.1, 0.2, 0.5))))
-    world.add(Sphere(Vec3(0, -100.5, -1), 100, Lambertian(Vec3(0.8, 0.8, 0.0))))
-    cam = Camera(
-        vfov=20,
-        lookfrom=Vec3(-2, 2, 1),
-        lookat=Vec3(0, 0, -1),
-        image_width=400,
-        samples_per_pixel=200,
-    )
-    cam.render(world)
-
-
-def render_quads():
-    world = HittableList()
-    world.add(
-        Quad(
-            Vec3(-3, -2, 5),
-            Vec3(0, 0, -4),
-            Vec3(0, 4, 0),
-            Lambertian(Vec3(1.0, 0.2, 0.2)),
+# only argparse is imported up front, so --help and bad arguments don't pay
+# for numpy and the rest; main imports what the options need
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog="python -m raytracing",
+        description="Render one of the built-in scenes.",
+    )
+    p.add_argument("scene", nargs="?", help="the scene to render, see --list")
+    p.add_argument("--list", action="store_true", help="list the scenes and exit")
+    p.add_argument("-w", "--width", type=int, help="image width in pixels")
+    p.add_argument("-s", "--spp", type=int, help="samples per pixel")
+    p.add_argument("--max-bounces", type=int, help="segments a path may have")
+    p.add_argument(
+        "--roulette-depth",
+        type=int,
+        help="segments after which paths end by russian roulette, off if unset",
+    )
+    p.add_argument("--seed", type=int, help="seed of the samples, random if unset")
+    p.add_argument(
+        "--sampler",
+        choices=("independent", "stratified", "halton", "sobol"),
+        help="how pixel, lens and scatter samples are drawn (default independent)",
+    )
+    p.add_argument(
+        "--light-sampling",
+        action="store_true",
+        default=None,
+        help="sample lights directly at diffuse hits, with MIS",
+    )
+    p.add_argument(
+        "--texture-filtering",
+        action="store_true",
+        default=None,
+        help="filter image textures by mip level from each ray's footprint",
+    )
+    p.add_argument(
+        "--scene-seed",
+        type=int,
+        default=0,
+        help="seed of what scenes place at random (default %(default)s)",
+    )
+    p.add_argument(
+        "-o", "--output", default="-", help="image path, - for stdout (default)"
+    )
+    p.add_argument(
+        "-f",
+        "--format",
+        choices=("ppm", "png", "pfm"),
+        help="image format, by default from the output's extension or ppm",
+    )
+    p.add_argument("-j", "--workers", type=int, default=1, help="render processes")
+    p.add_argument("--tile-size", type=int, default=64)
+    p.add_argument("--mode", choices=("scalar", "wavefront"), default="scalar")
+    p.add_argument("--no-bvh", action="store_true", help="trace the plain scene list")
+    p.add_argument(
+        "--no-cache", action="store_true", help="build the scene, skip the cache"
+    )
+    p.add_argument(
+        "--stats", action="store_true", help="print traversal stats to stderr"
+    )
+    p.add_argument(
+        "--profile",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help="profile the render and write pstats to PATH, or the top calls "
+        "to stderr; only this process is profiled",
+    )
+    p.add_argument("-q", "--quiet", action="store_true", help="no progress bar")
+    p.add_argument(
+        "--listen",
+        metavar="[HOST:]PORT",
+        help="hand tiles to workers that connect here instead of rendering them; "
+        "-j starts that many workers on this machine too. HOST is localhost "
+        "unless given, 0.0.0.0 listens on every interface",
+    )
+    p.add_argument(
+        "--connect",
+        metavar="HOST:PORT",
+        help="render tiles for the coordinator at this address in -j processes",
+    )
+    p.add_argument(
+        "--authkey",
+        default=os.environ.get("RAYTRACING_AUTHKEY"),
+        help="shared secret of a coordinator and its workers, by default "
+        "$RAYTRACING_AUTHKEY or, for --listen, a random one",
+    )
+    p.add_argument(
+        "--timeout",
+        type=float,
+        help="seconds a worker may take over a tile before it goes to another",
+    )
+    return p
+
+
+def connect(p, args):
+    from . import distributed, scenecache
+
+    if args.authkey is None:
+        p.error("--connect needs --authkey or $RAYTRACING_AUTHKEY")
+    address = distributed.parse_address(args.connect)
+    authkey = args.authkey.encode()
+    cache_dir = None if args.no_cache else scenecache.CACHE_DIR
+    if args.workers == 1:
+        distributed.work(address, authkey, cache_dir)
+        return
+    for w in distributed.start_workers(args.workers, address, authkey, cache_dir):
+        w.join()
+
+
+def main(argv=None):
+    p = parser()
+    args = p.parse_args(argv)
+    if args.connect is not None:
+        if args.workers < 1:
+            p.error(f"--workers can't be {args.workers}")
+        connect(p, args)
+        return
+    if args.list or args.scene is None:
+        from .scenes import SCENES
+
+        if args.scene is None and not args.list:
+            p.error(f"pick a scene: {', '.join(SCENES)}")
+        print("\n".join(SCENES))
+        return
+    names = ("width", "spp", "max_bounces", "roulette_depth", "workers", "tile_size")
+    for name in names:
+        value = getattr(args, name)
+        least = 0 if name == "max_bounces" or name == "workers" and args.listen else 1
+        if value is not None and value < least:
+            p.error(f"--{name.replace('_', '-')} can't be {value}")
+
+    from . import scenecache
+    from .scenes import SCENES
+
+    if args.scene not in SCENES:
+        p.error(f"unknown scene {args.scene!r}, pick one of {', '.join(SCENES)}")
+    overrides = {
+        key: value
+        for key, value in (
+            ("image_width", args.width),
+            ("samples_per_pixel", args.spp),
+            ("max_bounces", args.max_bounces),
+            ("roulette_depth", args.roulette_depth),
+            ("sampler", args.sampler),
+            ("light_sampling", args.light_sampling),
+            ("texture_filtering", args.texture_filtering),
         )
-    )
-    world.add(
-        Quad(
-            Vec3(-2, -2, 0),
-            Vec3(4, 0, 0),
-            Vec3(0, 4, 0),
-            Lambertian(
-                Checkered(0.32, Image("wah-01.png"), SolidColor(Vec3(1.0, 0.5, 0)))
-            ),
+        if value is not None
+    }
+    cache_dir = None if args.no_cache else scenecache.CACHE_DIR
+    cam, world = scenecache.scene(
+        args.scene, args.scene_seed, cache_dir, not args.no_bvh, **overrides
+    )
+    workers = args.workers
+    if args.listen is not None:
+        from . import distributed
+
+        authkey = args.authkey or os.urandom(16).hex()
+        workers = distributed.Coordinator(
+            args.scene,
+            args.scene_seed,
+            not args.no_bvh,
+            distributed.parse_address(args.listen),
+            authkey.encode(),
+            args.timeout,
         )
-    )
-    world.add(
-        Quad(
-            Vec3(3, -2, 1),
-            Vec3(0, 0, 4),
-            Vec3(0, 4, 0),
-            Lambertian(Vec3(0.2, 0.2, 1)),
-        )
-    )
-    world.add(
-        Quad(
-            Vec3(-2, 3, 1), Vec3(4, 0, 0), Vec3(0, 0, 4), Lambertian(Vec3(1.0, 0, 0.5))
+        host, port = workers.address
+        print(
+            f"listening on {host}:{port}, workers run: python -m raytracing"
+            f" --connect HOST:{port}"
+            + ("" if args.authkey else f" --authkey {authkey}"),
+            file=sys.stderr,
         )
-    )
-    world.add(
-        Quad(
-            Vec3(-2, -3, 5),
-            Vec3(4, 0, 0),
-            Vec3(0, 0, -4),
-            Lambertian(Vec3(0, 1.0, 0.5)),
+        distributed.start_workers(
+            args.workers, workers.address, authkey.encode(), cache_dir
         )
-    )
-    cam = Camera(
-        vfov=80,
-        lookfrom=Vec3(0, 0, 9),
-        lookat=Vec3(0, 0, 0),
-        image_width=1400,
-        samples_per_pixel=10,
-    )
-    cam.render(world)
-
-
-def render_simple_light():
-    world = HittableList()
-    ntext = Noise(scale=4, mode="sine", turb_depth=4, albedo=Vec3(0.5, 0.5, 0.5))
-    world.add(Sphere(Vec3(0, -1000, 0), 1000, Lambertian(ntext)))
-    world.add(Sphere(Vec3(0, 2, 0), 2, Lambertian(ntext)))
-    world.add(
-        Quad(Vec3(3, 1, -2), Vec3(2, 0, 0), Vec3(0, 2, 0), DiffuseLight(Vec3(4, 4, 4)))
-    )
-    cam = Camera(
-        vfov=10,
-        samples_per_pixel=100,
-        image_width=400,
-        background=Vec3(0, 0, 0),
-        lookfrom=Vec3(26, 3, 6),
-        lookat=Vec3(0, 2, 0),
-    )
-    cam.render(world)
-
-
-def render_simple_light_2():
-    world = HittableList()
-    ntext = Noise(scale=4, mode="sine", turb_depth=4, albedo=Vec3(1, 1, 1))
-    world.add(Sphere(Vec3(0, -1000, 0), 1000, Lambertian(ntext)))
-    world.add(Sphere(Vec3(0, 2, 0), 2, Lambertian(ntext)))
-    world.add(Sphere(Vec3(0, 7, 0), 2, DiffuseLight(Vec3(4, 4, 4))))
-    world.add(
-        Quad(Vec3(3, 1, -2), Vec3(2, 0, 0), Vec3(0, 2, 0), DiffuseLight(Vec3(4, 4, 4)))
-    )
-    cam = Camera(
-        vfov=20,
-        samples_per_pixel=100,
-        image_width=400,
-        background=Vec3(0, 0, 0),
-        lookfrom=Vec3(26, 3, 6),
-        lookat=Vec3(0, 2, 0),
-    )
-    cam.render(world)
-
-
-def render_textured_light():
-    world = HittableList()
-    world.add(Sphere(Vec3(0, 2, 0), 2, DiffuseLight(Image("wah-01.png"), 4)))
-    world.add(Sphere(Vec3(0, -1000, 0), 1000, Lambertian(Vec3(1, 1, 1))))
-    cam = Camera(
-        vfov=20,
-        samples_per_pixel=100,
-        image_width=400,
-        lookfrom=Vec3(26, 3, 6),
-        background=Vec3(0.00, 0.0, 0.0),
-    )
-    cam.render(world)
 
+    def render():
+        cam.render(
+            world,
+            args.mode,
+            workers,
+            args.tile_size,
+            args.seed,
+            args.stats,
+            args.output,
+            args.format,
+            progress=not args.quiet,
+        )
 
-def main():
-    tp = sys.argv[-1]
-    if tp == "main":
-        render_main()
-    elif tp == "globe":
-        render_globe()
-    elif tp == "noise":
-        render_noise()
-    elif tp == "s":
-        render_s()
-    elif tp == "checkered":
-        render_checkered_balls()
-    elif tp == "quads":
-        render_quads()
-    elif tp == "simple_light":
-        render_simple_light()
-    elif tp == "simple_light2":
-        render_simple_light_2()
-    elif tp == "textured_light":
-        render_textured_light()
+    if args.profile is None:
+        render()
+        return
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    profile.runcall(render)
+    if args.profile == "-":
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        stats.sort_stats("cumulative").print_stats(25)
     else:
-        raise ValueError("unknown:", tp)
+        profile.dump_stats(args.profile)
 
 
 if __name__ == "__main__":
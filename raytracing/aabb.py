@@ -1,5 +1,4 @@
 from . import interval
-import sys
 
 
 class AABB:
@@ -8,6 +7,7 @@ class AABB:
         self.y = y
         self.z = z
         self.axes = [x, y, z]
+        self.bounds = (x.start, y.start, z.start, x.end, y.end, z.end)
 
     def __getitem__(self, i):
         return self.axes[i]
@@ -45,27 +45,50 @@ class AABB:
             interval.Interval.empty, interval.Interval.empty, interval.Interval.empty
         )
 
+    def pad(self, delta):
+        return AABB(
+            *(ax if ax.size() >= delta else ax.expand(delta) for ax in self.axes)
+        )
+
     def hit(self, ray, ray_tmin, ray_tmax):
-        ray_orig, ray_dir = ray.origin, ray.dir
-        intervals = (self.x, self.y, self.z)
-        for axis in range(3):
-            ax = intervals[axis]
-            adi = 1 / ray_dir[axis]
-            t0 = (ax.start - ray_orig[axis]) * adi
-            t1 = (ax.end - ray_orig[axis]) * adi
-            if t0 < t1:
-                if t0 > ray_tmin:
-                    ray_tmin = t0
-                if t1 < ray_tmax:
-                    ray_tmax = t1
-            else:
-                if t1 > ray_tmin:
-                    ray_tmin = t1
-                if t0 < ray_tmax:
-                    ray_tmax = t0
-            if ray_tmax <= ray_tmin:
-                return False
-        return True
+        return self.entry(ray, ray_tmin, ray_tmax) is not None
+
+    def entry(self, ray, ray_tmin, ray_tmax):
+        b = self.bounds
+        o = ray.origin
+        ix, iy, iz = ray.inv_dir
+        nx, ny, nz = ray.near
+        fx, fy, fz = ray.far
+        t = (b[nx] - o.x) * ix
+        if t > ray_tmin:
+            ray_tmin = t
+        t = (b[fx] - o.x) * ix
+        if t < ray_tmax:
+            ray_tmax = t
+        if ray_tmax <= ray_tmin:
+            return None
+        t = (b[ny] - o.y) * iy
+        if t > ray_tmin:
+            ray_tmin = t
+        t = (b[fy] - o.y) * iy
+        if t < ray_tmax:
+            ray_tmax = t
+        if ray_tmax <= ray_tmin:
+            return None
+        t = (b[nz] - o.z) * iz
+        if t > ray_tmin:
+            ray_tmin = t
+        t = (b[fz] - o.z) * iz
+        if t < ray_tmax:
+            ray_tmax = t
+        if ray_tmax <= ray_tmin:
+            return None
+        return ray_tmin
+
+    def surface_area(self):
+        dx, dy, dz = (ax.size() for ax in self.axes)
+        return 2 * (dx * dy + dy * dz + dz * dx)
+
     def longest_axis(self):
         return max(range(3), key=self.axes.__getitem__)
        
@@ -0,0 +1,54 @@
+import numpy as np
+
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722])
+
+
+def render_tile(sample, tile, spp, threshold, min_spp=8, max_spp=None):
+    # sample(ii, jj, ss) returns one color per requested pixel sample, ss
+    # being the sample's index within its pixel
+    x0, y0, x1, y1 = tile
+    jj, ii = np.mgrid[y0:y1, x0:x1]
+    ii, jj = ii.ravel(), jj.ravel()
+    n = len(ii)
+    max_spp = max_spp or 4 * spp
+    min_spp = min(min_spp, max_spp)
+    budget = spp * n
+    count = np.zeros(n, int)
+    total = np.zeros((n, 3))
+    linear = np.zeros((n, 3))
+    lum_sum = np.zeros(n)
+    lum_sq = np.zeros(n)
+    active = np.arange(n)
+    err = np.full(n, np.inf)
+    while len(active) and budget > 0:
+        # the noisiest pixels get their samples first if the budget runs out
+        active = active[np.argsort(-err[active], kind="stable")]
+        take = np.minimum(min_spp, max_spp - count[active])
+        take = take[np.cumsum(take) <= max(budget, take[0])]
+        active = active[: len(take)]
+        pix = np.repeat(active, take)
+        first = count[active] - np.cumsum(take) + take
+        ss = np.repeat(first, take) + np.arange(len(pix))
+        colors = sample(ii[pix], jj[pix], ss)
+        # noise is judged on displayable values, so bright emitters don't dominate
+        lum = np.clip(colors, 0, 1) @ LUMINANCE
+        # clamped to framebuffer.DISPLAY like the samples of the other tiles
+        np.add.at(total, pix, np.clip(colors, 0, 0.999))
+        np.add.at(linear, pix, colors)
+        np.add.at(lum_sum, pix, lum)
+        np.add.at(lum_sq, pix, lum * lum)
+        count[active] += take
+        budget -= take.sum()
+
+        c = count[active]
+        mean = lum_sum[active] / c
+        var = np.maximum(lum_sq[active] - c * mean * mean, 0) / np.maximum(c - 1, 1)
+        err[active] = np.sqrt(var / c) / np.sqrt(np.maximum(mean, 0.01))
+        active = active[(err[active] > threshold) & (c < max_spp)]
+    shape = (y1 - y0, x1 - x0)
+    n = np.maximum(count, 1)[:, None]
+    return (
+        (total / n).reshape(*shape, 3),
+        (linear / n).reshape(*shape, 3),
+        count.reshape(shape),
+    )
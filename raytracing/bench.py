@@ -0,0 +1,642 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+from . import bvh, shapes
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def node_boxes(tree):
+    boxes, stack = [], [tree]
+    while stack:
+        node = stack.pop()
+        boxes.append(node.bbox)
+        if node.prims is None:
+            stack.extend(c for c in (node.left, node.right) if isinstance(c, bvh.BVH))
+    return boxes
+
+
+def us_per_ray(world, rays):
+    inf = float("inf")
+    rec = shapes.HitResult()
+    elapsed = best_of(lambda: [world.hit(r, 0.001, inf, rec) for r in rays])
+    return elapsed / len(rays) * 1e6
+
+
+def bench_slab(rays=2000, seed=0, cloud=5000):
+    from .scenes import main_scene
+    from . import ray, vec3
+
+    random.seed(seed)
+    cam, world = main_scene()
+    tree = bvh.BVH.from_hittable_list(world)
+    flat = tree.compile()
+    boxes = node_boxes(tree)
+    pixels = [(random.randrange(cam.iw), random.randrange(cam.ih)) for _ in range(rays)]
+    camera_rays = []
+    for i, j in pixels:
+        cam.sampler.start(i, j, 0)
+        camera_rays.append(cam.get_ray(i, j))
+    inf = float("inf")
+
+    def box_tests():
+        for r in camera_rays:
+            for box in boxes:
+                box.hit(r, 0.001, inf)
+
+    # the main scene's tree is shallow; a cloud of small spheres gives one
+    # deep enough for the traversal to dominate
+    spheres = shapes.HittableList()
+    for _ in range(cloud):
+        center = vec3.Vec3(*(random.uniform(-50, 50) for _ in range(3)))
+        spheres.add(shapes.Sphere(center, 0.5, None))
+    cloud_tree = bvh.BVH.from_hittable_list(spheres)
+    origin = vec3.Vec3(0, 0, 100)
+    cloud_rays = []
+    for _ in range(rays):
+        x, y = random.uniform(-0.5, 0.5), random.uniform(-0.5, 0.5)
+        cloud_rays.append(ray.Ray(origin, vec3.Vec3(x, y, -1)))
+    return {
+        "ns_per_box_test": best_of(box_tests)
+        / (len(camera_rays) * len(boxes))
+        * 1e9,
+        "us_per_ray_bvh": us_per_ray(tree, camera_rays),
+        "us_per_ray_flat_bvh": us_per_ray(flat, camera_rays),
+        "us_per_ray_cloud_bvh": us_per_ray(cloud_tree, cloud_rays),
+        "us_per_ray_cloud_flat_bvh": us_per_ray(cloud_tree.compile(), cloud_rays),
+    }
+
+
+def count_allocations(fn, classes):
+    # counts constructor calls of the given classes while fn runs
+    codes = {cls.__init__.__code__: cls.__name__ for cls in classes}
+    counts = dict.fromkeys(codes.values(), 0)
+
+    def profile(frame, event, arg):
+        if event == "call" and frame.f_code in codes:
+            counts[codes[frame.f_code]] += 1
+
+    sys.setprofile(profile)
+    try:
+        fn()
+    finally:
+        sys.setprofile(None)
+    return counts
+
+
+def bench_alloc(pixels=200, seed=0):
+    from .scenes import main_scene
+    from . import ray, vec3
+
+    random.seed(seed)
+    cam, world = main_scene()
+    world = bvh.BVH.from_hittable_list(world)
+    coords = [(random.randrange(cam.iw), random.randrange(cam.ih)) for _ in range(pixels)]
+    counts = count_allocations(
+        lambda: [cam.pixel_color(world, i, j) for i, j in coords],
+        (vec3.Vec3, ray.Ray, shapes.HitResult),
+    )
+    rays = counts["Ray"]
+    return {
+        "rays": rays,
+        "vec3_per_ray": counts["Vec3"] / rays,
+        "hit_results_per_ray": counts["HitResult"] / rays,
+        "us_per_ray": best_of(
+            lambda: [cam.pixel_color(world, i, j) for i, j in coords], 3
+        )
+        / rays
+        * 1e6,
+    }
+
+
+def convergence(render, reference, tolerance, max_spp, seed=1):
+    # rms error of render(spp, seed) against reference at 1 spp, and the spp
+    # at which it first falls within tolerance, doubling spp from 1; None if
+    # it doesn't by max_spp
+    import numpy as np
+
+    spp, previous = 1, None
+    while True:
+        rms = float(np.sqrt(np.mean((render(spp, seed) - reference) ** 2)))
+        if spp == 1:
+            first = rms
+        if rms <= tolerance or spp >= max_spp:
+            break
+        spp, previous = spp * 2, rms
+    if rms > tolerance:
+        return first, None
+    if previous is not None:
+        # interpolate between the last two powers of two on a log-log scale
+        slope = math.log(previous / tolerance) / math.log(previous / rms)
+        spp = spp / 2 * 2**slope
+    return first, spp
+
+
+def display(image):
+    import numpy as np
+
+    return np.sqrt(np.clip(image, 0, 1))
+
+
+def bench_mip(width=128, reference_spp=256, tolerance=0.02, seed=0):
+    # spp needed before the globe is within tolerance (rms, gamma corrected)
+    # of a reference render with the same filtering at reference_spp
+    from .scenes import globe_scene
+
+    def render(filtering):
+        def render_at(spp, seed):
+            cam, world = globe_scene(
+                image_width=width, samples_per_pixel=spp, texture_filtering=filtering
+            )
+            return display(cam.render_tiles(world, "wavefront", seed=seed).image())
+
+        return render_at
+
+    result = {}
+    for filtering, name in ((False, "nearest"), (True, "mip")):
+        reference = render(filtering)(reference_spp, seed)
+        rms, spp = convergence(
+            render(filtering), reference, tolerance, reference_spp // 4, seed + 1
+        )
+        result[f"rms_1spp_{name}"] = rms
+        result[f"spp_to_converge_{name}"] = spp
+    return result
+
+
+def bench_nee(width=96, reference_spp=2048, tolerance=0.05, seed=0):
+    # spp the light scenes need to get within tolerance of a converged
+    # render, with and without light sampling
+    from . import scenes
+
+    result = {}
+    for scene in ("simple_light", "textured_light"):
+
+        def render(light_sampling):
+            def render_at(spp, seed):
+                # the noise textures are drawn from the global random state
+                random.seed(0)
+                cam, world = scenes.SCENES[scene](
+                    image_width=width,
+                    samples_per_pixel=spp,
+                    light_sampling=light_sampling,
+                )
+                return display(cam.render_tiles(world, "wavefront", seed=seed).image())
+
+            return render_at
+
+        reference = render(True)(reference_spp, seed)
+        for light_sampling, name in ((False, "bsdf"), (True, "nee")):
+            rms, spp = convergence(
+                render(light_sampling), reference, tolerance, reference_spp, seed + 1
+            )
+            result[f"{scene}.rms_1spp_{name}"] = rms
+            result[f"{scene}.spp_to_converge_{name}"] = spp
+        bsdf = result[f"{scene}.spp_to_converge_bsdf"]
+        nee = result[f"{scene}.spp_to_converge_nee"]
+        if bsdf and nee:
+            result[f"{scene}.spp_saved"] = 1 - nee / bsdf
+    return result
+
+
+def bench_samplers(width=64, reference_spp=1024, tolerance=0.04, seed=0):
+    # spp the main scene needs with each sampler to get within tolerance of a
+    # converged render; the reference is traced wavefront, which doesn't use
+    # the samplers, but converges to the same image
+    from . import samplers
+    from .scenes import main_scene
+
+    def build(spp, **cam):
+        random.seed(seed)
+        cam, world = main_scene(image_width=width, samples_per_pixel=spp, **cam)
+        return cam, bvh.BVH.from_hittable_list(world)
+
+    cam, world = build(reference_spp)
+    reference = display(cam.render_tiles(world, "wavefront", seed=seed).image())
+    result = {}
+    for name in samplers.SAMPLERS:
+        spent = [0, 0.0]
+
+        def render_at(spp, seed):
+            cam, world = build(spp, sampler=name)
+            start = time.perf_counter()
+            image = cam.render_tiles(world, seed=seed).image()
+            spent[0] += cam.iw * cam.ih * spp
+            spent[1] += time.perf_counter() - start
+            return display(image)
+
+        rms, spp = convergence(render_at, reference, tolerance, 128, seed + 1)
+        result[f"rms_1spp_{name}"] = rms
+        result[f"spp_to_converge_{name}"] = spp
+        result[f"us_per_sample_{name}"] = spent[1] / spent[0] * 1e6
+    return result
+
+
+def bench_denoise(width=160, spp=10, reference_spp=512, seed=0):
+    # rms error of a render at spp, of the same render denoised and of one
+    # at 10 times the spp, against a converged render
+    import numpy as np
+    from . import scenes
+
+    def render(scene, spp, seed):
+        random.seed(0)
+        cam, world = scenes.SCENES[scene](
+            image_width=width, samples_per_pixel=spp, aovs=True
+        )
+        return cam.render_tiles(world, "wavefront", seed=seed)
+
+    def rms(image, reference):
+        return float(np.sqrt(np.mean((display(image) - reference) ** 2)))
+
+    result = {}
+    for scene in ("simple_light", "noise"):
+        reference = display(render(scene, reference_spp, seed).image())
+        fb = render(scene, spp, seed + 1)
+        start = time.perf_counter()
+        denoised = fb.denoised().image()
+        result[f"{scene}.denoise_s"] = time.perf_counter() - start
+        result[f"{scene}.rms"] = rms(fb.image(), reference)
+        result[f"{scene}.rms_denoised"] = rms(denoised, reference)
+        result[f"{scene}.rms_10x_spp"] = rms(
+            render(scene, 10 * spp, seed + 2).image(), reference
+        )
+    return result
+
+
+def bench_roulette(width=96, spp=16, seed=0):
+    # path length and render time on the main scene with paths running to
+    # max_bounces and with russian roulette; the mean brightness should agree
+    from . import stats
+    from .scenes import main_scene
+
+    result = {}
+    for depth, name in ((None, "fixed"), (3, "roulette")):
+        random.seed(seed)
+        cam, world = main_scene(
+            image_width=width, samples_per_pixel=spp, roulette_depth=depth
+        )
+        world = bvh.BVH.from_hittable_list(world)
+        start = time.perf_counter()
+        image = cam.render_tiles(world, seed=seed).image()
+        result[f"render_s_{name}"] = time.perf_counter() - start
+        with stats.collect() as st:
+            cam.render_tiles(world, seed=seed)
+        result[f"path_length_{name}"] = sum(st.rays) / st.rays[0]
+        result[f"max_path_length_{name}"] = len(st.rays)
+        result[f"mean_{name}"] = float(image.mean())
+    return result
+
+
+def write_sphere_obj(path, rows):
+    # a unit sphere of 2 * rows by rows quads, with uvs and normals
+    import numpy as np
+
+    theta, phi = np.meshgrid(
+        np.linspace(0, np.pi, rows + 1), np.linspace(0, 2 * np.pi, 2 * rows + 1)
+    )
+    normals = np.stack(
+        (np.sin(theta) * np.cos(phi), np.cos(theta), np.sin(theta) * np.sin(phi)),
+        axis=-1,
+    ).reshape(-1, 3)
+    uvs = np.stack((phi / (2 * np.pi), 1 - theta / np.pi), axis=-1).reshape(-1, 2)
+    i = np.arange(len(normals)).reshape(theta.shape) + 1
+    quads = np.stack((i[:-1, :-1], i[:-1, 1:], i[1:, 1:], i[1:, :-1]), axis=-1)
+    with open(path, "w") as f:
+        np.savetxt(f, normals, "v %.6f %.6f %.6f")
+        np.savetxt(f, uvs, "vt %.6f %.6f")
+        np.savetxt(f, normals, "vn %.6f %.6f %.6f")
+        np.savetxt(
+            f, np.repeat(quads.reshape(-1, 4), 3, axis=1), "f" + " %d/%d/%d" * 4
+        )
+
+
+def bench_mesh(triangles=(4_000, 100_000, 1_000_000), rays=5000, seed=0):
+    # loads tessellated spheres from OBJ files and traces rays at them; the
+    # bytes per triangle should stay flat and the time per ray grow slowly
+    import os
+    import tempfile
+    from . import mesh, ray, vec3
+
+    random.seed(seed)
+    rays = [
+        ray.Ray(
+            vec3.Vec3(0, 0, 4),
+            vec3.Vec3(random.uniform(-0.3, 0.3), random.uniform(-0.3, 0.3), -1),
+        )
+        for _ in range(rays)
+    ]
+    rec = shapes.HitResult()
+    inf = float("inf")
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for n in triangles:
+            path = os.path.join(directory, f"{n}.obj")
+            write_sphere_obj(path, max(round(math.sqrt(n / 4)), 2))
+            start = time.perf_counter()
+            m = mesh.load_obj(path, None)
+            result[f"load_s_{n}"] = time.perf_counter() - start
+            result[f"triangles_{n}"] = len(m)
+            result[f"bytes_per_triangle_{n}"] = m.nbytes() / len(m)
+            result[f"us_per_ray_{n}"] = (
+                best_of(lambda: [m.hit(r, 0.001, inf, rec) for r in rays], 3)
+                / len(rays)
+                * 1e6
+            )
+    return result
+
+
+def bench_instances(copies=100_000, triangles=20_000, rays=2000, seed=0):
+    # copies of one mesh on a grid, randomly turned and sized, against the
+    # mesh alone; the copies should add little memory next to the mesh
+    import os
+    import tempfile
+    import numpy as np
+    from . import instance, mesh, ray, vec3
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sphere.obj")
+        write_sphere_obj(path, max(round(math.sqrt(triangles / 4)), 2))
+        model = mesh.load_obj(path, None)
+    rng = np.random.default_rng(seed)
+    side = math.ceil(math.sqrt(copies))
+    transforms = [
+        instance.translate(3 * (i % side), 0, -3 * (i // side))
+        @ instance.rotate(rng.standard_normal(3), rng.uniform(0, 360))
+        @ instance.scale(rng.uniform(0.5, 1.2))
+        for i in range(copies)
+    ]
+    start = time.perf_counter()
+    copies = instance.Instances(model, transforms)
+    build = time.perf_counter() - start
+    random.seed(seed)
+    origin = vec3.Vec3(1.5 * side, 20, 10)
+    rays = [
+        ray.Ray(
+            origin,
+            vec3.Vec3(
+                random.uniform(-0.5, 0.5) * side,
+                -20,
+                -random.uniform(0, 1.5) * side - 10,
+            ),
+        )
+        for _ in range(rays)
+    ]
+    one = instance.Instance(model, instance.translate(0, 0, 0))
+    single = [
+        ray.Ray(vec3.Vec3(0, 0, 4), r.dir * (1 / r.dir.length) + vec3.Vec3(0, 0, -1))
+        for r in rays
+    ]
+    rec = shapes.HitResult()
+    inf = float("inf")
+    return {
+        "mesh_mb": model.nbytes() / 2**20,
+        "instances_mb": copies.nbytes() / 2**20,
+        "bytes_per_instance": copies.nbytes() / len(copies),
+        "build_s": build,
+        "us_per_ray_one": best_of(
+            lambda: [one.hit(r, 0.001, inf, rec) for r in single], 3
+        )
+        / len(rays)
+        * 1e6,
+        "us_per_ray_all": best_of(
+            lambda: [copies.hit(r, 0.001, inf, rec) for r in rays], 3
+        )
+        / len(rays)
+        * 1e6,
+        "hit_fraction": sum(copies.hit(r, 0.001, inf, rec)[0] for r in rays)
+        / len(rays),
+    }
+
+
+def bench_scene_cache(scenes=("main", "quads", "simple_light"), triangles=1_000_000):
+    # building scenes against loading them from the scene cache, and a large
+    # mesh parsed from OBJ against loading it mapped from the cache
+    import os
+    import tempfile
+    from . import mesh, scenecache
+
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in scenes:
+            start = time.perf_counter()
+            scenecache.scene(name, cache_dir=directory)
+            result[f"build_ms_{name}"] = (time.perf_counter() - start) * 1e3
+            result[f"load_ms_{name}"] = (
+                best_of(lambda: scenecache.scene(name, cache_dir=directory)) * 1e3
+            )
+        path = os.path.join(directory, "sphere.obj")
+        write_sphere_obj(path, max(round(math.sqrt(triangles / 4)), 2))
+        start = time.perf_counter()
+        m = mesh.load_obj(path, None)
+        result["build_ms_mesh"] = (time.perf_counter() - start) * 1e3
+        cached = os.path.join(directory, "mesh")
+        scenecache.save(cached, m, {}, {})
+        result["load_ms_mesh"] = best_of(lambda: scenecache.load(cached)) * 1e3
+    return result
+
+
+@contextlib.contextmanager
+def timed_calls(cls, name, totals):
+    # adds the time spent in cls.name to totals[0] while active
+    fn = vars(cls)[name]
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            totals[0] += time.perf_counter() - start
+
+    setattr(cls, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(cls, name, fn)
+
+
+def run_scene(name, width, spp, seed, mode="scalar", use_bvh=True, count_rays=True):
+    from . import scenes, stats, texture
+
+    random.seed(seed)
+    texture_load = [0.0]
+    start = time.perf_counter()
+    with timed_calls(texture.Image, "__init__", texture_load), timed_calls(
+        texture.Noise, "__init__", texture_load
+    ):
+        cam, world = scenes.SCENES[name](image_width=width, samples_per_pixel=spp)
+    scene_build = time.perf_counter() - start - texture_load[0]
+
+    start = time.perf_counter()
+    if use_bvh and isinstance(world, shapes.HittableList):
+        world = bvh.BVH.from_hittable_list(world)
+    bvh_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cam.render_tiles(world, mode, seed=seed)
+    render = time.perf_counter() - start
+    samples = int(cam.spp_map.sum())
+    result = {
+        "width": cam.iw,
+        "height": cam.ih,
+        "spp": spp,
+        "scene_build_s": scene_build,
+        "texture_load_s": texture_load[0],
+        "bvh_build_s": bvh_build,
+        "render_s": render,
+        "samples_per_second": samples / render,
+    }
+    if count_rays:
+        # the same seeded render again, counted; its timing is not used
+        with stats.collect() as st:
+            cam.render_tiles(world, mode, seed=seed)
+        # camera and bounce rays and next event estimation's shadow rays
+        result["rays"] = sum(st.rays) + st.shadow_rays
+        result["shadow_rays"] = st.shadow_rays
+        result["rays_per_second"] = result["rays"] / render
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_suite(names, width, spp, seed, mode="scalar", use_bvh=True, count_rays=True):
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "width": width,
+            "spp": spp,
+            "seed": seed,
+            "mode": mode,
+            "bvh": use_bvh,
+        },
+        "scenes": {},
+    }
+    # a fresh process per scene keeps peak memory figures separate
+    ctx = multiprocessing.get_context("spawn")
+    for name in names:
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=ctx) as pool:
+            results["scenes"][name] = pool.submit(
+                run_scene, name, width, spp, seed, mode, use_bvh, count_rays
+            ).result()
+    return results
+
+
+# metric: (sign of an improvement, smallest absolute change worth flagging)
+METRICS = {
+    "render_s": (-1, 0.05),
+    "bvh_build_s": (-1, 0.05),
+    "texture_load_s": (-1, 0.05),
+    "scene_build_s": (-1, 0.05),
+    "peak_rss_mb": (-1, 5),
+    "samples_per_second": (1, 0),
+    "rays_per_second": (1, 0),
+}
+
+
+def compare(results, previous, tolerance=0.1):
+    regressions = []
+    for name, res in results["scenes"].items():
+        old = previous["scenes"].get(name)
+        if old is None:
+            continue
+        for metric, (sign, floor) in METRICS.items():
+            a, b = old.get(metric), res.get(metric)
+            if not a or b is None or abs(b - a) <= floor:
+                continue
+            change = (b - a) / a
+            if change * sign < -tolerance:
+                regressions.append((name, metric, a, b, change))
+    return regressions
+
+
+BENCHMARKS = {
+    "slab": bench_slab,
+    "alloc": bench_alloc,
+    "mip": bench_mip,
+    "nee": bench_nee,
+    "roulette": bench_roulette,
+    "denoise": bench_denoise,
+    "samplers": bench_samplers,
+    "mesh": bench_mesh,
+    "instances": bench_instances,
+    "scene_cache": bench_scene_cache,
+}
+
+
+def main():
+    from . import scenes
+
+    parser = argparse.ArgumentParser(prog="python -m raytracing.bench")
+    names = ["suite", *sorted(BENCHMARKS)]
+    parser.add_argument(
+        "benchmarks", nargs="*", help=f"suite, the default, or {', '.join(names[1:])}"
+    )
+    parser.add_argument("--scenes", nargs="+", default=list(scenes.SCENES))
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--spp", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", default="scalar")
+    parser.add_argument("--no-bvh", action="store_true")
+    parser.add_argument("--no-ray-count", action="store_true")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="previous results JSON to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    # argparse's choices would reject an empty list of them
+    for name in args.benchmarks:
+        if name not in names:
+            parser.error(f"unknown benchmark {name!r}, pick from {', '.join(names)}")
+
+    for name in args.benchmarks:
+        if name == "suite":
+            continue
+        for key, value in BENCHMARKS[name]().items():
+            print(f"{name}.{key}: {'-' if value is None else f'{value:.4g}'}")
+    if args.benchmarks and "suite" not in args.benchmarks:
+        return
+
+    results = run_suite(
+        args.scenes,
+        args.width,
+        args.spp,
+        args.seed,
+        args.mode,
+        not args.no_bvh,
+        not args.no_ray_count,
+    )
+    for name, res in results["scenes"].items():
+        print(
+            f"{name}: render {res['render_s']:.2f}s,"
+            f" {res.get('rays_per_second', res['samples_per_second']):.0f}"
+            f" {'rays' if 'rays_per_second' in res else 'samples'}/s,"
+            f" bvh {res['bvh_build_s']:.3f}s, textures {res['texture_load_s']:.3f}s,"
+            f" peak {res['peak_rss_mb']:.0f} MB"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, metric, a, b, change in regressions:
+            print(f"REGRESSION {name}.{metric}: {a:.4g} -> {b:.4g} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,535 @@
-from . import aabb, shapes, randfloat
-import sys
+from . import aabb, shapes
+import numpy as np
+
+TRAVERSAL_COST = 1
+INTERSECT_COST = 1
+# build_flat grows thinner boxes to this, as Quad pads its box, since the
+# slab test misses boxes of zero thickness
+PAD = 1e-4
+# most nodes build_flat splits together, which bounds the memory their bins take
+BATCH = 2**14
+
 
 class BVH(shapes.Hittable):
-    def __init__(self, objects, start, end):
-        self.obj=objects
-        self.start=start
-        self.end=end
+    def __init__(self, objects, start, end, split="sah", max_leaf_size=4, bins=12):
+        self.obj = objects
+        self.start = start
+        self.end = end
+        self.prims = None
+        self.axis = 0
         self.bbox = aabb.AABB.empty()
         for i in objects[start:end]:
-            self.bbox=aabb.AABB.merge(self.bbox,i.bounding_box())
+            self.bbox = aabb.AABB.merge(self.bbox, i.bounding_box())
 
-        axis = self.bbox.longest_axis()
-        comparator = self.box_compare(axis)
         length = end - start
-        if length == 1:
-            self.left = self.right = self.obj[start]
-        elif length == 2:
-            self.left = self.obj[start]
-            self.right = self.obj[start + 1]
+        if split == "median":
+            axis = self.axis = self.bbox.longest_axis()
+            if length == 1:
+                self.left = self.right = self.obj[start]
+            elif length == 2:
+                self.left = self.obj[start]
+                self.right = self.obj[start + 1]
+            else:
+                sort_slice(self.obj, start, end, self.box_compare(axis))
+                mid = start + length // 2
+                self.left = BVH(self.obj, start, mid, split)
+                self.right = BVH(self.obj, mid, end, split)
+        elif split == "sah":
+            mid = self.sah_split(max_leaf_size, bins)
+            if mid is None:
+                self.left = self.right = None
+                self.prims = self.obj[start:end]
+            else:
+                self.left = BVH(self.obj, start, mid, split, max_leaf_size, bins)
+                self.right = BVH(self.obj, mid, end, split, max_leaf_size, bins)
         else:
-            self.obj.sort(key=comparator)
-            mid = start + length // 2
-            self.left = BVH(self.obj, start, mid)
-            self.right = BVH(self.obj, mid, end)
-        #self.bbox = aabb.AABB.merge(self.left.bounding_box(), self.right.bounding_box())
+            raise ValueError(f"unknown BVH split: {split}")
+
     @classmethod
-    def from_hittable_list(cls, hl):
-        return cls(hl.hittables, 0, len(hl))
+    def from_hittable_list(cls, hl, **kwargs):
+        return cls(hl.hittables, 0, len(hl), **kwargs)
+
+    def sah_split(self, max_leaf_size, bins):
+        # returns the index to split the slice at, or None to make a leaf
+        start, end = self.start, self.end
+        length = end - start
+        if length == 1:
+            return None
+        objs = self.obj[start:end]
+        boxes = [o.bounding_box() for o in objs]
+        centroids = [[b[axis].start + b[axis].end for axis in range(3)] for b in boxes]
+        parent_area = self.bbox.surface_area()
+        leaf_cost = length * INTERSECT_COST
+        best = None
+        for axis in range(3):
+            lo = min(c[axis] for c in centroids)
+            hi = max(c[axis] for c in centroids)
+            if hi <= lo:
+                continue
+            scale = bins / (hi - lo)
+            binned = [min(int((c[axis] - lo) * scale), bins - 1) for c in centroids]
+            bin_boxes = [aabb.AABB.empty() for _ in range(bins)]
+            bin_counts = [0] * bins
+            for b, box in zip(binned, boxes):
+                bin_boxes[b] = aabb.AABB.merge(bin_boxes[b], box)
+                bin_counts[b] += 1
+            # sweep from the right to get the area and count right of each plane
+            right_area, right_count = [0] * bins, [0] * bins
+            box, count = aabb.AABB.empty(), 0
+            for b in range(bins - 1, 0, -1):
+                box = aabb.AABB.merge(box, bin_boxes[b])
+                count += bin_counts[b]
+                right_area[b], right_count[b] = box.surface_area(), count
+            box, count = aabb.AABB.empty(), 0
+            for b in range(1, bins):
+                box = aabb.AABB.merge(box, bin_boxes[b - 1])
+                count += bin_counts[b - 1]
+                if not count or not right_count[b]:
+                    continue
+                cost = TRAVERSAL_COST + INTERSECT_COST * (
+                    box.surface_area() * count + right_area[b] * right_count[b]
+                ) / max(parent_area, 1e-300)
+                if best is None or cost < best[0]:
+                    best = cost, axis, b, binned
+        if best is None:
+            # every centroid coincides, so no plane separates them
+            if length <= max_leaf_size:
+                return None
+            return start + length // 2
+        cost, self.axis, split_bin, binned = best
+        if length <= max_leaf_size and leaf_cost <= cost:
+            return None
+        left = [o for o, b in zip(objs, binned) if b < split_bin]
+        right = [o for o, b in zip(objs, binned) if b >= split_bin]
+        self.obj[start:end] = left + right
+        return start + len(left)
+
+    def compile(self):
+        return FlatBVH.from_bvh(self)
 
-    def _hit(self, ray, ray_tmin, ray_tmax):
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
         if not self.bbox.hit(ray, ray_tmin, ray_tmax):
-            return (False,)
-        hit_left, *hr = self.left._hit(ray, ray_tmin, ray_tmax)
-        hit_right, *hr2 = self.right._hit(
-            ray, ray_tmin, hr[2] if hit_left else ray_tmax
+            return False
+        if self.prims is not None:
+            hit_anything = False
+            for prim in self.prims:
+                if prim._hit(ray, ray_tmin, ray_tmax, rec):
+                    hit_anything = True
+                    ray_tmax = rec.t
+            return hit_anything
+        hit_left = self.left._hit(ray, ray_tmin, ray_tmax, rec)
+        hit_right = self.right._hit(
+            ray, ray_tmin, rec.t if hit_left else ray_tmax, rec
         )
-        if hit_right:
-            return True, *hr2
-        return (hit_left or hit_right), *hr
+        return hit_left or hit_right
 
     def bounding_box(self):
         return self.bbox
 
     def box_compare(self, axis):
         return lambda a: a.bounding_box()[axis].start
+
+    def expected_cost(self, root_area=None):
+        # SAH estimate: each node is visited with probability area / root area
+        # and costs one box test plus one test per primitive it holds directly
+        root_area = root_area or max(self.bbox.surface_area(), 1e-300)
+        if self.prims is not None:
+            children, direct = (), len(self.prims)
+        else:
+            children = {id(c): c for c in (self.left, self.right)}.values()
+            direct = sum(not isinstance(c, BVH) for c in children)
+        cost = (self.bbox.surface_area() / root_area) * (
+            TRAVERSAL_COST + direct * INTERSECT_COST
+        )
+        for child in children:
+            if isinstance(child, BVH):
+                cost += child.expected_cost(root_area)
+        return cost
+
+    def cost_report(self):
+        nodes = leaves = max_depth = max_leaf = 0
+        stack = [(self, 1)]
+        while stack:
+            node, depth = stack.pop()
+            nodes += 1
+            max_depth = max(max_depth, depth)
+            if node.prims is not None:
+                leaves += 1
+                max_leaf = max(max_leaf, len(node.prims))
+                continue
+            children = {id(c): c for c in (node.left, node.right)}.values()
+            for child in children:
+                if isinstance(child, BVH):
+                    stack.append((child, depth + 1))
+                else:
+                    leaves += 1
+                    max_leaf = max(max_leaf, 1)
+        return {
+            "nodes": nodes,
+            "leaves": leaves,
+            "max_depth": max_depth,
+            "max_leaf_size": max_leaf,
+            "expected_cost": self.expected_cost(),
+        }
+
+
+class FlatTree(shapes.Hittable):
+    # a BVH laid out as FlatBVH's, in _bounds, _offset, _count and _axis, whose
+    # leaves _leaf tests: it returns the t of the closest hit among the n
+    # primitives from first, having recorded it in rec, or None if none is
+    # closer than ray_tmax. FlatBVH, meshes and instances share the traversal
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
+        return self._traverse(ray, ray_tmin, ray_tmax, rec, None)
+
+    def _traverse(self, ray, ray_tmin, ray_tmax, rec, counters):
+        b, leaf = self._bounds, self._leaf
+        offset, count, axis = self._offset, self._count, self._axis
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        ix, iy, iz = ray.inv_dir
+        nx, ny, nz = ray.near
+        fx, fy, fz = ray.far
+        dir_neg = (ix < 0, iy < 0, iz < 0)
+        hit_anything = False
+        if counters is not None:
+            counters.box_tests += 1
+        t = self.bbox.entry(ray, ray_tmin, ray_tmax)
+        if t is None:
+            return False
+        # parallel stacks of the nodes to visit and where the ray enters them;
+        # the children's slab tests are AABB.entry inlined, a call per box
+        # costs more than the test
+        nodes, entries = [0], [t]
+        while nodes:
+            i = nodes.pop()
+            if entries.pop() >= ray_tmax:
+                continue
+            if counters is not None:
+                counters.bvh_nodes += 1
+            n = count[i]
+            if n:
+                t = leaf(ray, offset[i], n, ray_tmin, ray_tmax, rec, counters)
+                if t is not None:
+                    hit_anything, ray_tmax = True, t
+                continue
+            left, right = i + 1, offset[i]
+            if dir_neg[axis[i]]:
+                left, right = right, left
+            if counters is not None:
+                counters.box_tests += 2
+            k = 6 * left
+            tl, far = ray_tmin, ray_tmax
+            t = (b[k + nx] - ox) * ix
+            if t > tl:
+                tl = t
+            t = (b[k + fx] - ox) * ix
+            if t < far:
+                far = t
+            if tl < far:
+                t = (b[k + ny] - oy) * iy
+                if t > tl:
+                    tl = t
+                t = (b[k + fy] - oy) * iy
+                if t < far:
+                    far = t
+                if tl < far:
+                    t = (b[k + nz] - oz) * iz
+                    if t > tl:
+                        tl = t
+                    t = (b[k + fz] - oz) * iz
+                    if t < far:
+                        far = t
+            hit_left = tl < far
+            k = 6 * right
+            tr, far = ray_tmin, ray_tmax
+            t = (b[k + nx] - ox) * ix
+            if t > tr:
+                tr = t
+            t = (b[k + fx] - ox) * ix
+            if t < far:
+                far = t
+            if tr < far:
+                t = (b[k + ny] - oy) * iy
+                if t > tr:
+                    tr = t
+                t = (b[k + fy] - oy) * iy
+                if t < far:
+                    far = t
+                if tr < far:
+                    t = (b[k + nz] - oz) * iz
+                    if t > tr:
+                        tr = t
+                    t = (b[k + fz] - oz) * iz
+                    if t < far:
+                        far = t
+            # push the farther child first so the nearer one is popped next
+            if tr < far:
+                if hit_left and tr < tl:
+                    nodes += left, right
+                    entries += tl, tr
+                elif hit_left:
+                    nodes += right, left
+                    entries += tr, tl
+                else:
+                    nodes.append(right)
+                    entries.append(tr)
+            elif hit_left:
+                nodes.append(left)
+                entries.append(tl)
+        return hit_anything
+
+    def bounding_box(self):
+        return self.bbox
+
+
+
+class FlatBVH(FlatTree):
+    # nodes are stored depth first: an inner node's left child follows it
+    # directly and offset holds its right child, a leaf's offset and count
+    # address its run of primitives in prims
+    def __init__(self, bounds, offset, count, axis, prims):
+        self.bounds = bounds
+        self.offset = offset
+        self.count = count
+        self.axis = axis
+        self.prims = prims
+        self.bbox = aabb.AABB.from_points(*bounds[0].reshape(2, 3).tolist())
+        self.lists()
+
+    def lists(self):
+        # _traverse reads plain lists, rebuilt from the arrays after unpickling
+        self._bounds = self.bounds.ravel().tolist()
+        self._offset = self.offset.tolist()
+        self._count = self.count.tolist()
+        self._axis = self.axis.tolist()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lists()
+
+    @classmethod
+    def from_bvh(cls, root):
+        bounds, offset, count, axis, prims = [], [], [], [], []
+
+        def add(node):
+            i = len(offset)
+            box = node.bounding_box()
+            bounds.append([ax.start for ax in box.axes] + [ax.end for ax in box.axes])
+            offset.append(0)
+            count.append(0)
+            axis.append(0)
+            if not isinstance(node, BVH):
+                leaf = [node]
+            elif node.prims is not None:
+                leaf = node.prims
+            elif node.left is node.right:
+                leaf = [node.left]
+            else:
+                leaf = None
+            if leaf is not None:
+                offset[i] = len(prims)
+                count[i] = len(leaf)
+                prims.extend(leaf)
+                return
+            axis[i] = node.axis
+            add(node.left)
+            offset[i] = len(offset)
+            add(node.right)
+
+        add(root)
+        return cls(
+            np.array(bounds, float),
+            np.array(offset, np.int32),
+            np.array(count, np.int32),
+            np.array(axis, np.int8),
+            prims,
+        )
+
+    def _leaf(self, ray, first, n, ray_tmin, ray_tmax, rec, counters):
+        hit_anything = False
+        for prim in self.prims[first : first + n]:
+            if prim._hit(ray, ray_tmin, ray_tmax, rec):
+                hit_anything = True
+                ray_tmax = rec.t
+        return ray_tmax if hit_anything else None
+
+
+def sort_slice(objects, start, end, key):
+    objects[start:end] = sorted(objects[start:end], key=key)
+
+
+def flatten(world):
+    if isinstance(world, shapes.HittableList):
+        for hittable in world.hittables:
+            yield from flatten(hittable)
+    elif isinstance(world, (BVH, FlatBVH)) and world.prims is not None:
+        for prim in world.prims:
+            yield from flatten(prim)
+    elif isinstance(world, BVH):
+        yield from flatten(world.left)
+        if world.right is not world.left:
+            yield from flatten(world.right)
+    else:
+        yield world
+
+
+def build_flat(lo, hi, max_leaf_size=4, bins=12):
+    # a binned SAH tree over the boxes lo, hi, split like BVH.sah_split, but a
+    # whole level of nodes at a time so numpy does the work; returns FlatBVH's
+    # bounds, offset, count and axis arrays and the order the boxes end up in
+    thin = hi - lo < PAD
+    lo = np.where(thin, lo - PAD / 2, lo)
+    hi = np.where(thin, hi + PAD / 2, hi)
+    centroid = lo + hi
+    order = np.arange(len(lo))
+    # per level: the slices of order its nodes cover, their bounds, which are
+    # leaves, the axes they split on and where
+    levels = []
+    start, end = np.array([0]), np.array([len(lo)])
+    while len(start):
+        level = [
+            split_nodes(
+                lo,
+                hi,
+                centroid,
+                order,
+                start[b : b + BATCH],
+                end[b : b + BATCH],
+                max_leaf_size,
+                bins,
+            )
+            for b in range(0, len(start), BATCH)
+        ]
+        bounds, leaf, axis, mid = (np.concatenate(a) for a in zip(*level))
+        levels.append((start, end, bounds, leaf, axis))
+        # the children of each level's inner nodes make the next, in pairs
+        split = ~leaf
+        start, end = (
+            np.stack((start[split], mid[split]), axis=1).ravel(),
+            np.stack((mid[split], end[split]), axis=1).ravel(),
+        )
+    return flat_layout(levels) + (order,)
+
+
+def split_nodes(lo, hi, centroid, order, start, end, max_leaf_size, bins):
+    # splits the nodes covering order[start:end], moving the boxes of each
+    # left of its split; returns their bounds, which are leaves, and the axis
+    # and index of order they split at
+    k = len(start)
+    sizes = end - start
+    first = np.cumsum(sizes) - sizes
+    seg = np.repeat(np.arange(k), sizes)
+    rank = np.arange(len(seg)) - first[seg]
+    idx = order[start[seg] + rank]
+    box_lo, box_hi = lo[idx], hi[idx]
+    node_lo = np.minimum.reduceat(box_lo, first)
+    node_hi = np.maximum.reduceat(box_hi, first)
+    cost, axis, plane, binned = sah_split(
+        box_lo, box_hi, centroid[idx], seg, first, node_lo, node_hi, bins
+    )
+    # a node is a leaf where BVH.sah_split would return None
+    valid = np.isfinite(cost)
+    small = sizes <= max_leaf_size
+    leaf = (sizes == 1) | (~valid & small)
+    leaf |= small & valid & (sizes * INTERSECT_COST <= cost)
+    # the side of the plane each box goes, or of the middle where no plane
+    # separates the boxes
+    right = np.where(valid[seg], binned > plane[seg], rank >= sizes[seg] // 2)
+    right &= ~leaf[seg]
+    left = ~right
+    left_count = np.bincount(seg, left, minlength=k).astype(np.intp)
+    # each box's rank among its node's boxes on the same side, from how many
+    # boxes on that side come before it and before its node
+    lefts, rights = np.cumsum(left) - left, np.cumsum(right) - right
+    lefts -= lefts[first][seg]
+    rights -= rights[first][seg]
+    side_rank = np.where(left, lefts, left_count[seg] + rights)
+    order[start[seg] + side_rank] = idx
+    return (
+        np.hstack((node_lo, node_hi)),
+        leaf,
+        np.where(valid, axis, 0),
+        start + left_count,
+    )
+
+
+def flat_layout(levels):
+    # lays out nodes made a level at a time depth first, as FlatBVH does: an
+    # inner node's left child follows it directly, offset is its right
+    # child's index, and a leaf's offset and count its slice of order
+    subtree = [None] * len(levels)
+    below = None
+    for i in range(len(levels) - 1, -1, -1):
+        leaf = levels[i][3]
+        size = np.ones(len(leaf), np.intp)
+        if below is not None:
+            size[~leaf] += below[0::2] + below[1::2]
+        subtree[i] = below = size
+    total = int(subtree[0][0])
+    bounds = np.empty((total, 6))
+    offset = np.empty(total, np.int32)
+    count = np.zeros(total, np.int32)
+    axes = np.zeros(total, np.int8)
+    index = np.array([0])
+    for i, (start, end, node_bounds, leaf, axis) in enumerate(levels):
+        bounds[index] = node_bounds
+        axes[index] = axis
+        offset[index[leaf]] = start[leaf]
+        count[index[leaf]] = (end - start)[leaf]
+        if i + 1 < len(levels):
+            left = index[~leaf] + 1
+            right = left + subtree[i + 1][0::2]
+            offset[index[~leaf]] = right
+            index = np.stack((left, right), axis=1).ravel()
+    return bounds, offset, count, axes
+
+
+def sah_split(lo, hi, centroid, seg, first, node_lo, node_hi, bins):
+    # the cheapest plane between bins for each node, whose boxes are lo, hi
+    # where seg is its index, as cost, axis, the last bin left of it and the
+    # boxes' bins; as in pbrt only the axis the centroids spread most along
+    # is binned, and the cost is inf where no plane separates the boxes
+    k = len(first)
+    sizes = np.diff(np.append(first, len(seg)))
+    c_lo = np.minimum.reduceat(centroid, first)
+    extent = np.maximum.reduceat(centroid, first) - c_lo
+    ax = np.argmax(extent, axis=1)
+    rows = np.arange(k)
+    extent, c_lo = extent[rows, ax], c_lo[rows, ax]
+    scale = bins / np.where(extent > 0, extent, 1)
+    binned = (centroid[np.arange(len(seg)), ax[seg]] - c_lo[seg]) * scale[seg]
+    binned = np.minimum(binned.astype(np.intp), bins - 1)
+    key = seg * bins + binned
+    counts = np.bincount(key, minlength=k * bins).reshape(k, bins)
+    bin_lo = np.full((3, k * bins), np.inf)
+    bin_hi = np.full((3, k * bins), -np.inf)
+    for axis in range(3):
+        np.minimum.at(bin_lo[axis], key, lo[:, axis])
+        np.maximum.at(bin_hi[axis], key, hi[:, axis])
+    bin_lo = bin_lo.T.reshape(k, bins, 3)
+    bin_hi = bin_hi.T.reshape(k, bins, 3)
+    # the plane after bin p has bins [0, p] left of it and the rest right
+    left_lo = np.minimum.accumulate(bin_lo, axis=1)[:, :-1]
+    left_hi = np.maximum.accumulate(bin_hi, axis=1)[:, :-1]
+    right_lo = np.minimum.accumulate(bin_lo[:, ::-1], axis=1)[:, -2::-1]
+    right_hi = np.maximum.accumulate(bin_hi[:, ::-1], axis=1)[:, -2::-1]
+    left_count = np.cumsum(counts, axis=1)[:, :-1]
+    right_count = sizes[:, None] - left_count
+    parent_area = np.maximum(surface_area(node_lo, node_hi), 1e-300)
+    with np.errstate(invalid="ignore"):
+        cost = TRAVERSAL_COST + INTERSECT_COST * (
+            surface_area(left_lo, left_hi) * left_count
+            + surface_area(right_lo, right_hi) * right_count
+        ) / parent_area[:, None]
+    empty = (left_count == 0) | (right_count == 0)
+    cost[empty | (extent <= 0)[:, None]] = np.inf
+    plane = np.argmin(cost, axis=1)
+    return cost[rows, plane], ax, plane, binned
+
+
+def surface_area(lo, hi):
+    d = hi - lo
+    dx, dy, dz = d[..., 0], d[..., 1], d[..., 2]
+    return 2 * (dx * dy + dy * dz + dz * dx)
@@ -0,0 +1,97 @@
+import json
+import math
+import os
+import random
+import time
+from . import framebuffer
+
+STATE = "state.json"
+
+
+class Checkpoint:
+    # a render in progress: the accumulation buffer is memory mapped from
+    # directory and state.json records which tile jobs it already holds
+    def __init__(self, directory, fb, state):
+        self.directory = directory
+        self.fb = fb
+        self.state = state
+        self.done = set(state["done"])
+        self.pending = []
+        self.saved = time.monotonic()
+
+    @classmethod
+    def open(cls, directory, cam, mode, tile_size, seed=None):
+        path = os.path.join(directory, STATE)
+        expected = {
+            "width": cam.iw,
+            "height": cam.ih,
+            "samples_per_pixel": cam.samples_per_pixel,
+            "tile_size": tile_size,
+            "mode": mode,
+            "aovs": cam.aovs,
+        }
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            # state files from older or other versions may lack keys
+            if seed is not None:
+                expected["seed"] = seed
+            for key, value in expected.items():
+                if state.get(key) != value:
+                    raise ValueError(
+                        f"checkpoint {directory} has {key}={state.get(key)}, "
+                        f"not {value}"
+                    )
+            missing = {"seed", "passes", "done"} - state.keys()
+            if missing:
+                raise ValueError(
+                    f"checkpoint {directory} has no {', '.join(sorted(missing))}"
+                )
+        else:
+            # buffers without a state file are from a render that never
+            # checkpointed, so they hold nothing we can account for
+            for name in ("sums", "linear", "counts", *framebuffer.AOVS):
+                path = os.path.join(directory, name + ".npy")
+                if os.path.exists(path):
+                    os.remove(path)
+            if seed is None:
+                seed = random.randrange(2**32)
+            state = dict(expected, seed=seed, passes=0, done=[])
+        fb = framebuffer.Framebuffer.mapped(directory, cam.iw, cam.ih, cam.aovs)
+        return cls(directory, fb, state)
+
+    @property
+    def seed(self):
+        return self.state["seed"]
+
+    @property
+    def tiles(self):
+        size = self.state["tile_size"]
+        return math.ceil(self.fb.width / size) * math.ceil(self.fb.height / size)
+
+    def is_done(self, index):
+        return index < self.state["passes"] * self.tiles or index in self.done
+
+    def add(self, index, tile, sums, linear, counts, aovs=None):
+        # results are held back until the next save, so a render that is
+        # killed never leaves samples in the buffer that state.json doesn't know of
+        self.pending.append((index, tile, sums, linear, counts, aovs))
+
+    def save(self):
+        for index, tile, sums, linear, counts, aovs in self.pending:
+            self.fb.add(tile, sums, linear, counts, aovs)
+            self.done.add(index)
+        self.pending.clear()
+        self.fb.flush()
+        n = self.tiles
+        passes = self.state["passes"]
+        while all(passes * n + i in self.done for i in range(n)):
+            self.done.difference_update(range(passes * n, (passes + 1) * n))
+            passes += 1
+        self.state["passes"] = passes
+        self.state["done"] = sorted(self.done)
+        path = os.path.join(self.directory, STATE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(path + ".tmp", path)
+        self.saved = time.monotonic()
@@ -0,0 +1,101 @@
+import numpy as np
+from . import adaptive
+
+KERNEL = np.array([1, 4, 6, 4, 1]) / 16
+EPS = 1e-6
+# keeps black albedo channels from dividing by zero
+ALBEDO_EPS = 0.01
+
+
+def dot(a, b):
+    return np.einsum("ijk,ijk->ij", a, b)
+
+
+def atrous(
+    color,
+    albedo,
+    normal,
+    depth,
+    variance,
+    iterations=3,
+    sigma_luminance=4.0,
+    sigma_normal=128.0,
+    sigma_depth=1.0,
+):
+    # edge-avoiding a-trous wavelet filter (Dammertz et al. 2010) with the
+    # luminance edge stop scaled by the noise's standard deviation, as in SVGF
+    # (Schied et al. 2017); the albedo is divided out first and multiplied
+    # back after, so texture detail isn't blurred with the noise
+    demodulate = albedo + ALBEDO_EPS
+    irradiance = color / demodulate
+    scale = demodulate @ adaptive.LUMINANCE
+    variance = variance / (scale * scale)
+    length = np.sqrt(dot(normal, normal))
+    normal = normal / np.maximum(length, EPS)[..., None]
+    gradient = np.hypot(*np.gradient(depth))
+    for i in range(iterations):
+        irradiance, variance = atrous_step(
+            irradiance,
+            variance,
+            normal,
+            depth,
+            gradient,
+            2**i,
+            sigma_luminance,
+            sigma_normal,
+            sigma_depth,
+        )
+    return irradiance * demodulate
+
+
+def atrous_step(
+    color,
+    variance,
+    normal,
+    depth,
+    gradient,
+    step,
+    sigma_luminance,
+    sigma_normal,
+    sigma_depth,
+):
+    # one pass of the 5x5 B-spline kernel with holes of step pixels; the
+    # variance goes through the squared weights so later passes see less noise
+    h, w = depth.shape
+    luminance = color @ adaptive.LUMINANCE
+    sigma = sigma_luminance * np.sqrt(blur3(variance)) + EPS
+    pad = 2 * step
+    padded = [
+        np.pad(a, ((pad, pad), (pad, pad)) + ((0, 0),) * (a.ndim - 2), mode="edge")
+        for a in (color, variance, normal, depth, luminance)
+    ]
+    total = np.zeros_like(color)
+    total_variance = np.zeros_like(variance)
+    weights = np.zeros_like(variance)
+    for dy in range(-2, 3):
+        for dx in range(-2, 3):
+            rows = slice(pad + dy * step, pad + dy * step + h)
+            cols = slice(pad + dx * step, pad + dx * step + w)
+            c, v, n, z, lum = (a[rows, cols] for a in padded)
+            distance = step * np.hypot(dx, dy)
+            weight = (
+                KERNEL[dy + 2]
+                * KERNEL[dx + 2]
+                * np.maximum(dot(normal, n), 0) ** sigma_normal
+                * np.exp(
+                    -np.abs(luminance - lum) / sigma
+                    - np.abs(depth - z) / (sigma_depth * gradient * distance + EPS)
+                )
+            )
+            total += weight[..., None] * c
+            total_variance += weight * weight * v
+            weights += weight
+    weights = np.maximum(weights, EPS)
+    return total / weights[..., None], total_variance / (weights * weights)
+
+
+def blur3(a):
+    # 3x3 binomial blur, which steadies the per pixel variance estimates
+    p = np.pad(a, 1, mode="edge")
+    rows = (p[:-2] + 2 * p[1:-1] + p[2:]) / 4
+    return (rows[:, :-2] + 2 * rows[:, 1:-1] + rows[:, 2:]) / 4
@@ -0,0 +1,239 @@
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import connection
+from . import scenecache, trace
+
+# how long workers keep trying to reach a coordinator that isn't up yet
+CONNECT_WAIT = 10
+# how often idle connections check whether the render is over
+POLL = 0.1
+# connections waiting to be accepted, which many workers starting at once need
+BACKLOG = 64
+# how long close waits for connections to tell their workers to stop
+CLOSE_WAIT = 1
+# how long a render with tiles left waits for a worker once all have gone
+WORKER_WAIT = 10
+
+
+def parse_address(address, host="localhost"):
+    # "host:port", or just the port
+    name, _, port = str(address).rpartition(":")
+    return name or host, int(port)
+
+
+class Coordinator:
+    # hands render_tiles' jobs to workers that connect over TCP, one job at a
+    # time per worker, and passes their results back; a job goes back in the
+    # queue if its worker's connection drops or the worker takes longer than
+    # timeout over it, so the render finishes as long as any worker is left.
+    # Workers build the world themselves, from the scene cache, and are sent
+    # the camera; messages are pickles, so only accept workers you trust,
+    # which the authkey handshake checks. run gives up if every worker that
+    # joined has been gone for worker_wait seconds with tiles left
+    def __init__(
+        self,
+        scene,
+        scene_seed=0,
+        use_bvh=True,
+        address=("localhost", 0),
+        authkey=None,
+        timeout=None,
+        worker_wait=WORKER_WAIT,
+    ):
+        self.scene = scene, scene_seed, use_bvh
+        self.authkey = os.urandom(16) if authkey is None else authkey
+        self.timeout = timeout
+        self.worker_wait = worker_wait
+        self.listener = connection.Listener(
+            address, backlog=BACKLOG, authkey=self.authkey
+        )
+        self.address = self.listener.address
+        self.closed = threading.Event()
+        self.pending = queue.Queue()
+        self.results = queue.Queue()
+        # workers may join, and build their world, before the render starts
+        self.setup = None
+        self.started = threading.Event()
+        self.threads = []
+        # workers rendering, and when the last of them left if none are
+        self.lock = threading.Lock()
+        self.live = 0
+        self.left = None
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        # closing the listener doesn't wake a thread blocked accepting on it
+        try:
+            socket.create_connection(self.address, 1).close()
+        except OSError:
+            pass
+        self.listener.close()
+        deadline = time.monotonic() + CLOSE_WAIT
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+    def run(self, jobs, cam, mode, seed, collect_stats=False):
+        # render_job's results for jobs, as they come back
+        if self.setup is not None:
+            raise ValueError("a coordinator runs one render")
+        self.setup = cam, mode, seed, collect_stats
+        for job in jobs:
+            self.pending.put(job)
+        self.started.set()
+        done = set()
+        try:
+            while len(done) < len(jobs):
+                try:
+                    result = self.results.get(timeout=POLL)
+                except queue.Empty:
+                    if self.abandoned():
+                        raise RuntimeError(
+                            f"all workers left with {len(jobs) - len(done)} "
+                            "tiles to go"
+                        ) from None
+                    continue
+                if isinstance(result, str):
+                    raise RuntimeError(f"a worker failed:\n{result}")
+                # a job given up on may still come back from its worker
+                if result[0] not in done:
+                    done.add(result[0])
+                    yield result
+        finally:
+            self.close()
+
+    def abandoned(self):
+        with self.lock:
+            if self.live or self.left is None:
+                return False
+            return time.monotonic() - self.left > self.worker_wait
+
+    def accept(self):
+        while not self.closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, connection.AuthenticationError):
+                continue
+            thread = threading.Thread(target=self.serve, args=(conn,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def next_job(self):
+        # None once the render is over
+        while not self.closed.is_set():
+            try:
+                return self.pending.get(timeout=POLL)
+            except queue.Empty:
+                pass
+        return None
+
+    def serve(self, conn):
+        job, name, joined = None, "a worker", False
+        try:
+            name, sources = conn.recv()
+            if sources != scenecache.sources():
+                log(f"turned away {name}, which runs different code")
+                conn.send("the coordinator runs different code")
+                return
+            while not self.started.wait(POLL):
+                if self.closed.is_set():
+                    conn.send(None)
+                    return
+            conn.send((*self.scene, *self.setup))
+            log(f"{name} joined")
+            with self.lock:
+                self.live += 1
+                joined = True
+            while True:
+                job = self.next_job()
+                conn.send(job)
+                if job is None:
+                    return
+                if self.timeout is not None and not conn.poll(self.timeout):
+                    raise TimeoutError(f"no result in {self.timeout}s")
+                self.results.put(conn.recv())
+                job = None
+        except (OSError, EOFError, TimeoutError) as e:
+            if not self.closed.is_set():
+                log(f"lost {name}: {str(e) or 'connection closed'}")
+        finally:
+            if job is not None:
+                self.pending.put(job)
+            if joined:
+                with self.lock:
+                    self.live -= 1
+                    if not self.live:
+                        self.left = time.monotonic()
+            conn.close()
+
+
+def log(message):
+    print(f"coordinator: {message}", file=sys.stderr)
+
+
+def work(address, authkey, cache_dir=scenecache.CACHE_DIR, wait=CONNECT_WAIT):
+    # renders jobs from the coordinator at address until it runs out or goes
+    # away; returns how many it rendered
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            conn = connection.Client(tuple(address), authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(POLL)
+    with conn:
+        conn.send((f"{socket.gethostname()}:{os.getpid()}", scenecache.sources()))
+        setup = conn.recv()
+        # None if the render is already over
+        if setup is None:
+            return 0
+        if isinstance(setup, str):
+            raise RuntimeError(f"{address}: {setup}")
+        name, scene_seed, use_bvh, cam, mode, seed, collect_stats = setup
+        _, world = scenecache.scene(name, scene_seed, cache_dir, use_bvh)
+        trace.init_worker(cam, world, mode, seed, collect_stats)
+        rendered = 0
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                job = None
+            if job is None:
+                return rendered
+            try:
+                result = trace.render_job(job)
+            except Exception:
+                conn.send(traceback.format_exc())
+                raise
+            conn.send(result)
+            rendered += 1
+
+
+def start_workers(n, address, authkey, cache_dir=scenecache.CACHE_DIR):
+    # n worker processes on this machine
+    import multiprocessing
+
+    workers = [
+        multiprocessing.Process(
+            target=work, args=(address, authkey, cache_dir), daemon=True
+        )
+        for _ in range(n)
+    ]
+    for w in workers:
+        w.start()
+    return workers
@@ -0,0 +1,216 @@
+import os
+import sys
+import numpy as np
+from . import adaptive, interval
+
+FORMATS = ("ppm", "png", "pfm")
+BAND_ROWS = 256
+# what 8 bit output can show; samples are clamped to it one at a time
+DISPLAY = interval.Interval(0, 0.999)
+# first hit features summed over a pixel's samples, by channel count;
+# moment sums the squared luminance of the clamped samples, for their variance
+AOVS = {"albedo": 3, "normal": 3, "depth": 1, "moment": 1}
+
+
+def aov_shape(name, height, width):
+    channels = AOVS[name]
+    return (height, width, channels) if channels > 1 else (height, width)
+
+
+def split_aovs(features):
+    # the aovs out of an array whose last axis holds their channels in order
+    aovs, k = {}, 0
+    for name, channels in AOVS.items():
+        aovs[name] = features[..., k : k + channels]
+        if channels == 1:
+            aovs[name] = aovs[name][..., 0]
+        k += channels
+    return aovs
+
+
+class Framebuffer:
+    # sample sums and counts; sums has every sample clamped to what a pixel
+    # can display, as 8 bit images always had, and linear the samples as
+    # they are, for HDR output. Gamma correction waits for quantizing
+    def __init__(self, width, height, sums=None, counts=None, aovs=None, linear=None):
+        self.width = width
+        self.height = height
+        self.sums = np.zeros((height, width, 3), np.float32) if sums is None else sums
+        if counts is None:
+            counts = np.zeros((height, width), np.float32)
+        self.counts = counts
+        if linear is None:
+            linear = np.zeros((height, width, 3), np.float32)
+        self.linear = linear
+        # sums of the AOVS, by name, if the camera collects them
+        self.aovs = {} if aovs is None else aovs
+
+    @classmethod
+    def with_aovs(cls, width, height):
+        return cls(
+            width,
+            height,
+            aovs={
+                name: np.zeros(aov_shape(name, height, width), np.float32)
+                for name in AOVS
+            },
+        )
+
+    @classmethod
+    def mapped(cls, directory, width, height, aovs=False):
+        # sums and counts live in .npy files and are paged in as tiles touch
+        # them, so memory use doesn't grow with the image
+        os.makedirs(directory, exist_ok=True)
+        shapes = {
+            "sums": (height, width, 3),
+            "linear": (height, width, 3),
+            "counts": (height, width),
+        }
+        if aovs:
+            shapes.update((name, aov_shape(name, height, width)) for name in AOVS)
+        arrays = {}
+        for name, shape in shapes.items():
+            path = os.path.join(directory, name + ".npy")
+            if os.path.exists(path):
+                a = np.load(path, mmap_mode="r+")
+                if a.shape != shape:
+                    raise ValueError(
+                        f"{path} holds a {a.shape} buffer, expected {shape}"
+                    )
+            else:
+                a = np.lib.format.open_memmap(path, "w+", np.float32, shape)
+            arrays[name] = a
+        sums, counts = arrays.pop("sums"), arrays.pop("counts")
+        return cls(width, height, sums, counts, arrays, arrays.pop("linear"))
+
+    def flush(self):
+        for a in (self.sums, self.linear, self.counts, *self.aovs.values()):
+            if isinstance(a, np.memmap):
+                a.flush()
+
+    def add(self, tile, sums, linear, counts, aovs=None):
+        x0, y0, x1, y1 = tile
+        self.sums[y0:y1, x0:x1] += sums
+        self.linear[y0:y1, x0:x1] += linear
+        self.counts[y0:y1, x0:x1] += counts
+        if aovs is not None:
+            for name, a in aovs.items():
+                self.aovs[name][y0:y1, x0:x1] += a
+
+    def image(self, y0=0, y1=None):
+        sums, counts = self.sums[y0:y1], self.counts[y0:y1]
+        return sums / np.maximum(counts, 1)[..., None]
+
+    def linear_image(self, y0=0, y1=None):
+        linear, counts = self.linear[y0:y1], self.counts[y0:y1]
+        return linear / np.maximum(counts, 1)[..., None]
+
+    def aov(self, name):
+        counts = np.maximum(self.counts, 1)
+        a = self.aovs[name]
+        return a / (counts[..., None] if a.ndim == 3 else counts)
+
+    def variance(self):
+        # of each pixel's mean luminance, estimated from its samples
+        n = np.maximum(self.counts, 1)
+        mean = self.image() @ adaptive.LUMINANCE
+        var = np.maximum(self.aovs["moment"] / n - mean * mean, 0)
+        # var * n / (n - 1) is the samples' variance, and the mean's is that / n
+        return var / np.maximum(n - 1, 1)
+
+    def denoised(self, **kwargs):
+        from . import denoise
+
+        image = denoise.atrous(
+            self.image(),
+            self.aov("albedo"),
+            self.aov("normal"),
+            self.aov("depth"),
+            self.variance(),
+            **kwargs,
+        )
+        # of the clamped samples, so there is no HDR image to keep
+        ones = np.ones(self.counts.shape)
+        return Framebuffer(self.width, self.height, image, ones, linear=image)
+
+    def save_aovs(self, path):
+        # next to the image at path, as stem.name.pfm
+        stem = os.path.splitext(path)[0]
+        for name in AOVS:
+            if name != "moment":
+                with open(f"{stem}.{name}.pfm", "wb") as f:
+                    write_pfm(f, self.aov(name))
+        with open(f"{stem}.variance.pfm", "wb") as f:
+            write_pfm(f, self.variance())
+
+    def bands(self, rows=BAND_ROWS):
+        for y in range(0, self.height, rows):
+            yield self.image(y, y + rows)
+
+    def to_rgb(self):
+        return to_rgb(self.image())
+
+    def save(self, path=None, fmt=None):
+        fmt = fmt or format_for(path)
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown image format: {fmt}")
+        if path is None or path == "-":
+            write(sys.stdout.buffer, self, fmt)
+            sys.stdout.buffer.flush()
+        else:
+            with open(path, "wb") as f:
+                write(f, self, fmt)
+
+
+def format_for(path):
+    if path is None or path == "-":
+        return "ppm"
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in FORMATS else "ppm"
+
+
+def to_rgb(image):
+    # gamma_corrected and asrgb, vectorized; the clip only matters for images
+    # that aren't means of clamped samples
+    return (np.sqrt(np.clip(image, DISPLAY.start, DISPLAY.end)) * 256).astype(np.uint8)
+
+
+def write(f, fb, fmt):
+    # ppm and pfm are written a band of rows at a time, png needs the whole image
+    if fmt == "pfm":
+        write_pfm_header(f, fb.width, fb.height)
+        for y in range(fb.height, 0, -BAND_ROWS):
+            write_pfm_rows(f, fb.linear_image(max(y - BAND_ROWS, 0), y))
+    elif fmt == "png":
+        write_png(f, fb.to_rgb())
+    else:
+        write_ppm_header(f, fb.width, fb.height)
+        for band in fb.bands():
+            f.write(to_rgb(band).tobytes())
+
+
+def write_ppm_header(f, w, h):
+    f.write(f"P6\n{w} {h}\n255\n".encode("ascii"))
+
+
+def write_png(f, rgb):
+    from PIL import Image
+
+    Image.fromarray(np.ascontiguousarray(rgb, np.uint8), "RGB").save(f, "PNG")
+
+
+def write_pfm_header(f, w, h, channels=3):
+    # a negative scale marks little endian data, Pf is the grayscale variant
+    kind = "PF" if channels == 3 else "Pf"
+    f.write(f"{kind}\n{w} {h}\n-1.0\n".encode("ascii"))
+
+
+def write_pfm_rows(f, image):
+    # pfm rows go bottom to top
+    f.write(np.ascontiguousarray(image[::-1], "<f4").tobytes())
+
+
+def write_pfm(f, image):
+    h, w = image.shape[:2]
+    write_pfm_header(f, w, h, image.shape[2] if image.ndim == 3 else 1)
+    write_pfm_rows(f, image)
@@ -0,0 +1,91 @@
+import numpy as np
+
+# points evaluated at once while filling a grid
+CHUNK = 2**16
+
+
+class Grid:
+    # values sampled at the vertices of a regular lattice spanning lo to hi,
+    # read back with trilinear interpolation
+    def __init__(self, lo, hi, values):
+        if min(values.shape) < 2:
+            raise ValueError(f"a grid needs two samples per axis, not {values.shape}")
+        self.lo = tuple(lo)
+        self.hi = tuple(hi)
+        self.values = values
+        self.shape = values.shape
+        self.scale = tuple((n - 1) / (h - l) for n, l, h in zip(self.shape, lo, hi))
+        self.cells = flat_view(values)
+
+    @classmethod
+    def sample(cls, fn, lo, hi, shape):
+        # fn maps an (n, 3) array of points to n values
+        axes = [np.linspace(l, h, n) for l, h, n in zip(lo, hi, shape)]
+        values = np.empty(shape, np.float32)
+        flat = values.reshape(-1)
+        yz = np.stack(np.meshgrid(axes[1], axes[2], indexing="ij"), -1).reshape(-1, 2)
+        rows = max(CHUNK // len(yz), 1)
+        for x0 in range(0, shape[0], rows):
+            xs = axes[0][x0 : x0 + rows]
+            p = np.empty((len(xs), len(yz), 3))
+            p[..., 0] = xs[:, None]
+            p[..., 1:] = yz
+            start = x0 * len(yz)
+            flat[start : start + p.shape[0] * p.shape[1]] = fn(p.reshape(-1, 3))
+        return cls(lo, hi, values)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["cells"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cells = flat_view(self.values)
+
+    def lookup(self, x, y, z):
+        # the interpolated value at a point, or None outside the grid
+        nx, ny, nz = self.shape
+        lx, ly, lz = self.lo
+        sx, sy, sz = self.scale
+        fx, fy, fz = (x - lx) * sx, (y - ly) * sy, (z - lz) * sz
+        if not (0 <= fx <= nx - 1 and 0 <= fy <= ny - 1 and 0 <= fz <= nz - 1):
+            return None
+        i, j, k = min(int(fx), nx - 2), min(int(fy), ny - 2), min(int(fz), nz - 2)
+        tx, ty, tz = fx - i, fy - j, fz - k
+        c = self.cells
+        n = (i * ny + j) * nz + k
+        dy, dx = nz, ny * nz
+        c00 = c[n] + (c[n + 1] - c[n]) * tz
+        c01 = c[n + dy] + (c[n + dy + 1] - c[n + dy]) * tz
+        c10 = c[n + dx] + (c[n + dx + 1] - c[n + dx]) * tz
+        c11 = c[n + dx + dy] + (c[n + dx + dy + 1] - c[n + dx + dy]) * tz
+        c0 = c00 + (c01 - c00) * ty
+        c1 = c10 + (c11 - c10) * ty
+        return c0 + (c1 - c0) * tx
+
+    def lookup_array(self, p):
+        # interpolated values at (n, 3) points and a mask of those inside;
+        # values outside are meaningless
+        shape = np.array(self.shape)
+        f = (p - self.lo) * self.scale
+        inside = np.all((f >= 0) & (f <= shape - 1), axis=1)
+        f = np.clip(f, 0, shape - 1)
+        ijk = np.minimum(f.astype(int), shape - 2)
+        t = f - ijk
+        i, j, k = ijk.T
+        v = self.values
+
+        def along_z(a, b):
+            return v[a, b, k] + (v[a, b, k + 1] - v[a, b, k]) * t[:, 2]
+
+        c00, c01 = along_z(i, j), along_z(i, j + 1)
+        c10, c11 = along_z(i + 1, j), along_z(i + 1, j + 1)
+        c0 = c00 + (c01 - c00) * t[:, 1]
+        c1 = c10 + (c11 - c10) * t[:, 1]
+        return c0 + (c1 - c0) * t[:, 0], inside
+
+
+def flat_view(values):
+    # indexing a memoryview gives plain floats, no numpy scalars
+    return memoryview(np.ascontiguousarray(values).reshape(-1))
@@ -0,0 +1,156 @@
+import math
+import numpy as np
+from . import aabb, bvh, ray, vec3
+
+
+# 4x4 affine transforms, which compose with @ and apply right to left
+def translate(x, y, z):
+    m = np.eye(4)
+    m[:3, 3] = x, y, z
+    return m
+
+
+def scale(x, y=None, z=None):
+    return np.diag((x, x if y is None else y, x if z is None else z, 1.0))
+
+
+def rotate(axis, degrees):
+    # about the axis through the origin, counterclockwise looking down it
+    x, y, z = np.asarray(tuple(axis), float) / np.linalg.norm(tuple(axis))
+    c, s = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    m = np.eye(4)
+    m[:3, :3] = (
+        (c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s),
+        (y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s),
+        (z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)),
+    )
+    return m
+
+
+class Instances(bvh.FlatTree):
+    # copies of one hittable, each placed by its own transform; rays are moved
+    # into the hittable's space rather than the hittable into the world, so
+    # every copy shares its geometry and acceleration structure. The copies
+    # have a BVH of their own over their boxes, in FlatBVH's layout, which
+    # makes this the top level of a two level BVH: a copy costs two
+    # transforms and its share of the tree, not a copy of the hittable
+    def __init__(self, hittable, transforms, max_leaf_size=4, bins=12):
+        transforms = np.asarray(transforms, float).reshape(-1, 4, 4)
+        if not len(transforms):
+            raise ValueError("instances need at least one transform")
+        if np.any(np.abs(np.linalg.det(transforms[:, :3, :3])) < 1e-12):
+            raise ValueError("instance transforms must be invertible")
+        self.hittable = hittable
+        box = hittable.bounding_box()
+        corners = np.array(
+            [
+                (x, y, z, 1.0)
+                for x in (box.x.start, box.x.end)
+                for y in (box.y.start, box.y.end)
+                for z in (box.z.start, box.z.end)
+            ]
+        )
+        world = corners @ transforms.transpose(0, 2, 1)
+        lo, hi = world[..., :3].min(axis=1), world[..., :3].max(axis=1)
+        self.bounds, self.offset, self.count, self.axis, order = bvh.build_flat(
+            lo, hi, max_leaf_size, bins
+        )
+        transforms = transforms[order]
+        # the top three rows of each inverse, which is all hits need
+        self.to_object = np.ascontiguousarray(
+            np.linalg.inv(transforms)[:, :3].reshape(-1, 12)
+        )
+        # how much each copy scales lengths, for the widths of ray cones
+        self.scale = np.cbrt(np.abs(np.linalg.det(transforms[:, :3, :3])))
+        self.bbox = aabb.AABB.from_points(
+            *self.bounds[0].reshape(2, 3).tolist()
+        ).pad(bvh.PAD)
+        self.views()
+
+    def views(self):
+        # read through memoryviews, as in Mesh
+        self._bounds = memoryview(self.bounds.ravel())
+        self._offset = memoryview(self.offset)
+        self._count = memoryview(self.count)
+        self._axis = memoryview(self.axis)
+        self._to_object = memoryview(self.to_object.ravel())
+        self._scale = memoryview(self.scale)
+
+    def __getstate__(self):
+        return {
+            k: v for k, v in self.__dict__.items() if not isinstance(v, memoryview)
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.views()
+
+    def __len__(self):
+        return len(self.scale)
+
+    def nbytes(self):
+        arrays = (self.bounds, self.offset, self.count, self.axis)
+        arrays += (self.to_object, self.scale)
+        return sum(a.nbytes for a in arrays)
+
+    def local_ray(self, r, j):
+        # r in the space of copy j; its direction isn't normalized, so hits
+        # keep their t
+        m, k = self._to_object, 12 * j
+        o, d = r.origin, r.dir
+        return ray.Ray(
+            vec3.Vec3(
+                m[k] * o.x + m[k + 1] * o.y + m[k + 2] * o.z + m[k + 3],
+                m[k + 4] * o.x + m[k + 5] * o.y + m[k + 6] * o.z + m[k + 7],
+                m[k + 8] * o.x + m[k + 9] * o.y + m[k + 10] * o.z + m[k + 11],
+            ),
+            vec3.Vec3(
+                m[k] * d.x + m[k + 1] * d.y + m[k + 2] * d.z,
+                m[k + 4] * d.x + m[k + 5] * d.y + m[k + 6] * d.z,
+                m[k + 8] * d.x + m[k + 9] * d.y + m[k + 10] * d.z,
+            ),
+            r.width / self._scale[j],
+            r.spread,
+        )
+
+    def _leaf(self, ray, first, n, ray_tmin, ray_tmax, rec, counters):
+        # each copy hit in its own space
+        hittable, hit = self.hittable, None
+        for j in range(first, first + n):
+            if hittable._hit(self.local_ray(ray, j), ray_tmin, ray_tmax, rec):
+                ray_tmax = rec.t
+                hit = j, rec.obj, rec.index, rec.inner
+        if hit is None:
+            return None
+        # what the copy's hittable recorded waits in inner for finalize
+        j, obj, index, inner = hit
+        rec.obj = self
+        rec.index = j
+        rec.inner = obj, index, inner
+        return ray_tmax
+
+    def finalize(self, ray, rec):
+        j = rec.index
+        rec.obj, rec.index, rec.inner = rec.inner
+        rec.obj.finalize(self.local_ray(ray, j), rec)
+        # normals go back through the inverse transpose; the side they face,
+        # and t, are the same in both spaces
+        m, k, n = self._to_object, 12 * j, rec.normal
+        rec.normal = vec3.Vec3(
+            m[k] * n.x + m[k + 4] * n.y + m[k + 8] * n.z,
+            m[k + 1] * n.x + m[k + 5] * n.y + m[k + 9] * n.z,
+            m[k + 2] * n.x + m[k + 6] * n.y + m[k + 10] * n.z,
+        ).normalized()
+        rec.p = ray.at(rec.t)
+        rec.width *= self._scale[j]
+        # the instance, not the primitive, is what was hit in the world, so
+        # hits on copies aren't taken for hits on a light they copy
+        rec.obj = self
+        rec.index = j
+        rec.inner = None
+
+
+class Instance(Instances):
+    # a single copy of hittable
+    def __init__(self, hittable, transform):
+        super().__init__(hittable, [transform])
@@ -1,6 +1,3 @@
-import sys
-
-
 class Interval:
     def __init__(self, start=float("+inf"), end=float("-inf")):
         self.start = start
@@ -35,7 +32,7 @@ class Interval:
             return self.end
         return n
 
-    def expand(delta):
+    def expand(self, delta):
         padding = delta / 2
         return Interval(self.start - padding, self.end + padding)
 
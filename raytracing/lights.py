@@ -0,0 +1,43 @@
+import random
+from . import bvh, material
+
+
+class Lights:
+    # the emissive primitives of a world; next event estimation picks one
+    # uniformly and asks it for a direction towards itself
+    def __init__(self, prims):
+        self.prims = prims
+        self.ids = {id(prim) for prim in prims}
+
+    @classmethod
+    def from_world(cls, world):
+        # None when the world has nothing to sample
+        prims = [
+            obj
+            for obj in bvh.flatten(world)
+            if isinstance(getattr(obj, "material", None), material.DiffuseLight)
+            and hasattr(obj, "sample_direction")
+        ]
+        return cls(prims) if prims else None
+
+    def __len__(self):
+        return len(self.prims)
+
+    def sample(self, origin):
+        # a light and a direction from origin towards it, which is None if
+        # the light can't be sampled from there
+        light = self.prims[int(random.random() * len(self.prims))]
+        return light, light.sample_direction(origin)
+
+    def pdf(self, ray, rec):
+        # solid angle density of sampling ray's direction towards the point
+        # of rec, 0 if rec isn't on a light
+        if id(rec.obj) not in self.ids:
+            return 0
+        return rec.obj.light_pdf(ray, rec) / len(self.prims)
+
+
+def mis_weight(pdf, other):
+    # power heuristic
+    pdf *= pdf
+    return pdf / (pdf + other * other)
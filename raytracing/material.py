@@ -1,25 +1,35 @@
-from . import ray, randfloat, texture, vec3
+import math
+from . import ray, samplers, texture, vec3
 
 BLACK = vec3.Vec3(0,0,0)
 WHITE = vec3.Vec3(1,1,1)
 class Material:
-    def scatter(self, r, hr):
+    def scatter(self, r, hr, sampler=samplers.INDEPENDENT):
         return False, None, None
 
-    def emit(self, u, v, p):
+    def emit(self, u, v, p, footprint=0):
         return BLACK
 
+    def pdf(self, hr, direction):
+        # density of scatter having picked direction, 0 for specular
+        # materials, which can't be combined with light samples
+        return 0
+
 class Lambertian(Material):
     def __init__(self, albedo):
 
         self.albedo = texture.Texture.texturify(albedo)
 
-    def scatter(self, r, hr):
-        scatter_dir = hr.normal + vec3.Vec3.random_unit()
+    def scatter(self, r, hr, sampler=samplers.INDEPENDENT):
+        scatter_dir = vec3.unit_sphere(*sampler.get_2d()).iadd(hr.normal)
         if scatter_dir.near_zero():
             scatter_dir = hr.normal
-        scattered_ray = ray.Ray(hr.p, scatter_dir)
-        return True, self.albedo.sample(hr.u, hr.v, hr.p), scattered_ray
+        scattered_ray = ray.Ray(hr.p, scatter_dir, hr.width, r.spread)
+        return True, self.albedo.sample(hr.u, hr.v, hr.p, hr.footprint), scattered_ray
+
+    def pdf(self, hr, direction):
+        cos = vec3.dot(direction, hr.normal) / direction.length
+        return cos / math.pi if cos > 0 else 0
 
 
 class Metal(Material):
@@ -27,15 +37,14 @@ class Metal(Material):
         self.albedo = texture.Texture.texturify(albedo)
         self.fuzz = min(fuzz, 1)
 
-    def scatter(self, r, hr):
-        scatter_dir = vec3.reflect(r.dir, hr.normal)
-        scatter_dir = scatter_dir.normalized() + (
-            self.fuzz * vec3.Vec3.random_unit()
-        )
-        scattered_ray = ray.Ray(hr.p, scatter_dir)
+    def scatter(self, r, hr, sampler=samplers.INDEPENDENT):
+        scatter_dir = vec3.reflect(r.dir, hr.normal).normalized()
+        if self.fuzz:
+            scatter_dir.iadd(vec3.unit_sphere(*sampler.get_2d()).iscale(self.fuzz))
+        scattered_ray = ray.Ray(hr.p, scatter_dir, hr.width, r.spread)
         return (
             vec3.dot(scattered_ray.dir, hr.normal) > 0,
-            self.albedo.sample(hr.u, hr.v, hr.p),
+            self.albedo.sample(hr.u, hr.v, hr.p, hr.footprint),
             scattered_ray,
         )
 
@@ -45,16 +54,20 @@ class Dielectric(Material):
         self.refraction_index = refraction_index
         self.albedo = texture.Texture.texturify(albedo)
 
-    def scatter(self, r, hr):
+    def scatter(self, r, hr, sampler=samplers.INDEPENDENT):
         ri = 1 / self.refraction_index if hr.front_face else self.refraction_index
         udir = r.dir.normalized()
         cos_theta = min(-vec3.dot(udir, hr.normal), 1)
         sin_theta = (1 - (cos_theta**2)) ** 0.5
-        if ri * sin_theta > 1 or reflectance(cos_theta, ri) > randfloat.randfloat():
+        if ri * sin_theta > 1 or reflectance(cos_theta, ri) > sampler.get_1d():
             scatter_dir = vec3.reflect(udir,hr.normal)
         else:
             scatter_dir = vec3.refract(udir, hr.normal, ri)
-        return True, self.albedo.sample(hr.u, hr.v, hr.p), ray.Ray(hr.p, scatter_dir)
+        return (
+            True,
+            self.albedo.sample(hr.u, hr.v, hr.p, hr.footprint),
+            ray.Ray(hr.p, scatter_dir, hr.width, r.spread),
+        )
 
 
 class DiffuseLight(Material):
@@ -62,8 +75,8 @@ class DiffuseLight(Material):
         self.energy_multiplier = energy_multiplier
         self.texture = texture.Texture.texturify(e_tex)
 
-    def emit(self, u, v, p):
-        return self.texture.sample(u, v, p) * self.energy_multiplier
+    def emit(self, u, v, p, footprint=0):
+        return self.texture.sample(u, v, p, footprint) * self.energy_multiplier
 
 
 def reflectance(cs, ri):
@@ -0,0 +1,308 @@
+import array
+import itertools
+import math
+import warnings
+import numpy as np
+from . import aabb, bvh, reads, shapes, vec3
+
+# lines of an OBJ file read at a time
+CHUNK = 2**16
+
+
+class Mesh(bvh.FlatTree):
+    # a triangle mesh held in contiguous arrays: faces index vertices, and
+    # normal_faces and uv_faces, if given, index normals and uvs, with -1 for
+    # faces that have none; the mesh has its own BVH, in FlatBVH's layout,
+    # and its triangles are reordered so every leaf holds a run of them
+    def __init__(
+        self,
+        vertices,
+        faces,
+        material,
+        normals=None,
+        normal_faces=None,
+        uvs=None,
+        uv_faces=None,
+        max_leaf_size=4,
+        bins=12,
+    ):
+        vertices = np.asarray(vertices, float).reshape(-1, 3)
+        faces = np.asarray(faces, np.int32).reshape(-1, 3)
+        if not len(faces):
+            raise ValueError("a mesh needs at least one triangle")
+        if faces.min() < 0 or faces.max() >= len(vertices):
+            raise ValueError("mesh faces refer to missing vertices")
+        self.material = material
+        v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+        lo = np.minimum(np.minimum(v0, v1), v2)
+        hi = np.maximum(np.maximum(v0, v1), v2)
+        self.bounds, self.offset, self.count, self.axis, order = bvh.build_flat(
+            lo, hi, max_leaf_size, bins
+        )
+        # the first vertex and both edges of each triangle, for Moller-Trumbore
+        self.tri = np.hstack((v0, v1 - v0, v2 - v0))[order]
+        self.vertices = vertices
+        self.faces = faces[order]
+        self.normals = self.normal_faces = self.uvs = self.uv_faces = None
+        if normals is not None and normal_faces is not None:
+            self.normals = np.asarray(normals, float).reshape(-1, 3)
+            normal_faces = np.asarray(normal_faces, np.int32).reshape(-1, 3)
+            self.normal_faces = normal_faces[order]
+            if self.normal_faces.max() >= len(self.normals):
+                raise ValueError("mesh faces refer to missing normals")
+            # a face only uses normals if all its corners have one
+            self.normal_faces[(self.normal_faces < 0).any(axis=1)] = -1
+        if uvs is not None and uv_faces is not None:
+            self.uvs = np.asarray(uvs, float).reshape(-1, 2)
+            self.uv_faces = np.asarray(uv_faces, np.int32).reshape(-1, 3)[order]
+            if self.uv_faces.max() >= len(self.uvs):
+                raise ValueError("mesh faces refer to missing uvs")
+            self.uv_faces[(self.uv_faces < 0).any(axis=1)] = -1
+        self.bbox = aabb.AABB.from_points(
+            *self.bounds[0].reshape(2, 3).tolist()
+        ).pad(bvh.PAD)
+        self.views()
+
+    def views(self):
+        # the traversal and finalize read the arrays through memoryviews, which
+        # index about as fast as lists without a Python object per number
+        self._bounds = memoryview(self.bounds.ravel())
+        self._offset = memoryview(self.offset)
+        self._count = memoryview(self.count)
+        self._axis = memoryview(self.axis)
+        self._tri = memoryview(self.tri.ravel())
+        self._normals = self._uvs = None
+        if self.normals is not None:
+            self._normals = memoryview(np.ascontiguousarray(self.normals).ravel())
+            self._normal_faces = memoryview(self.normal_faces.ravel())
+        if self.uvs is not None:
+            self._uvs = memoryview(np.ascontiguousarray(self.uvs).ravel())
+            self._uv_faces = memoryview(self.uv_faces.ravel())
+
+    # memoryviews don't pickle, so worker processes make their own
+    def __getstate__(self):
+        return {
+            k: v for k, v in self.__dict__.items() if not isinstance(v, memoryview)
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.views()
+
+    def __len__(self):
+        return len(self.faces)
+
+    def nbytes(self):
+        arrays = (self.bounds, self.offset, self.count, self.axis, self.tri)
+        arrays += (self.vertices, self.faces, self.normals, self.normal_faces)
+        arrays += (self.uvs, self.uv_faces)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def _leaf(self, ray, first, n, ray_tmin, ray_tmax, rec, counters):
+        # Moller-Trumbore on each triangle of the leaf
+        if counters is not None:
+            counters.count_prims("Triangle", n)
+        tri, hit = self._tri, None
+        ox, oy, oz = ray.origin.x, ray.origin.y, ray.origin.z
+        dx, dy, dz = ray.dir.x, ray.dir.y, ray.dir.z
+        for j in range(first, first + n):
+            k = 9 * j
+            e1x, e1y, e1z = tri[k + 3], tri[k + 4], tri[k + 5]
+            e2x, e2y, e2z = tri[k + 6], tri[k + 7], tri[k + 8]
+            px = dy * e2z - dz * e2y
+            py = dz * e2x - dx * e2z
+            pz = dx * e2y - dy * e2x
+            det = e1x * px + e1y * py + e1z * pz
+            if -1e-12 < det < 1e-12:
+                continue
+            inv = 1 / det
+            sx, sy, sz = ox - tri[k], oy - tri[k + 1], oz - tri[k + 2]
+            u = (sx * px + sy * py + sz * pz) * inv
+            if u < 0 or u > 1:
+                continue
+            qx = sy * e1z - sz * e1y
+            qy = sz * e1x - sx * e1z
+            qz = sx * e1y - sy * e1x
+            v = (dx * qx + dy * qy + dz * qz) * inv
+            if v < 0 or u + v > 1:
+                continue
+            t = (e2x * qx + e2y * qy + e2z * qz) * inv
+            if ray_tmin < t < ray_tmax:
+                ray_tmax, hit = t, (j, u, v)
+        if hit is None:
+            return None
+        # like Quad, the barycentric coordinates wait in u and v for finalize
+        rec.t = ray_tmax
+        rec.obj = self
+        rec.index, rec.u, rec.v = hit
+        return ray_tmax
+
+    def finalize(self, ray, rec):
+        i, b1, b2 = rec.index, rec.u, rec.v
+        b0 = 1 - b1 - b2
+        tri, k = self._tri, 9 * i
+        e1 = vec3.Vec3(tri[k + 3], tri[k + 4], tri[k + 5])
+        e2 = vec3.Vec3(tri[k + 6], tri[k + 7], tri[k + 8])
+        outward = e1.cross(e2)
+        # twice the triangle's area
+        area = outward.length
+        is_front = vec3.dot(ray.dir, outward) < 0
+        normal = None
+        if self._normals is not None and self._normal_faces[3 * i] >= 0:
+            ns, f = self._normals, self._normal_faces
+            a, b, c = (3 * f[3 * i + n] for n in range(3))
+            normal = vec3.Vec3(
+                b0 * ns[a] + b1 * ns[b] + b2 * ns[c],
+                b0 * ns[a + 1] + b1 * ns[b + 1] + b2 * ns[c + 1],
+                b0 * ns[a + 2] + b1 * ns[b + 2] + b2 * ns[c + 2],
+            )
+            if normal.near_zero():
+                normal = None
+        if normal is None:
+            normal = outward
+        normal = normal.normalized()
+        rec.p = ray.at(rec.t)
+        rec.normal = normal if is_front else normal.iscale(-1)
+        rec.front_face = is_front
+        rec.material = self.material
+        # without uvs a triangle's uv is its barycentric coordinates, a
+        # triangle of twice the area 1
+        uv_area = 1
+        if self._uvs is not None and self._uv_faces[3 * i] >= 0:
+            uvs, f = self._uvs, self._uv_faces
+            a, b, c = (2 * f[3 * i + n] for n in range(3))
+            rec.u = b0 * uvs[a] + b1 * uvs[b] + b2 * uvs[c]
+            rec.v = b0 * uvs[a + 1] + b1 * uvs[b + 1] + b2 * uvs[c + 1]
+            uv_area = abs(
+                (uvs[b] - uvs[a]) * (uvs[c + 1] - uvs[a + 1])
+                - (uvs[c] - uvs[a]) * (uvs[b + 1] - uvs[a + 1])
+            )
+        extent = math.sqrt(area / uv_area) if uv_area > 0 else math.sqrt(area)
+        shapes.set_footprint(ray, rec, extent)
+
+
+def load_obj(path, material, **kwargs):
+    # streams a Wavefront OBJ file into flat typed arrays a chunk of lines at
+    # a time, so loading takes little more memory than the mesh; polygons
+    # become fans of triangles, and everything but vertices, uvs, normals and
+    # faces is skipped
+    reads.report(path)
+    floats = {"v": array.array("d"), "vt": array.array("d"), "vn": array.array("d")}
+    faces = array.array("i"), array.array("i"), array.array("i")
+    with open(path) as lines:
+        for first in itertools.count(1, CHUNK):
+            chunk = list(itertools.islice(lines, CHUNK))
+            if not chunk:
+                break
+            read_obj_chunk(path, first, chunk, floats, faces)
+    if len(floats["v"]) % 3 or len(floats["vn"]) % 3:
+        raise ValueError(f"{path}: a vertex or normal has fewer than 3 coordinates")
+    faces, uv_faces, normal_faces = (np.frombuffer(a, np.int32) for a in faces)
+    has_uvs = len(uv_faces) and uv_faces.max() >= 0
+    has_normals = len(normal_faces) and normal_faces.max() >= 0
+    return Mesh(
+        np.frombuffer(floats["v"]),
+        faces,
+        material,
+        np.frombuffer(floats["vn"]) if has_normals else None,
+        normal_faces if has_normals else None,
+        np.frombuffer(floats["vt"]) if has_uvs else None,
+        uv_faces if has_uvs else None,
+        **kwargs,
+    )
+
+
+def read_obj_chunk(path, first, chunk, floats, faces):
+    # the vertices, uvs and normals of the chunk are read first, then its
+    # faces, with numpy if read_faces can, otherwise line by line, counting
+    # what came before each face for its negative indices
+    widths = {"v": 3, "vt": 2, "vn": 3}
+    sizes = [len(floats[tag]) // width for tag, width in widths.items()]
+    rows = {"v": [], "vt": [], "vn": [], "f": []}
+    for line in chunk:
+        parts = line.split(None, 1)
+        if len(parts) == 2 and parts[0] in rows:
+            rows[parts[0]].append(parts[1])
+    for tag, width in widths.items():
+        if rows[tag]:
+            read_floats(rows[tag], width, floats[tag])
+    if not rows["f"] or read_faces(rows["f"], faces):
+        return
+    tags = list(widths)
+    for number, line in enumerate(chunk, first):
+        parts = line.split(None, 1)
+        if len(parts) < 2:
+            continue
+        if parts[0] in widths:
+            sizes[tags.index(parts[0])] += 1
+        elif parts[0] == "f":
+            corners = [obj_corner(corner, sizes) for corner in parts[1].split()]
+            if len(corners) < 3:
+                raise ValueError(f"{path}:{number}: a face needs 3 vertices")
+            for k in range(2, len(corners)):
+                for n, out in enumerate(faces):
+                    out.extend((corners[0][n], corners[k - 1][n], corners[k][n]))
+
+
+def read_floats(rows, width, out):
+    # the first width numbers of every row, which are 0 where it has fewer;
+    # rows that all have width numbers are parsed by numpy in one go
+    with warnings.catch_warnings():
+        # fromstring warns about text it can't parse, which the loop reports
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(" ".join(rows), sep=" ")
+    if len(values) == width * len(rows):
+        out.frombytes(values.tobytes())
+        return
+    for row in rows:
+        values = [float(x) for x in row.split()[:width]]
+        out.extend(values + [0.0] * (width - len(values)))
+
+
+def read_faces(rows, faces):
+    # parses and triangulates the faces with numpy if they all have the same
+    # "v", "v/vt", "v//vn" or "v/vt/vn" form, at least 3 corners and no
+    # negative indices; returns False, having added nothing, if they don't
+    text = " ".join(rows)
+    if "-" in text:
+        return False
+    text = text.replace("//", "/0/")
+    counts = np.array([len(row.split()) for row in rows])
+    tokens = text.split()
+    slashes = tokens[0].count("/")
+    if counts.min() < 3 or any(t.count("/") != slashes for t in tokens):
+        return False
+    width = slashes + 1
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(text.replace("/", " "), np.int64, sep=" ")
+    if len(values) != width * len(tokens):
+        return False
+    # OBJ indices start at 1, so missing ones, written as 0, become -1
+    values = values.reshape(len(tokens), width) - 1
+    # the fan of each face: its first corner with every pair of the others
+    triangles = counts - 2
+    face = np.repeat(np.arange(len(counts)), triangles)
+    k = np.arange(len(face)) - np.repeat(np.cumsum(triangles) - triangles, triangles)
+    c0 = (np.cumsum(counts) - counts)[face]
+    fan = np.stack((c0, c0 + k + 1, c0 + k + 2), axis=1).ravel()
+    for n, out in enumerate(faces):
+        if n < width:
+            out.frombytes(values[fan, n].astype(np.int32).tobytes())
+        else:
+            out.frombytes(np.full(len(fan), -1, np.int32).tobytes())
+    return True
+
+
+def obj_corner(corner, sizes):
+    # "v", "v/vt", "v//vn" or "v/vt/vn" as 0 based indices, -1 where missing;
+    # negative OBJ indices count back from the last one read
+    indices = []
+    for text, size in zip(corner.split("/"), sizes):
+        if not text:
+            indices.append(-1)
+            continue
+        index = int(text)
+        indices.append(index - 1 if index > 0 else size + index)
+    indices.extend([-1] * (3 - len(indices)))
+    return indices
@@ -1,65 +1,73 @@
-from . import randfloat,vec3
-from math import floor
+import random
+import numpy as np
+from . import vec3
+
+# offsets of the eight lattice corners around a point
+CORNERS = np.array([(i, j, k) for i in range(2) for j in range(2) for k in range(2)])
 
 
 class Perlin:
-    def __init__(self, point_count=256):
+    def __init__(self, point_count=256, seed=None):
+        # without a seed the tables come from the global random state, as
+        # they always have
+        rng = random if seed is None else random.Random(seed)
         self.pc = point_count
         self.rv = []
         for i in range(self.pc):
-            self.rv.append(vec3.random_unit())
-        self.px, self.py, self.pz = (self.gen_perm() for _ in range(3))
+            self.rv.append(random_unit(rng))
+        self.px, self.py, self.pz = (self.gen_perm(rng) for _ in range(3))
+        self.grad = np.array([tuple(v) for v in self.rv])
+        self.perm = np.array([self.px, self.py, self.pz])
 
     def noise(self, point):
-        i, j, k = (int(floor(x)) % self.pc for x in point)
-        u, v, w = (q % self.pc for q in (point - vec3.array([i, j, k])))
-        c = [
-            [
-                [
-                    self.rv[
-                        self.px[(i + di) & 255]
-                        ^ self.py[(j + dj) & 255]
-                        ^ self.pz[(k + dk) & 255]
-                    ]
-                    for dk in range(2)
-                ]
-                for dj in range(2)
-            ]
-            for di in range(2)
-        ]
-        return self.trilinear(c, u, v, w)
+        return float(self.noise_array([tuple(point)])[0])
+
+    def turb(self, point, depth):
+        return float(self.turb_array([tuple(point)], depth)[0])
+
+    def noise_array(self, points):
+        p = np.asarray(points, float).reshape(-1, 3)
+        f = np.floor(p)
+        frac = p - f
+        # (n, 8, 3) lattice coordinates of every corner, hashed to gradients
+        lattice = ((f.astype(np.int64) % self.pc)[:, None, :] + CORNERS) & 255
+        h = (
+            self.perm[0][lattice[..., 0]]
+            ^ self.perm[1][lattice[..., 1]]
+            ^ self.perm[2][lattice[..., 2]]
+        )
+        offset = frac[:, None, :] - CORNERS
+        dots = np.einsum("nci,nci->nc", self.grad[h], offset)
+        smooth = (frac * frac * (3 - 2 * frac))[:, None, :]
+        weights = np.where(CORNERS, smooth, 1 - smooth).prod(axis=2)
+        return (weights * dots).sum(axis=1)
 
-    def gen_perm(self):
-        return self.permute(range(self.pc))
+    def octaves(self, points, depth):
+        # (depth, n) noise at points scaled by 1, 2, 4, ... in one evaluation
+        p = np.asarray(points, float).reshape(-1, 3)
+        scaled = p[None] * (2.0 ** np.arange(depth))[:, None, None]
+        return self.noise_array(scaled.reshape(-1, 3)).reshape(depth, len(p))
 
-    def permute(self, p):
+    def turb_array(self, points, depth):
+        weights = 0.5 ** np.arange(depth)
+        return np.abs(weights @ self.octaves(points, depth))
+
+    def gen_perm(self, rng=random):
+        return self.permute(range(self.pc), rng)
+
+    def permute(self, p, rng=random):
         p = list(p)
         for i in range(len(p) - 1, -1, -1):
-            t = randfloat.randint(0, i)
+            t = rng.randint(0, i)
             p[i], p[t] = p[t], p[i]
         return p
 
-    def trilinear(self, c, u, v, w):
-        accum = 0
-        uu, vv, ww = (x**2 * (3 - 2 * x) for x in (u, v, w))
-        for i in range(2):
-            for j in range(2):
-                for k in range(2):
-                    weight = vec3.array([u - i, v - j, w - k])
-                    accum += (
-                        (i * uu + (1 - i) * (1 - uu))
-                        * (j * vv + (1 - j) * (1 - vv))
-                        * (k * ww + (1 - k) * (1 - ww))
-                        * vec3.dot(c[i][j][k], weight)
-                    )
-        return accum
 
-    def turb(self, point, depth):
-        accum = 0
-        p = point
-        weight = 1
-        for i in range(depth):
-            accum += weight * self.noise(p)
-            weight *= 0.5
-            p *= 2
-        return abs(accum)
+def random_unit(rng):
+    # vec3.Vec3.random_unit drawing from rng
+    while True:
+        x, y, z = 2 * rng.random() - 1, 2 * rng.random() - 1, 2 * rng.random() - 1
+        lsq = x * x + y * y + z * z
+        if 1e-160 < lsq <= 1:
+            s = 1 / lsq**0.5
+            return vec3.Vec3(x * s, y * s, z * s)
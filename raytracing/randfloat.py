@@ -1,4 +1,4 @@
-from random import random, randint
+from random import random
 
 
 def randfloat(min=0, max=1):
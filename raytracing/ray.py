@@ -1,7 +1,25 @@
+import math
+from . import vec3
+
+
 class Ray:
-    def __init__(self, origin, dir):
+    __slots__ = ("origin", "dir", "inv_dir", "near", "far", "width", "spread")
+
+    def __init__(self, origin, dir, width=0.0, spread=0.0):
         self.origin = origin
         self.dir = dir
+        # a cone around the ray: its width at the origin and how much that
+        # grows per unit of distance, used to filter textures
+        self.width = width
+        self.spread = spread
+        ix = 1 / dir.x if dir.x else math.inf
+        iy = 1 / dir.y if dir.y else math.inf
+        iz = 1 / dir.z if dir.z else math.inf
+        self.inv_dir = (ix, iy, iz)
+        # indices of the near and far slab planes in AABB.bounds
+        near = (3 if ix < 0 else 0, 4 if iy < 0 else 1, 5 if iz < 0 else 2)
+        self.near = near
+        self.far = (3 - near[0], 5 - near[1], 7 - near[2])
 
     def at(self, t):
-        return self.origin + self.dir * t
+        return vec3.at(self.origin, self.dir, t)
@@ -0,0 +1,24 @@
+import contextlib
+import os
+
+# the files read while something is recording them; loaders report what
+# they read, even when they find it cached in the process, so the scene
+# cache knows which files a scene was built from
+current = None
+
+
+def report(path):
+    if current is not None:
+        current.add(os.path.abspath(path))
+
+
+@contextlib.contextmanager
+def record():
+    global current
+    outer, current = current, set()
+    try:
+        yield current
+    finally:
+        if outer is not None:
+            outer |= current
+        current = outer
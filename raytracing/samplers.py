@@ -0,0 +1,238 @@
+import math
+import random
+
+MASK = 0xFFFFFFFF
+REVERSED = bytes(int(f"{b:08b}"[::-1], 2) for b in range(256))
+
+
+def mix(h, x):
+    # murmur3's finalizer over h ^ x, a 32 bit hash
+    h = ((h ^ x) * 0x85EBCA6B) & MASK
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & MASK
+    return h ^ (h >> 16)
+
+
+def reverse_bits(x):
+    # reverses the bytes' bits, then their order
+    return int.from_bytes(x.to_bytes(4, "little").translate(REVERSED), "big")
+
+
+def permute(i, n, p):
+    # element i of a permutation of range(n) picked by p, without building it
+    # (Kensler, "Correlated Multi-Jittered Sampling")
+    w = n - 1
+    w |= w >> 1
+    w |= w >> 2
+    w |= w >> 4
+    w |= w >> 8
+    w |= w >> 16
+    while True:
+        i ^= p
+        i = i * 0xE170893D & MASK
+        i ^= p >> 16
+        i ^= (i & w) >> 4
+        i ^= p >> 8
+        i = i * 0x0929EB3F & MASK
+        i ^= p >> 23
+        i ^= (i & w) >> 1
+        i = i * (1 | p >> 27) & MASK
+        i = i * 0x6935FA69 & MASK
+        i ^= (i & w) >> 11
+        i = i * 0x74DCB303 & MASK
+        i ^= (i & w) >> 2
+        i = i * 0x9E501CC3 & MASK
+        i ^= (i & w) >> 2
+        i = i * 0xC860A3DF & MASK
+        i &= w
+        i ^= i >> 5
+        if i < n:
+            return (i + p) % n
+
+
+def owen_scramble(x, seed):
+    # nested uniform scramble of the bit reversed 32 bit fraction x (Burley,
+    # "Practical Hash-based Owen Scrambling")
+    x = (x + seed) & MASK
+    x ^= x * 0x6C50B47C & MASK
+    x ^= x * 0xB82F1E52 & MASK
+    x ^= x * 0xC7AFE638 & MASK
+    x ^= x * 0x8D22F6E6 & MASK
+    return x
+
+
+def primes(n):
+    found = []
+    k = 2
+    while len(found) < n:
+        if all(k % p for p in found):
+            found.append(k)
+        k += 1
+    return found
+
+
+def sobol_tables():
+    # the second Sobol dimension, bit reversed, for each byte of the index:
+    # the xor of the direction numbers of its set bits
+    v = [1]
+    for _ in range(31):
+        v.append((v[-1] ^ v[-1] << 1) & MASK)
+    tables = []
+    for k in range(0, 32, 8):
+        table = [0]
+        for bit in v[k : k + 8]:
+            table += [x ^ bit for x in table]
+        tables.append(table)
+    return tables
+
+
+class Sampler:
+    # hands out the dimensions of one pixel sample in a fixed order: the pixel
+    # offset, the lens if there is one, then two per scatter; start() moves to
+    # sample index of pixel (i, j)
+    def __init__(self, samples_per_pixel=1, seed=0):
+        self.spp = max(samples_per_pixel, 1)
+        self.seed = seed
+        self.key = None
+        self.index = 0
+        self.dim = 0
+        # per dimension values that only depend on the pixel
+        self.params = {}
+        # pixel (0, 0) until start() picks one, so samples can be drawn before
+        self.start(0, 0, 0)
+
+    def reseed(self):
+        # tiles reseed from the global random state, which the camera seeds
+        # per tile, so scrambles are independent but reproducible
+        self.seed = random.getrandbits(32)
+
+    def start(self, i, j, index):
+        # hashes of int tuples don't depend on PYTHONHASHSEED
+        key = hash((self.seed, i, j)) & MASK
+        if key != self.key:
+            self.key = key
+            self.params = {}
+        self.index = index
+        self.dim = 0
+
+    def get_1d(self):
+        return random.random()
+
+    def get_2d(self):
+        return self.get_1d(), self.get_1d()
+
+
+class Independent(Sampler):
+    def start(self, i, j, index):
+        pass
+
+    def get_2d(self):
+        return random.random(), random.random()
+
+
+class Stratified(Sampler):
+    # each dimension splits [0, 1) into spp strata, [0, 1)^2 into a grid of
+    # about as many cells, and gives every sample of a pixel its own in a
+    # random order; indices past spp start another round
+    def __init__(self, samples_per_pixel=1, seed=0):
+        super().__init__(samples_per_pixel, seed)
+        self.nx = math.isqrt(self.spp)
+        self.ny = self.spp // self.nx
+
+    def stratum(self):
+        rnd, i = divmod(self.index, self.spp)
+        h = self.params.get((self.dim, rnd))
+        if h is None:
+            h = self.params[self.dim, rnd] = mix(mix(self.key, self.dim), rnd)
+        return permute(i, self.spp, h)
+
+    def get_1d(self):
+        s = self.stratum()
+        self.dim += 1
+        return (s + random.random()) / self.spp
+
+    def get_2d(self):
+        s = self.stratum()
+        self.dim += 2
+        if s >= self.nx * self.ny:
+            return random.random(), random.random()
+        y, x = divmod(s, self.nx)
+        return (x + random.random()) / self.nx, (y + random.random()) / self.ny
+
+
+class Halton(Sampler):
+    # the Halton sequence per pixel, with each digit of the radical inverse
+    # put through a random linear permutation of the base's digits; the
+    # dimensions past the last base are independent
+    BASES = primes(64)
+
+    def get_1d(self):
+        d = self.dim
+        self.dim += 1
+        if d >= len(self.BASES):
+            return random.random()
+        base, index = self.BASES[d], self.index
+        perm = self.params.get(d)
+        if perm is None or index >= perm[0]:
+            perm = self.params[d] = self.permutations(d, max(index + 1, self.spp))
+        value, scale = 0.0, 1.0
+        for a, c in perm[1]:
+            index, digit = divmod(index, base)
+            scale /= base
+            value += (digit * a + c) % base * scale
+        return value + perm[2] * scale
+
+    def permutations(self, d, n):
+        # digit permutations for indices below n: every sample of the pixel
+        # goes through as many digits as the largest, so they all see the
+        # same ones, and the scrambled zeros past them make a random tail
+        base, h = self.BASES[d], mix(self.key, d)
+        limit, perm = 1, []
+        while limit < n:
+            h = mix(h, 0x9E3779B9)
+            perm.append((1 + h % (base - 1) if base > 2 else 1, (h >> 16) % base))
+            limit *= base
+        return limit, perm, mix(h, 0x7F4A7C15) / 2**32
+
+
+class Sobol(Sampler):
+    # pairs of dimensions come from the first two dimensions of the Sobol
+    # sequence, Owen scrambled, with the sample order shuffled per pair by
+    # scrambling the index too so the pairs aren't correlated with each other
+    # (Burley, "Practical Hash-based Owen Scrambling")
+    TABLES = sobol_tables()
+
+    def seeds(self, d):
+        seeds = self.params.get(d)
+        if seeds is None:
+            h = mix(self.key, d)
+            seeds = self.params[d] = h, mix(h, 1), mix(h, 2)
+        return seeds
+
+    def get_1d(self):
+        h, s0, _ = self.seeds(self.dim)
+        self.dim += 1
+        index = reverse_bits(owen_scramble(reverse_bits(self.index), h))
+        return reverse_bits(owen_scramble(index, s0)) / 2**32
+
+    def get_2d(self):
+        h, s0, s1 = self.seeds(self.dim)
+        self.dim += 2
+        index = reverse_bits(owen_scramble(reverse_bits(self.index), h))
+        # both dimensions in bit reversed form: the first is index itself
+        t0, t1, t2, t3 = self.TABLES
+        y = t0[index & 255] ^ t1[index >> 8 & 255] ^ t2[index >> 16 & 255]
+        y ^= t3[index >> 24]
+        return (
+            reverse_bits(owen_scramble(index, s0)) / 2**32,
+            reverse_bits(owen_scramble(y, s1)) / 2**32,
+        )
+
+
+SAMPLERS = {
+    "independent": Independent,
+    "stratified": Stratified,
+    "halton": Halton,
+    "sobol": Sobol,
+}
+INDEPENDENT = Independent()
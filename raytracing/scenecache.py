@@ -0,0 +1,162 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import random
+import sys
+import numpy as np
+from . import bvh, reads, shapes
+
+# where built scenes are kept between runs
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "raytracing", "scenes")
+# bumped when the layout of a cached scene changes
+FORMAT = 1
+# arrays start at multiples of this in the array file
+ALIGN = 64
+
+
+def sources():
+    # the package's code, which decides what a scene builds to
+    h = hashlib.sha256()
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith(".py"):
+            with open(os.path.join(package, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+    return h.hexdigest()
+
+
+def key(name, seed, use_bvh=True):
+    # scenes open their files by relative paths, so the working directory
+    # is part of what they are
+    params = [FORMAT, name, seed, use_bvh, os.getcwd()]
+    params += [sys.version_info[:2], np.__version__]
+    return hashlib.sha256(json.dumps(params).encode() + sources().encode()).hexdigest()
+
+
+def file_state(path):
+    # None for files that are missing, which a scene may have tried
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def inputs(paths):
+    # the state of each file a build read
+    return {path: file_state(path) for path in sorted(paths)}
+
+
+def prebuilt(world):
+    # lists get a BVH, flattened, so loading doesn't have to build one
+    if isinstance(world, shapes.HittableList) and len(world.hittables) > 1:
+        return bvh.BVH.from_hittable_list(world).compile()
+    return world
+
+
+def build(name, seed=0, use_bvh=True):
+    # the world of scene name, prebuilt unless use_bvh is off, the settings of
+    # its camera and the files the loaders reported reading; seed fixes what
+    # scenes draw from the global random state
+    from .scenes import SCENES
+
+    if name not in SCENES:
+        raise ValueError(f"unknown scene: {name}")
+    state = random.getstate()
+    try:
+        with reads.record() as paths:
+            random.seed(seed)
+            cam, world = SCENES[name]()
+            if use_bvh:
+                world = prebuilt(world)
+    finally:
+        random.setstate(state)
+    return world, cam.settings, inputs(paths)
+
+
+class Pickler(pickle.Pickler):
+    # arrays mapped from other files are pickled as plain arrays, so they go
+    # out of band like the rest
+    def reducer_override(self, obj):
+        if isinstance(obj, np.memmap):
+            return obj.view(np.ndarray).__reduce_ex__(5)
+        return NotImplemented
+
+
+def replace(path, write):
+    with open(path + ".tmp", "wb") as f:
+        write(f)
+    os.replace(path + ".tmp", path)
+
+
+def save(directory, world, settings, files):
+    # the object graph is pickled to scene.pickle with its arrays out of band,
+    # laid end to end in arrays.bin so loading can map them; manifest.json is
+    # written last, so its presence means the rest is complete
+    os.makedirs(directory, exist_ok=True)
+    manifest = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest):
+        os.remove(manifest)
+    buffers = []
+    data = io.BytesIO()
+    Pickler(data, 5, buffer_callback=buffers.append).dump((world, settings))
+    layout, end = [], 0
+    for buf in buffers:
+        end = -(-end // ALIGN) * ALIGN
+        layout.append((end, buf.raw().nbytes))
+        end += buf.raw().nbytes
+
+    def write_arrays(f):
+        for (start, _), buf in zip(layout, buffers):
+            f.seek(start)
+            f.write(buf.raw())
+        f.truncate(end)
+
+    replace(os.path.join(directory, "arrays.bin"), write_arrays)
+    replace(os.path.join(directory, "scene.pickle"), lambda f: f.write(data.getvalue()))
+    state = {"format": FORMAT, "buffers": layout, "files": files}
+    replace(manifest, lambda f: f.write(json.dumps(state).encode()))
+
+
+def load(directory):
+    # (world, camera settings), or None if nothing is cached in directory or
+    # a file the scene read has changed since; arrays come back read only,
+    # mapped from arrays.bin
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest["format"] != FORMAT:
+        return None
+    for path, state in manifest["files"].items():
+        if file_state(path) != state:
+            return None
+    path = os.path.join(directory, "arrays.bin")
+    if os.path.getsize(path):
+        arrays = np.memmap(path, np.uint8, "r")
+    else:
+        arrays = b""
+    buffers = [arrays[start : start + n] for start, n in manifest["buffers"]]
+    with open(os.path.join(directory, "scene.pickle"), "rb") as f:
+        return pickle.load(f, buffers=buffers)
+
+
+def scene(name, seed=0, cache_dir=CACHE_DIR, use_bvh=True, **overrides):
+    # like SCENES[name](**overrides), but the world is built once per seed
+    # and then loaded from cache_dir; None for cache_dir always builds
+    from .trace import Camera
+
+    if cache_dir is None:
+        world, settings, _ = build(name, seed, use_bvh)
+    else:
+        directory = os.path.join(cache_dir, key(name, seed, use_bvh))
+        cached = load(directory)
+        if cached is None:
+            world, settings, files = build(name, seed, use_bvh)
+            save(directory, world, settings, files)
+        else:
+            world, settings = cached
+    return Camera(**dict(settings, **overrides)), world
@@ -1,5 +1,4 @@
-from collections import namedtuple
-import math,sys
+import math,random
 from . import aabb,vec3
 
 """HitResult = namedtuple(
@@ -7,8 +6,22 @@ from . import aabb,vec3
     ("p", "normal", "t", "front_face", "material", "u", "v"),
     defaults=(None, None, None, None, None, None, None),
 )"""
-log=open("hcc_normal.log",'w')
 class HitResult:
+    __slots__ = (
+        "p",
+        "normal",
+        "t",
+        "front_face",
+        "material",
+        "u",
+        "v",
+        "obj",
+        "index",
+        "inner",
+        "width",
+        "footprint",
+    )
+
     def __init__(self, p=None, normal=None, t=None, front_face=None, material=None, u=None, v=None):
         self.p = p
         self.normal = normal
@@ -17,50 +30,115 @@ class HitResult:
         self.material = material
         self.u = u
         self.v = v
+        self.obj = None
+        # which of obj's parts was hit, for primitives made of many
+        self.index = None
+        # what an instance's hittable recorded, until the instance finalizes
+        self.inner = None
+        self.width = 0.0
+        self.footprint = 0.0
+
+
+def set_footprint(ray, rec, uv_extent):
+    # rec.width is the ray cone's width at the hit, rec.footprint the same in
+    # uv units, stretched by how obliquely the ray meets the surface
+    if not ray.spread and not ray.width:
+        rec.width = rec.footprint = 0.0
+        return
+    d, n = ray.dir, rec.normal
+    length = d.length
+    rec.width = ray.width + ray.spread * rec.t * length
+    cos = abs(d.x * n.x + d.y * n.y + d.z * n.z) / length
+    rec.footprint = rec.width / (max(cos, MIN_COS) * uv_extent)
+
+
+# caps the stretch of footprints at grazing angles
+MIN_COS = 0.05
+
+
 class Hittable:
-    def hit(self, *args):
-        hit, *hr = self._hit(*args)
-        return hit, HitResult(*hr)
+    # _hit only records t and the primitive in rec; the rest of the record is
+    # filled in by finalize, once, for the closest hit
+    def hit(self, ray, ray_tmin, ray_tmax, rec=None):
+        if rec is None:
+            rec = HitResult()
+        if not self._hit(ray, ray_tmin, ray_tmax, rec):
+            return False, rec
+        rec.obj.finalize(ray, rec)
+        return True, rec
 
-    def _hit(self, *args):
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
         raise NotImplementedError("can't call hit on plain Hittable instance")
 
+    def finalize(self, ray, rec):
+        raise NotImplementedError("can't finalize a hit on plain Hittable instance")
+
 
 class Sphere(Hittable):
     def __init__(self, center, radius, material):
         self.center = center
         self.radius = radius
         self.material = material
+        # uv_extent is the square root of the world area one unit of uv covers
+        self.uv_extent = math.pi * math.sqrt(2) * radius
         rvec = vec3.array([radius, radius, radius])
         self.bbox = aabb.AABB.from_points(center - rvec, center + rvec)
 
-    def _hit(self, ray, ray_tmin, ray_tmax, *args):
-        oc = self.center - ray.origin
-        a = ray.dir.length_squared 
-        h = vec3.dot(ray.dir, oc)
-        c = oc.length_squared - self.radius**2
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
+        c, o, d = self.center, ray.origin, ray.dir
+        ocx, ocy, ocz = c.x - o.x, c.y - o.y, c.z - o.z
+        a = d.x * d.x + d.y * d.y + d.z * d.z
+        h = d.x * ocx + d.y * ocy + d.z * ocz
+        c = ocx * ocx + ocy * ocy + ocz * ocz - self.radius**2
         d = h**2 - a * c
         if d < 0:
-            return (False,)
+            return False
         sqrtd = d ** (0.5)
         root = (h - sqrtd) / a
         if root <= ray_tmin or ray_tmax <= root:
             root = (h + sqrtd) / a
             if root <= ray_tmin or ray_tmax <= root:
-                return (False,)
-        p = ray.at(root)
-        outward_normal = (p - self.center) / self.radius
+                return False
+        rec.t = root
+        rec.obj = self
+        return True
+
+    def finalize(self, ray, rec):
+        p = ray.at(rec.t)
+        outward_normal = (p - self.center).iscale(1 / self.radius)
         is_front = vec3.dot(ray.dir, outward_normal) < 0
-        normal = (-1) ** (not is_front) * outward_normal
-        return (
-            True,
-            p,
-            normal,
-            root,
-            is_front,
-            self.material,
-            *self.getuv(normal),
-        )
+        normal = outward_normal if is_front else outward_normal.iscale(-1)
+        rec.p = p
+        rec.normal = normal
+        rec.front_face = is_front
+        rec.material = self.material
+        rec.u, rec.v = self.getuv(normal)
+        set_footprint(ray, rec, self.uv_extent)
+
+    # light sampling: directions are drawn uniformly from the cone the sphere
+    # subtends, so the pdf only depends on where they start
+    def sample_direction(self, origin):
+        c = self.center
+        dx, dy, dz = c.x - origin.x, c.y - origin.y, c.z - origin.z
+        dist_sq = dx * dx + dy * dy + dz * dz
+        if dist_sq <= self.radius**2:
+            return None
+        cos_max = math.sqrt(1 - self.radius**2 / dist_sq)
+        z = 1 + random.random() * (cos_max - 1)
+        phi = 2 * math.pi * random.random()
+        s = math.sqrt(1 - z * z)
+        w = vec3.Vec3(dx, dy, dz).iscale(1 / math.sqrt(dist_sq))
+        u, v = vec3.onb(w)
+        w.iscale(z).iadd(u.iscale(math.cos(phi) * s))
+        return w.iadd(v.iscale(math.sin(phi) * s))
+
+    def light_pdf(self, ray, rec):
+        c, o = self.center, ray.origin
+        dist_sq = (c.x - o.x) ** 2 + (c.y - o.y) ** 2 + (c.z - o.z) ** 2
+        if dist_sq <= self.radius**2:
+            return 0
+        cos_max = math.sqrt(1 - self.radius**2 / dist_sq)
+        return 1 / (2 * math.pi * (1 - cos_max))
 
     def getuv(self, p):
         theta, phi = math.acos(-p[1]), math.atan2(-p[2], p[0]) + math.pi
@@ -79,34 +157,86 @@ class Quad(Hittable):
         self.u = u
         self.v = v
         self.material = material
-        self.normal = n / vec3.linalg.norm(n)
+        self.normal = n / n.length
+        self.area = n.length
+        self.uv_extent = math.sqrt(self.area)
         self.d = vec3.dot(self.normal, q)
         self.w = n / vec3.dot(n, n)
+        self.bbox = aabb.AABB.merge(
+            aabb.AABB.from_points(q, q + u + v), aabb.AABB.from_points(q + u, q + v)
+        ).pad(1e-4)
 
-    def _hit(self, ray, ray_tmin, ray_tmax):
-        dn = vec3.dot(self.normal, ray.dir)
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
+        n, o, d = self.normal, ray.origin, ray.dir
+        dn = n.x * d.x + n.y * d.y + n.z * d.z
         if abs(dn) < 1e-8:
-            return (False,)
-        t = (self.d - vec3.dot(self.normal, ray.origin)) / dn
+            return False
+        t = (self.d - (n.x * o.x + n.y * o.y + n.z * o.z)) / dn
         if t <= ray_tmin or ray_tmax <= t:
-            return (False,)
+            return False
+
+        q, u, v, w = self.q, self.u, self.v, self.w
+        hx = o.x + d.x * t - q.x
+        hy = o.y + d.y * t - q.y
+        hz = o.z + d.z * t - q.z
+        alpha = (
+            w.x * (hy * v.z - hz * v.y)
+            + w.y * (hz * v.x - hx * v.z)
+            + w.z * (hx * v.y - hy * v.x)
+        )
+        if not 0 < alpha < 1:
+            return False
+        beta = (
+            w.x * (u.y * hz - u.z * hy)
+            + w.y * (u.z * hx - u.x * hz)
+            + w.z * (u.x * hy - u.y * hx)
+        )
+        if not 0 < beta < 1:
+            return False
+        # a quad's uv is its plane coordinates, so they are stored right away
+        rec.t = t
+        rec.obj = self
+        rec.u = alpha
+        rec.v = beta
+        return True
+
+    def finalize(self, ray, rec):
+        is_front = vec3.dot(self.normal, ray.dir) < 0
+        rec.p = ray.at(rec.t)
+        rec.normal = self.normal if is_front else -self.normal
+        rec.front_face = is_front
+        rec.material = self.material
+        set_footprint(ray, rec, self.uv_extent)
 
-        intersection = ray.at(t)
-        hitpt_vector = intersection - self.q
-        alpha = vec3.dot(self.w, vec3.cross(hitpt_vector, self.v))
-        beta = vec3.dot(self.w, vec3.cross(self.u, hitpt_vector))
-        if not ((0 < alpha < 1) and (0 < beta < 1)):
-            return (False,)
-        is_front = vec3.dot(ray.dir, self.normal) < 0
-        normal = (-1) ** (is_front) * self.normal
-        return (True, intersection, normal, t, is_front, self.material, alpha, beta)
+    # light sampling: points are drawn uniformly over the area, so the pdf in
+    # solid angle is distance squared over the projected area
+    def sample_direction(self, origin):
+        a, b = random.random(), random.random()
+        q, u, v = self.q, self.u, self.v
+        return vec3.Vec3(
+            q.x + a * u.x + b * v.x - origin.x,
+            q.y + a * u.y + b * v.y - origin.y,
+            q.z + a * u.z + b * v.z - origin.z,
+        )
+
+    def light_pdf(self, ray, rec):
+        d, n = ray.dir, self.normal
+        length_sq = d.x * d.x + d.y * d.y + d.z * d.z
+        cos = abs(d.x * n.x + d.y * n.y + d.z * n.z) / math.sqrt(length_sq)
+        if cos < 1e-8:
+            return 0
+        return rec.t * rec.t * length_sq / (cos * self.area)
+
+    def bounding_box(self):
+        return self.bbox
 
 
 class HittableList(Hittable):
-    def __init__(self, hittables=[]):
-        self.hittables = hittables
-        self.hcc = 0
+    def __init__(self, hittables=None):
+        self.hittables = [] if hittables is None else hittables
         self.bbox = aabb.AABB.empty()
+        for hittable in self.hittables:
+            self.bbox = aabb.AABB.merge(self.bbox, hittable.bounding_box())
 
     def add(self, hittable):
         self.hittables.append(hittable)
@@ -116,20 +246,14 @@ class HittableList(Hittable):
         self.hittables = []
         self.bbox = aabb.AABB.empty
 
-    def _hit(self, ray, ray_tmin, ray_tmax):
-        self.hcc+=1
-        print("HC Calls(no BVH)", self.hcc, file=log)
+    def _hit(self, ray, ray_tmin, ray_tmax, rec):
         hit_anything = False
-        closest = ray_tmax
-        result = ()
         for hittable in self.hittables:
-            did_hit, *tresult = hittable._hit(ray, ray_tmin, closest)
-            if did_hit:
+            if hittable._hit(ray, ray_tmin, ray_tmax, rec):
                 hit_anything = True
-                result = tresult
-                closest = result[2]
+                ray_tmax = rec.t
 
-        return hit_anything, *result
+        return hit_anything
 
     def bounding_box(self):
         return self.bbox
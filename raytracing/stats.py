@@ -0,0 +1,138 @@
+import contextlib
+import functools
+from . import bvh, shapes, trace
+
+# the Stats being collected into, or None; instrumentation is patched in only
+# while collecting, so disabled stats cost nothing on the scalar paths
+current = None
+_restore = []
+
+
+class Stats:
+    def __init__(self):
+        self.rays = []
+        # next event estimation's rays toward lights, which rays leaves out
+        self.shadow_rays = 0
+        self.bvh_nodes = 0
+        self.box_tests = 0
+        self.prim_tests = {}
+
+    def count_rays(self, depth, n=1):
+        if depth >= len(self.rays):
+            self.rays.extend([0] * (depth + 1 - len(self.rays)))
+        self.rays[depth] += n
+
+    def count_prims(self, name, n=1):
+        self.prim_tests[name] = self.prim_tests.get(name, 0) + n
+
+    def as_dict(self):
+        return {
+            "rays": sum(self.rays),
+            "rays_per_depth": list(self.rays),
+            "shadow_rays": self.shadow_rays,
+            "bvh_nodes_visited": self.bvh_nodes,
+            "ray_box_tests": self.box_tests,
+            "ray_primitive_tests": dict(self.prim_tests),
+        }
+
+    def merge(self, d):
+        for depth, n in enumerate(d["rays_per_depth"]):
+            self.count_rays(depth, n)
+        self.shadow_rays += d["shadow_rays"]
+        self.bvh_nodes += d["bvh_nodes_visited"]
+        self.box_tests += d["ray_box_tests"]
+        for name, n in d["ray_primitive_tests"].items():
+            self.count_prims(name, n)
+
+    def take(self):
+        d = self.as_dict()
+        self.__init__()
+        return d
+
+
+def primitive_classes(cls=shapes.Hittable):
+    for sub in cls.__subclasses__():
+        if "finalize" in vars(sub) and "_hit" in vars(sub):
+            yield sub
+        yield from primitive_classes(sub)
+
+
+def patch(cls, name, make_wrapper):
+    fn = vars(cls)[name]
+    _restore.append((cls, name, fn))
+    setattr(cls, name, functools.wraps(fn)(make_wrapper(fn)))
+
+
+def start():
+    global current
+    if current is not None:
+        raise RuntimeError("already collecting stats")
+    st = current = Stats()
+
+    def ray_color(fn):
+        def wrapper(self, r, world, bounces, *args):
+            color = fn(self, r, world, bounces, *args)
+            # a path of n segments traced one ray at each depth below n
+            for depth in range(self.path_length):
+                st.count_rays(depth)
+            return color
+
+        return wrapper
+
+    def shadow_hit(fn):
+        def wrapper(self, *args):
+            st.shadow_rays += 1
+            return fn(self, *args)
+
+        return wrapper
+
+    def bvh_node(fn):
+        def wrapper(self, *args):
+            st.bvh_nodes += 1
+            st.box_tests += 1
+            return fn(self, *args)
+
+        return wrapper
+
+    def flat_bvh(fn):
+        def wrapper(self, ray, ray_tmin, ray_tmax, rec):
+            return self._traverse(ray, ray_tmin, ray_tmax, rec, st)
+
+        return wrapper
+
+    def primitive(name):
+        def make_wrapper(fn):
+            def wrapper(self, *args):
+                st.count_prims(name)
+                return fn(self, *args)
+
+            return wrapper
+
+        return make_wrapper
+
+    patch(trace.Camera, "ray_color", ray_color)
+    patch(trace.Camera, "shadow_hit", shadow_hit)
+    patch(bvh.BVH, "_hit", bvh_node)
+    # FlatBVHs, meshes and instances count their own nodes and triangles
+    patch(bvh.FlatTree, "_hit", flat_bvh)
+    for cls in set(primitive_classes()):
+        patch(cls, "_hit", primitive(cls.__name__))
+    return st
+
+
+def stop():
+    global current
+    while _restore:
+        cls, name, fn = _restore.pop()
+        setattr(cls, name, fn)
+    st, current = current, None
+    return st
+
+
+@contextlib.contextmanager
+def collect():
+    st = start()
+    try:
+        yield st
+    finally:
+        stop()
@@ -0,0 +1,96 @@
+import collections
+import hashlib
+import os
+import numpy as np
+from . import reads
+
+# decoded images are shared by every texture in the process that uses the same
+# file, and dropped least recently used first once they exceed the budget
+DEFAULT_BUDGET = 256 * 2**20
+
+
+class TextureCache:
+    def __init__(self, budget=DEFAULT_BUDGET, dtype=np.uint8, mmap_dir=None):
+        if np.dtype(dtype) not in (np.uint8, np.float32):
+            raise ValueError(f"textures are stored as uint8 or float32, not {dtype}")
+        self.budget = budget
+        self.dtype = np.dtype(dtype)
+        self.mmap_dir = mmap_dir
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, path):
+        # the image's mip pyramid as a list of (h, w, 3) arrays, full size
+        # first; raises OSError if the file can't be read
+        path = os.path.abspath(path)
+        reads.report(path)
+        key = path, os.stat(path).st_mtime_ns
+        levels = self.entries.get(key)
+        if levels is not None:
+            self.entries.move_to_end(key)
+            return levels
+        levels = self.load(*key)
+        self.entries[key] = levels
+        self.size += nbytes(levels)
+        while self.size > self.budget and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.size -= nbytes(old)
+        return levels
+
+    def load(self, path, mtime):
+        if self.mmap_dir is None:
+            return self.decode(path)
+        name = hashlib.sha1(f"{path}:{mtime}:{self.dtype}".encode()).hexdigest()
+        name = os.path.join(self.mmap_dir, name)
+        # the level count is written last, so its presence means every level is
+        if not os.path.exists(name + ".levels"):
+            os.makedirs(self.mmap_dir, exist_ok=True)
+            levels = self.decode(path)
+            for k, level in enumerate(levels):
+                with open(f"{name}-{k}.npy.tmp", "wb") as f:
+                    np.save(f, level)
+                os.replace(f"{name}-{k}.npy.tmp", f"{name}-{k}.npy")
+            with open(name + ".levels.tmp", "w") as f:
+                f.write(str(len(levels)))
+            os.replace(name + ".levels.tmp", name + ".levels")
+        with open(name + ".levels") as f:
+            n = int(f.read())
+        return [np.load(f"{name}-{k}.npy", mmap_mode="r") for k in range(n)]
+
+    def decode(self, path):
+        from PIL import Image as PILImage
+
+        with PILImage.open(path) as img:
+            data = np.asarray(img.convert("RGB")).astype(np.float32)
+        levels = [data]
+        while max(data.shape[:2]) > 1:
+            data = downsample(data)
+            levels.append(data)
+        if self.dtype == np.float32:
+            return [level * np.float32(1 / 255) for level in levels]
+        return [np.rint(level).astype(np.uint8) for level in levels]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+def downsample(data):
+    # box filter each 2x2 block; an odd last row or column is repeated
+    h, w = data.shape[:2]
+    data = np.pad(data, ((0, h % 2), (0, w % 2), (0, 0)), mode="edge")
+    return (
+        data[0::2, 0::2] + data[1::2, 0::2] + data[0::2, 1::2] + data[1::2, 1::2]
+    ) / 4
+
+
+def nbytes(levels):
+    # mapped pixels are paged in by the OS and don't count against the budget
+    return sum(0 if isinstance(a, np.memmap) else a.nbytes for a in levels)
+
+
+cache = TextureCache()
+
+
+def get(path):
+    return cache.get(path)
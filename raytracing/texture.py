@@ -1,8 +1,20 @@
-from PIL import Image as PILImage
-from numpy import float64, asarray
+import hashlib
+import json
+import os
+import numpy as np
 import sys
 import math
-from . import interval, perlin, vec3
+from . import grid, perlin, texcache, vec3
+
+# what textures whose image couldn't be loaded render as
+MISSING = vec3.Vec3(1, 0, 0)
+
+# where baked noise grids are kept between runs
+NOISE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "raytracing", "noise")
+# points a baked grid is checked at against the tolerance, and the most
+# samples it may be refined to
+CHECK_POINTS = 4096
+MAX_VOXELS = 2**26
 
 
 class Texture:
@@ -13,14 +25,27 @@ class Texture:
             return obj
         return SolidColor(obj)
 
+    def sample_array(self, u, v, p, footprint=None):
+        if footprint is None:
+            footprint = np.zeros(len(u))
+        return np.array(
+            [
+                tuple(self.sample(ui, vi, vec3.array(pi), fi))
+                for ui, vi, pi, fi in zip(u, v, p, footprint)
+            ]
+        ).reshape(-1, 3)
+
 
 class SolidColor(Texture):
     def __init__(self, albedo):
         self.albedo = albedo
 
-    def sample(self, u, v, p):
+    def sample(self, u, v, p, footprint=0):
         return self.albedo
 
+    def sample_array(self, u, v, p, footprint=None):
+        return np.broadcast_to(tuple(self.albedo), (len(u), 3))
+
 
 class Checkered(Texture):
     def __init__(self, scale, even, odd):
@@ -28,49 +53,195 @@ class Checkered(Texture):
         self.even = even
         self.odd = odd
 
-    def sample(self, u, v, p):
+    def sample(self, u, v, p, footprint=0):
         xi, yi, zi = map(int, self.inv_scale * p)
         if (xi + yi + zi) % 2:
-            return self.odd.sample(u, v, p)
-        return self.even.sample(u, v, p)
+            return self.odd.sample(u, v, p, footprint)
+        return self.even.sample(u, v, p, footprint)
+
+    def sample_array(self, u, v, p, footprint=None):
+        odd = np.trunc(self.inv_scale * p).astype(int).sum(axis=1) % 2 == 1
+        out = np.empty((len(u), 3))
+        for sel, tex in ((odd, self.odd), (~odd, self.even)):
+            if sel.any():
+                fp = None if footprint is None else footprint[sel]
+                out[sel] = tex.sample_array(u[sel], v[sel], p[sel], fp)
+        return out
 
 
 class Image(Texture):
     def __init__(self, path):
         try:
-            self.img_data = asarray(PILImage.open(path)) * (1 / 255)
-        except:
+            self.levels = texcache.get(path)
+        except OSError as e:
+            print(f"could not load image {path}: {e}", file=sys.stderr)
             self.img_data = None
+            return
+        self.img_data = self.levels[0]
+        self.h, self.w = self.img_data.shape[:2]
+        self.size = max(self.w, self.h)
+        self.scale = 1 / 255 if self.img_data.dtype == np.uint8 else 1
+        self.texels = [texel_view(level) for level in self.levels]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("texels", None)
+        return state
 
-    def sample(self, u, v, p):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.img_data is not None:
+            self.texels = [texel_view(level) for level in self.levels]
+
+    def sample(self, u, v, p, footprint=0):
         if self.img_data is None:
-            return numpy.array([1, 0, 0])
-        u = interval.Interval(0, 1).clamp(u)
-        v = 1 - interval.Interval(0, 1).clamp(v)
-        i = u * len(self.img_data[0])
-        j = v * len(self.img_data)
-        # print(i,j,u,v,file=sys.stderr)
-        pixel = self.img_data[int(j) - 1][int(i) - 1]
-        return vec3.Vec3(*pixel)
+            return MISSING
+        # footprint is the hit's width in uv units; the level is picked so a
+        # texel is about as wide as the footprint
+        texels = footprint * self.size
+        if texels < 2:
+            level = 0
+            w, h = self.w, self.h
+        else:
+            level = min(int(texels).bit_length() - 1, len(self.levels) - 1)
+            h, w = self.levels[level].shape[:2]
+        i = int((0.0 if u < 0 else 1.0 if u > 1 else u) * w)
+        j = int((1.0 if v < 0 else 0.0 if v > 1 else 1 - v) * h)
+        k = 3 * ((j if j < h else h - 1) * w + (i if i < w else w - 1))
+        t, s = self.texels[level], self.scale
+        return vec3.Vec3(t[k] * s, t[k + 1] * s, t[k + 2] * s)
+
+    def sample_array(self, u, v, p, footprint=None):
+        if self.img_data is None:
+            return np.broadcast_to(tuple(MISSING), (len(u), 3))
+        if footprint is None:
+            return self.lookup(0, u, v)
+        texels = np.maximum(footprint * self.size, 1)
+        level = np.minimum(np.log2(texels).astype(int), len(self.levels) - 1)
+        out = np.empty((len(u), 3))
+        for k in np.unique(level):
+            sel = level == k
+            out[sel] = self.lookup(k, u[sel], v[sel])
+        return out
+
+    def lookup(self, level, u, v):
+        data = self.levels[level]
+        h, w = data.shape[:2]
+        i = np.minimum((np.clip(u, 0, 1) * w).astype(int), w - 1)
+        j = np.minimum(((1 - np.clip(v, 0, 1)) * h).astype(int), h - 1)
+        return data[j, i] * self.scale
+
+
+def texel_view(data):
+    # flat view for the scalar path: indexing it makes no numpy scalars, and
+    # uint8 texels come back as cached small ints
+    return memoryview(np.ascontiguousarray(data).reshape(-1))
 
 
 class Noise(Texture):
-    def __init__(self, scale=1, mode="normal", turb_depth=7, albedo=vec3.Vec3(1, 1, 1)):
-        self.noise = perlin.Perlin()
+    def __init__(
+        self, scale=1, mode="normal", turb_depth=7, albedo=vec3.Vec3(1, 1, 1), seed=None
+    ):
+        self.noise = perlin.Perlin(seed=seed)
         self.scale = scale
         self.albedo = albedo
         self.mode = mode
         self.turb_depth = turb_depth
+        self.seed = seed
+        self.grid = None
+
+    def bake(self, box, resolution=64, tolerance=None, cache_dir=NOISE_CACHE):
+        # samples inside box come from a baked grid of the Perlin part of the
+        # texture, the rest is evaluated as before; with a tolerance the grid
+        # is refined until baked values are within it at CHECK_POINTS points
+        lo = tuple(ax.start for ax in box.axes) if hasattr(box, "axes") else box[0]
+        hi = tuple(ax.end for ax in box.axes) if hasattr(box, "axes") else box[1]
+        lo, hi = tuple(map(float, lo)), tuple(map(float, hi))
+        shape = (resolution,) * 3 if isinstance(resolution, int) else tuple(resolution)
+        path = None
+        if cache_dir is not None:
+            params = [self.seed, self.scale, self.mode, self.turb_depth]
+            key = json.dumps(params + [lo, hi, shape, tolerance]).encode()
+            # the tables stand in for the seed when there isn't one
+            tables = self.noise.grad.tobytes() + self.noise.perm.tobytes()
+            digest = hashlib.sha1(key + tables).hexdigest()
+            path = os.path.join(cache_dir, f"noise-{digest}.npy")
+            if os.path.exists(path):
+                self.grid = grid.Grid(lo, hi, np.load(path, mmap_mode="r"))
+                return self
+        self.grid = grid.Grid.sample(self.field_array, lo, hi, shape)
+        if tolerance is not None:
+            p = np.random.default_rng(0).uniform(lo, hi, (CHECK_POINTS, 3))
+            exact = self.text_array(p, self.field_array(p))
+            while True:
+                baked = self.text_array(p, self.grid.lookup_array(p)[0])
+                if np.abs(baked - exact).max() <= tolerance:
+                    break
+                shape = tuple(2 * n for n in shape)
+                if np.prod(shape) > MAX_VOXELS:
+                    print(
+                        f"noise grid stops at {self.grid.shape}, short of"
+                        f" tolerance {tolerance}",
+                        file=sys.stderr,
+                    )
+                    break
+                self.grid = grid.Grid.sample(self.field_array, lo, hi, shape)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, self.grid.values)
+            os.replace(path + ".tmp", path)
+        return self
 
-    def sample(self, u, v, p):
+    def field(self, p):
+        # the Perlin part of the texture, which is what gets baked
+        if self.grid is not None:
+            value = self.grid.lookup(p.x, p.y, p.z)
+            if value is not None:
+                return value
         if self.mode == "normal":
-            text = 0.5 * (1 + self.noise.noise(p * self.scale))
+            return self.noise.noise(p * self.scale)
+        if self.mode == "turb":
+            return self.noise.turb(p * self.scale, self.turb_depth)
+        if self.mode == "sine":
+            return self.noise.turb(p, self.turb_depth)
+        return 0
+
+    def field_array(self, p):
+        if self.mode == "normal":
+            return self.noise.noise_array(p * self.scale)
+        if self.mode == "turb":
+            return self.noise.turb_array(p * self.scale, self.turb_depth)
+        if self.mode == "sine":
+            return self.noise.turb_array(p, self.turb_depth)
+        return np.zeros(len(p))
+
+    def sample(self, u, v, p, footprint=0):
+        field = self.field(p)
+        if self.mode == "normal":
+            text = 0.5 * (1 + field)
         elif self.mode == "turb":
-            text = self.noise.turb(p * self.scale, self.turb_depth)
+            text = field
         elif self.mode == "sine":
-            text = 1 + math.sin(
-                self.scale * p.z + 10 * self.noise.turb(p, self.turb_depth)
-            )
+            text = 1 + math.sin(self.scale * p.z + 10 * field)
         else:
             text = 1
         return self.albedo * text
+
+    def text_array(self, p, field):
+        if self.mode == "normal":
+            return 0.5 * (1 + field)
+        if self.mode == "turb":
+            return field
+        if self.mode == "sine":
+            return 1 + np.sin(self.scale * p[:, 2] + 10 * field)
+        return np.ones(len(p))
+
+    def sample_array(self, u, v, p, footprint=None):
+        if self.grid is None:
+            field = self.field_array(p)
+        else:
+            field, inside = self.grid.lookup_array(p)
+            if not inside.all():
+                field[~inside] = self.field_array(p[~inside])
+        return self.text_array(p, field)[:, None] * tuple(self.albedo)
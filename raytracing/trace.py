@@ -1,8 +1,11 @@
-from . import ray, vec3, ppm, shapes, interval, material
-import tqdm
+from . import framebuffer, lights, ray, samplers, vec3, shapes, material
 import random
+import sys
+import json
+import contextlib
+import numpy as np
 import math
-from functools import lru_cache
+import time
 
 
 class Camera:
@@ -19,9 +22,20 @@ class Camera:
         defocus_angle=0,
         focus_dist=10,
         background=vec3.Vec3(0.7, 0.8, 1),
+        noise_threshold=None,
+        min_samples_per_pixel=8,
+        max_samples_per_pixel=None,
+        texture_filtering=False,
+        light_sampling=False,
+        roulette_depth=None,
+        sampler="independent",
+        aovs=False,
     ):  #
         self.aspect_ratio = aspect_ratio
         self.samples_per_pixel = samples_per_pixel
+        self.noise_threshold = noise_threshold
+        self.min_samples_per_pixel = min_samples_per_pixel
+        self.max_samples_per_pixel = max_samples_per_pixel
         self.background = background
         self.vfov = vfov
         self.lookfrom = lookfrom
@@ -60,72 +74,432 @@ class Camera:
         self.defocus_disk_u = self.u * self.defocus_radius
         self.defocus_disk_v = self.v * self.defocus_radius
 
+        # the angle a pixel subtends; camera rays carry it as their cone's
+        # spread so textures can pick a mip level, with texture_filtering on
+        self.texture_filtering = texture_filtering
+        self.pixel_spread = (
+            self.pixel_delta_u.length / self.focus_dist if texture_filtering else 0.0
+        )
+
+        # next event estimation, off by default; the world's lights are
+        # registered by init_worker when it is on
+        self.light_sampling = light_sampling
+        self.lights = None
+
+        # draws the pixel, lens and scatter dimensions of every sample; the
+        # default independent sampler draws them from random() as before
+        if sampler not in samplers.SAMPLERS:
+            raise ValueError(f"unknown sampler: {sampler}")
+        self.sampler = samplers.SAMPLERS[sampler](samples_per_pixel)
+
+        # first hit albedo, normal and depth for the denoiser, see
+        # framebuffer.AOVS; adaptive tiles don't collect them, so a camera
+        # can't have both and render(denoise=True) needs aovs without a
+        # noise_threshold
+        if aovs and noise_threshold is not None:
+            raise ValueError("aovs can't be collected with adaptive sampling")
+        self.aovs = aovs
+        self.features = None
+
+        # paths run up to max_bounces segments; past roulette_depth of them,
+        # if it is set, they are cut short at random
         self.max_bounces = max_bounces
+        self.roulette_depth = roulette_depth
+        self.path_length = 0
+        self.rec = shapes.HitResult()
+        self.shadow_rec = shapes.HitResult()
 
     def ray_color(self, r, world, bounces):
-        if bounces == 0:
-            return vec3.BLACK 
-        did_hit, res = world.hit(r, 0.001, float("inf"))
-
-        if did_hit:
-            did_reflect, attenuation, scattered = res.material.scatter(r, res)
-            if did_reflect:
-                # print(attenuation,scattered, file=__import__("sys").stderr)
-                scattered_light = attenuation.item_mul(
-                    self.ray_color(scattered, world, bounces - 1)
+        # iterative path tracing: throughput is the product of the attenuations
+        # so far, pdf the density of the diffuse bounce that produced r, so
+        # light it finds can be weighed against light sampling at that bounce
+        color = vec3.Vec3(0, 0, 0)
+        tx = ty = tz = 1.0
+        pdf = None
+        depth = 0
+        while depth < bounces:
+            depth += 1
+            did_hit, res = world.hit(r, 0.001, float("inf"), self.rec)
+            if not did_hit:
+                bg = self.background
+                color.x += tx * bg.x
+                color.y += ty * bg.y
+                color.z += tz * bg.z
+                if self.aovs and depth == 1:
+                    self.first_hit(r, None, None)
+                break
+            did_reflect, attenuation, scattered = res.material.scatter(
+                r, res, self.sampler
+            )
+            if self.aovs and depth == 1:
+                self.first_hit(r, res, attenuation if did_reflect else None)
+            emitted = res.material.emit(res.u, res.v, res.p, res.footprint)
+            if pdf:
+                light_pdf = self.lights.pdf(r, res)
+                if light_pdf:
+                    emitted = emitted * lights.mis_weight(pdf, light_pdf)
+            color.x += tx * emitted.x
+            color.y += ty * emitted.y
+            color.z += tz * emitted.z
+            if not did_reflect:
+                break
+            pdf = None
+            # a light sample is one more segment, so the last bounce has none
+            if self.lights is not None and depth < bounces:
+                pdf = res.material.pdf(res, scattered.dir)
+                if pdf:
+                    direct = self.sample_light(world, res, attenuation)
+                    if direct is not None:
+                        color.x += tx * direct.x
+                        color.y += ty * direct.y
+                        color.z += tz * direct.z
+            tx *= attenuation.x
+            ty *= attenuation.y
+            tz *= attenuation.z
+            if self.roulette_depth is not None and depth >= self.roulette_depth:
+                # russian roulette: continue with a probability that follows the
+                # throughput and divide by it, so the estimate stays unbiased
+                q = max(tx, ty, tz)
+                if q < 1:
+                    if random.random() >= q:
+                        break
+                    tx, ty, tz = tx / q, ty / q, tz / q
+            r = scattered
+        self.path_length = depth
+        return color
+
+    def first_hit(self, r, res, albedo):
+        # the albedo, normal and distance of what a camera ray sees; misses see
+        # the background, face the camera and have no depth
+        d = r.dir.length
+        if res is None:
+            a, n, depth = self.background, r.dir * (-1 / d), 0.0
+        else:
+            a, n, depth = albedo or material.WHITE, res.normal, res.t * d
+        self.features = a.x, a.y, a.z, n.x, n.y, n.z, depth
+
+    def sample_light(self, world, res, attenuation):
+        # next event estimation for a diffuse hit: the light arriving along a
+        # light sample, weighed against finding it by scattering
+        light, d = self.lights.sample(res.p)
+        if d is None:
+            return None
+        n = res.normal
+        cos = d.x * n.x + d.y * n.y + d.z * n.z
+        if cos <= 0:
+            return None
+        shadow = ray.Ray(res.p, d)
+        rec = self.shadow_rec
+        if not self.shadow_hit(world, shadow) or rec.obj is not light:
+            return None
+        light_pdf = self.lights.pdf(shadow, rec)
+        if not light_pdf:
+            return None
+        scatter_pdf = cos / d.length / math.pi
+        le = rec.material.emit(rec.u, rec.v, rec.p, rec.footprint)
+        s = lights.mis_weight(light_pdf, scatter_pdf) * scatter_pdf / light_pdf
+        return vec3.Vec3(
+            attenuation.x * le.x * s, attenuation.y * le.y * s, attenuation.z * le.z * s
+        )
+
+    def shadow_hit(self, world, shadow):
+        # traces a shadow ray into self.shadow_rec, in a method of its own so
+        # stats can count them
+        return world.hit(shadow, 0.001, float("inf"), self.shadow_rec)[0]
+
+    def render(
+        self,
+        world,
+        mode="scalar",
+        workers=1,
+        tile_size=64,
+        seed=None,
+        collect_stats=False,
+        output=None,
+        fmt=None,
+        passes=1,
+        checkpoint=None,
+        checkpoint_interval=60,
+        denoise=False,
+        progress=True,
+    ):
+        if mode not in ("scalar", "wavefront"):
+            raise ValueError(f"unknown render mode: {mode}")
+        if denoise and not self.aovs:
+            raise ValueError("denoising needs a camera that collects aovs")
+        if collect_stats:
+            from . import stats
+
+            with stats.collect() as st:
+                fb = self.render(
+                    world,
+                    mode,
+                    workers,
+                    tile_size,
+                    seed,
+                    output=output,
+                    fmt=fmt,
+                    passes=passes,
+                    checkpoint=checkpoint,
+                    checkpoint_interval=checkpoint_interval,
+                    denoise=denoise,
+                    progress=progress,
                 )
+            self.render_stats = st.as_dict()
+            print(json.dumps(self.render_stats), file=sys.stderr)
+            return fb
+        fb = self.render_tiles(
+            world,
+            mode,
+            workers,
+            tile_size,
+            seed,
+            passes,
+            checkpoint,
+            checkpoint_interval,
+            progress,
+        )
+        if self.noise_threshold is not None:
+            print(
+                f"adaptive sampling: {self.spp_map.mean():.2f} spp on average"
+                f" (min {self.spp_map.min():.0f}, max {self.spp_map.max():.0f}),"
+                f" {self.spp_map.sum():.0f} samples",
+                file=sys.stderr,
+            )
+        if self.aovs and output not in (None, "-"):
+            fb.save_aovs(output)
+        if denoise:
+            fb = fb.denoised()
+        fb.save(output, fmt)
+        return fb
+
+    def render_tiles(
+        self,
+        world,
+        mode="scalar",
+        workers=1,
+        tile_size=64,
+        seed=None,
+        passes=1,
+        checkpoint=None,
+        checkpoint_interval=60,
+        progress=True,
+    ):
+        from . import stats
+
+        if checkpoint is None:
+            ck = None
+            if seed is None:
+                seed = random.randrange(2**32)
+            if self.aovs:
+                fb = framebuffer.Framebuffer.with_aovs(self.iw, self.ih)
             else:
-                scattered_light = vec3.BLACK
-            emmited_light = res.material.emit(res.u, res.v, res.p)
-            return scattered_light + emmited_light
-            # direction = res.normal + vec3.Vec3.random_unit()
-            # return 0.5 * self.ray_color(ray.Ray(res.p, direction), world, bounces - 1)
-            # return 0.5 * (res.normal + vec3.Vec3(1, 1, 1))
-        # udir = r.dir.normalized()
-        # a = 0.5 * (udir.y + 1.0)
-        # return (1.0 - a) * vec3.Vec3(1.0, 1.0, 1.0) + a * vec3.Vec3(0.5, 0.7, 1.0)
-        return self.background
-
-    def render(self, world):
-        self.pixel_samples_scale = 1 / self.samples_per_pixel
-        ppm.write_header(self.iw, self.ih)
-        for j in tqdm.tqdm(range(self.ih)):
-            for i in range(self.iw):
-                pixel_pos = (
-                    self.pixel_start
-                    + (i * self.pixel_delta_u)
-                    + (j * self.pixel_delta_v)
-                )
-                pixel_color = (
-                    sum(
-                        (
-                            self.ray_color(
-                                self.get_ray(i, j), world, self.max_bounces
-                            ).clamp_all(interval.Interval(0, 0.999))
-                            for sample in range(self.samples_per_pixel)
-                        ),
-                        vec3.BLACK,
-                    )
-                    * self.pixel_samples_scale
+                fb = framebuffer.Framebuffer(self.iw, self.ih)
+        else:
+            from . import checkpoint as checkpoints
+
+            ck = checkpoints.Checkpoint.open(checkpoint, self, mode, tile_size, seed)
+            fb, seed = ck.fb, ck.seed
+        grid = list(tiles(self.iw, self.ih, tile_size))
+        # each pass adds samples_per_pixel samples; tile i of pass p is job
+        # p * len(grid) + i so every pass draws fresh samples
+        jobs = [
+            (p * len(grid) + i, tile)
+            for p in range(passes)
+            for i, tile in enumerate(grid)
+            if ck is None or not ck.is_done(p * len(grid) + i)
+        ]
+        tile_stats = stats.Stats()
+        init = (self, world, mode, seed, stats.current is not None)
+        with contextlib.ExitStack() as stack:
+            if not isinstance(workers, int):
+                # a distributed.Coordinator, whose workers build their own world
+                results = workers.run(jobs, self, mode, seed, init[-1])
+            elif workers == 1:
+                init_worker(*init)
+                results = map(render_job, jobs)
+            else:
+                import multiprocessing
+
+                pool = stack.enter_context(
+                    multiprocessing.Pool(workers, init_worker, init)
                 )
-                ppm.write_color(*pixel_color.gamma_corrected().asrgb())
+                results = pool.imap_unordered(render_job, jobs)
+            if progress:
+                import tqdm
 
-    def get_ray(self, i, j):
-        offset = vec3.Vec3(random.random() - 0.5 , random.random() - 0.5, 0)
-        pixel_pos = (
-            self.pixel_start
-            + ((i + offset.x) * self.pixel_delta_u)
-            + ((j + offset.y) * self.pixel_delta_v)
+                results = tqdm.tqdm(results, total=len(jobs))
+            try:
+                for index, tile, pixels, linear, counts, aovs, job_stats in results:
+                    sums = pixels * counts[..., None], linear * counts[..., None]
+                    if ck is None:
+                        fb.add(tile, *sums, counts, aovs)
+                    else:
+                        ck.add(index, tile, *sums, counts, aovs)
+                        if time.monotonic() - ck.saved >= checkpoint_interval:
+                            ck.save()
+                    if job_stats is not None:
+                        tile_stats.merge(job_stats)
+            finally:
+                if ck is not None:
+                    ck.save()
+        if stats.current is not None:
+            stats.current.merge(tile_stats.as_dict())
+        self.spp_map = fb.counts
+        return fb
+
+    def render_tile(self, world, tile):
+        # the mean of each pixel's clamped samples, and of its samples, and
+        # the sums of framebuffer.split_aovs if the camera collects aovs
+        x0, y0, x1, y1 = tile
+        pixels = np.empty((y1 - y0, x1 - x0, 3))
+        linear = np.empty((y1 - y0, x1 - x0, 3))
+        features = np.empty((y1 - y0, x1 - x0, 8)) if self.aovs else None
+        sums = None
+        scale = 1 / self.samples_per_pixel
+        for j in range(y0, y1):
+            for i in range(x0, x1):
+                if features is not None:
+                    sums = [0.0] * 8
+                color, hdr = self.pixel_sums(world, i, j, sums)
+                pixels[j - y0, i - x0] = tuple(color.iscale(scale))
+                linear[j - y0, i - x0] = tuple(hdr.iscale(scale))
+                if features is not None:
+                    features[j - y0, i - x0] = sums
+        if features is None:
+            return pixels, linear, None
+        return pixels, linear, framebuffer.split_aovs(features)
+
+    def render_tile_adaptive(self, sample, tile):
+        from . import adaptive
+
+        return adaptive.render_tile(
+            sample,
+            tile,
+            self.samples_per_pixel,
+            self.noise_threshold,
+            self.min_samples_per_pixel,
+            self.max_samples_per_pixel,
         )
+
+    def sample_pixels(self, world, ii, jj, ss):
+        colors = np.empty((len(ii), 3))
+        for k, (i, j, s) in enumerate(zip(ii.tolist(), jj.tolist(), ss.tolist())):
+            self.sampler.start(i, j, s)
+            color = self.ray_color(self.get_ray(i, j), world, self.max_bounces)
+            colors[k] = tuple(color)
+        return colors
+
+    def pixel_sums(self, world, i, j, features=None):
+        # the sum of the pixel's samples clamped to displayable values, and
+        # their plain sum; a list of 8 features, if given, gets the sums of
+        # the samples' first hit features and squared clamped luminance
+        color = vec3.Vec3(0, 0, 0)
+        hdr = vec3.Vec3(0, 0, 0)
+        lo, hi = framebuffer.DISPLAY.start, framebuffer.DISPLAY.end
+        if features is not None:
+            from . import adaptive
+
+            lr, lg, lb = adaptive.LUMINANCE.tolist()
+        for sample in range(self.samples_per_pixel):
+            self.sampler.start(i, j, sample)
+            c = self.ray_color(self.get_ray(i, j), world, self.max_bounces)
+            if features is not None:
+                d = c.clamp_all(framebuffer.DISPLAY)
+                lum = lr * d.x + lg * d.y + lb * d.z
+                for k, f in enumerate((*self.features, lum * lum)):
+                    features[k] += f
+            color.iadd_clamped(c, lo, hi)
+            hdr.iadd(c)
+        return color, hdr
+
+    def pixel_color(self, world, i, j):
+        return self.pixel_sums(world, i, j)[0].iscale(1 / self.samples_per_pixel)
+
+    def get_ray(self, i, j):
+        u, v = self.sampler.get_2d()
+        fi = i + u - 0.5
+        fj = j + v - 0.5
+        s, du, dv = self.pixel_start, self.pixel_delta_u, self.pixel_delta_v
         ray_origin = (
             self.camera_center if self.defocus_angle <= 0 else self.sample_defocus()
         )
-        return ray.Ray(ray_origin, pixel_pos - self.camera_center)
+        c = self.camera_center
+        return ray.Ray(
+            ray_origin,
+            vec3.Vec3(
+                s.x + fi * du.x + fj * dv.x - c.x,
+                s.y + fi * du.y + fj * dv.y - c.y,
+                s.z + fi * du.z + fj * dv.z - c.z,
+            ),
+            0.0,
+            self.pixel_spread,
+        )
 
     def sample_defocus(self):
-        p = vec3.Vec3.random_in_unit_disk()
+        p = vec3.unit_disk(*self.sampler.get_2d())
         return (
             self.camera_center
             + (p.x * self.defocus_disk_u)
             + (p.y * self.defocus_disk_v)
         )
+
+
+def tiles(w, h, size):
+    for y in range(0, h, size):
+        for x in range(0, w, size):
+            yield x, y, min(x + size, w), min(y + size, h)
+
+
+# per-process state for tile jobs, set up once by init_worker
+_job = None
+
+
+def init_worker(cam, world, mode, seed, collect_stats):
+    global _job
+    from . import stats
+
+    # forked workers inherit the parent's collection, spawned ones start their own
+    if collect_stats and stats.current is None:
+        stats.start()
+    # found in this process's copy of the world, so hits can be matched to them
+    cam.lights = lights.Lights.from_world(world) if cam.light_sampling else None
+    if mode == "wavefront":
+        from . import wavefront
+
+        world = wavefront.PackedScene(world, cam.lights)
+    _job = cam, world, mode, seed
+
+
+def render_job(job):
+    from . import stats
+
+    index, tile = job
+    result = render_tile_job(index, tile)
+    return index, *result, stats.current and stats.current.take()
+
+
+def render_tile_job(index, tile):
+    cam, world, mode, seed = _job
+    # every tile gets its own seed, so the image doesn't depend on scheduling
+    random.seed(f"{seed}:{index}")
+    cam.sampler.reseed()
+    aovs = None
+    if mode == "wavefront":
+        from . import wavefront
+
+        rng = np.random.default_rng([seed, index])
+        if cam.noise_threshold is not None:
+            return tile, *cam.render_tile_adaptive(
+                lambda ii, jj, ss: wavefront.sample_pixels(cam, world, ii, jj, rng),
+                tile,
+            ), None
+        pixels, linear, aovs = wavefront.render_tile(cam, world, tile, rng)
+    elif cam.noise_threshold is not None:
+        return tile, *cam.render_tile_adaptive(
+            lambda ii, jj, ss: cam.sample_pixels(world, ii, jj, ss), tile
+        ), None
+    else:
+        pixels, linear, aovs = cam.render_tile(world, tile)
+    counts = np.full(pixels.shape[:2], cam.samples_per_pixel)
+    return tile, pixels, linear, counts, aovs
@@ -1,6 +1,6 @@
 from .randfloat import randfloat
-import numpy as np
-import cmath
+from random import random
+import math
 
 
 def linear_to_gamma(linear):
@@ -11,37 +11,55 @@ def linear_to_gamma(linear):
 
 
 class Vec3:
-    def __init__(self, *e):
-        self.x = self.r = e[0]
-        self.y = self.g = e[1]
-        self.z = self.b = e[2]
-        self.e = e
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def r(self):
+        return self.x
+
+    @property
+    def g(self):
+        return self.y
+
+    @property
+    def b(self):
+        return self.z
+
+    @property
+    def e(self):
+        return (self.x, self.y, self.z)
 
     @property
     def length(self):
-        return self.length_squared**0.5
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
 
     @property
     def length_squared(self):
-        return self.x**2 + self.y**2 + self.z**2
+        return self.x * self.x + self.y * self.y + self.z * self.z
+
 
-    
 
     def cross(self, v):
         return Vec3(
-            self.e[1] * v.e[2] - self.e[2] * v.e[1],
-            self.e[2] * v.e[0] - self.e[0] * v.e[2],
-            self.e[0] * v.e[1] - self.e[1] * v.e[0],
+            self.y * v.z - self.z * v.y,
+            self.z * v.x - self.x * v.z,
+            self.x * v.y - self.y * v.x,
         )
 
     def __add__(self, v):
         return Vec3(self.x + v.x, self.y + v.y, self.z + v.z)
 
     def __sub__(self, v):
-        return self + (-v)
+        return Vec3(self.x - v.x, self.y - v.y, self.z - v.z)
 
     def __truediv__(self, s):
-        return self * (1 / s)
+        s = 1 / s
+        return Vec3(self.x * s, self.y * s, self.z * s)
 
     def __floordiv__(self, s):
         return Vec3(self.x // s, self.y // s, self.z // s)
@@ -53,7 +71,7 @@ class Vec3:
         return Vec3(self.x * s, self.y * s, self.z * s)
 
     def __rmul__(self, s):
-        return self * s
+        return Vec3(self.x * s, self.y * s, self.z * s)
 
     def __repr__(self):
         return f"({self.x:.2f}, {self.y:.2f}, {self.z:.2f})"
@@ -62,42 +80,58 @@ class Vec3:
         return iter((self.x, self.y, self.z))
 
     def __getitem__(self, i):
-        return self.e[i]
+        return (self.x, self.y, self.z)[i]
 
     def asrgb(self):
         return Vec3(int(self.x * 256), int(self.y * 256), int(self.z * 256))
 
     def normalized(self):
-        return self / self.length
+        s = 1 / math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+        return Vec3(self.x * s, self.y * s, self.z * s)
 
     def clamp_all(self, i):
         return Vec3(i.clamp(self.x), i.clamp(self.y), i.clamp(self.z))
 
+    def muladd(self, v, s):
+        return Vec3(self.x + v.x * s, self.y + v.y * s, self.z + v.z * s)
+
+    # in-place accumulators, only for vectors the caller owns
+    def iadd(self, v):
+        self.x += v.x
+        self.y += v.y
+        self.z += v.z
+        return self
+
+    def iadd_clamped(self, v, lo, hi):
+        self.x += lo if v.x < lo else hi if v.x > hi else v.x
+        self.y += lo if v.y < lo else hi if v.y > hi else v.y
+        self.z += lo if v.z < lo else hi if v.z > hi else v.z
+        return self
+
+    def iscale(self, s):
+        self.x *= s
+        self.y *= s
+        self.z *= s
+        return self
+
     @classmethod
     def random(cls, min=0, max=1):
         return cls(randfloat(min, max), randfloat(min, max), randfloat(min, max))
 
     @classmethod
     def random_unit(cls):
-        while True:
-            p = cls.random(-1, 1)
-            lsq = p.length_squared
-            if 1e-160 < lsq <= 1:
-                return p.normalized()
+        return unit_sphere(random(), random())
 
     @classmethod
     def random_on_hemisphere(cls, normal):
         u = cls.random_unit()
-        if u.dot(normal) > 0:
+        if dot(u, normal) > 0:
             return u
         return -u
 
     @classmethod
     def random_in_unit_disk(cls):
-        while True:
-            p = cls(randfloat(-1, 1), randfloat(-1, 1), 0)
-            if p.length_squared < 1:
-                return p
+        return unit_disk(random(), random())
 
     def gamma_corrected(self):
         return Vec3(
@@ -107,7 +141,7 @@ class Vec3:
     def near_zero(self):
         return abs(self.x) < 1e-8 and abs(self.y) < 1e-8 and abs(self.z) < 1e-8
 
-    
+
 
     def item_mul(self, v):
         return Vec3(self.x * v.x, self.y * v.y, self.z * v.z)
@@ -115,16 +149,59 @@ class Vec3:
     def abs(self):
         return Vec3(abs(self.x), abs(self.y), abs(self.z))
 
-    
+
 def array(a):
     return Vec3(*a)
+
+
+def at(origin, dir, t):
+    return Vec3(origin.x + dir.x * t, origin.y + dir.y * t, origin.z + dir.z * t)
+
+
 def dot(u, v):
-        return u.x * v.x + u.y * v.y + u.z * v.z
+    return u.x * v.x + u.y * v.y + u.z * v.z
+
+
+def cross(u, v):
+    return u.cross(v)
+
+
 def reflect(u, v):
-        return u - 2 * dot(u,v) * v
+    return u.muladd(v, -2 * dot(u, v))
+
+
 def refract(uv, n, etai_over_etat):
-        cos_theta = min(-dot(uv,n), 1)
-        r_out_perp = etai_over_etat * (uv + cos_theta * n)
-        r_out_par = -((abs(1 - r_out_perp.length_squared)) ** 0.5) * n
-        return r_out_perp + r_out_par
-BLACK = Vec3(0,0,0)
+    cos_theta = min(-dot(uv, n), 1)
+    r_out_perp = (uv.muladd(n, cos_theta)).iscale(etai_over_etat)
+    return r_out_perp.muladd(n, -((abs(1 - r_out_perp.length_squared)) ** 0.5))
+
+
+def onb(w):
+    # two unit vectors that make an orthonormal basis with the unit vector w
+    a = Vec3(0, 1, 0) if abs(w.x) > 0.9 else Vec3(1, 0, 0)
+    v = w.cross(a).normalized()
+    return w.cross(v), v
+
+
+def unit_sphere(u, v):
+    # maps [0, 1)^2 onto the unit sphere, preserving area
+    z = 1 - 2 * u
+    r = math.sqrt(max(1 - z * z, 0))
+    phi = 2 * math.pi * v
+    return Vec3(r * math.cos(phi), r * math.sin(phi), z)
+
+
+def unit_disk(u, v):
+    # concentric mapping of [0, 1)^2 onto the unit disk, which keeps
+    # strata of the square compact
+    a, b = 2 * u - 1, 2 * v - 1
+    if a == 0 and b == 0:
+        return Vec3(0, 0, 0)
+    if abs(a) > abs(b):
+        r, phi = a, math.pi / 4 * (b / a)
+    else:
+        r, phi = b, math.pi / 2 - math.pi / 4 * (a / b)
+    return Vec3(r * math.cos(phi), r * math.sin(phi), 0)
+
+
+BLACK = Vec3(0, 0, 0)
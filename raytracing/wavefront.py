@@ -0,0 +1,515 @@
+import numpy as np
+from . import adaptive, bvh, framebuffer, material, ray, shapes, stats, vec3
+
+
+# most rays traced together by render_tile
+BATCH = 2**16
+
+
+def dot(a, b):
+    return np.einsum("ij,ij->i", a, b)
+
+
+def normalized(a):
+    return a / np.sqrt(dot(a, a))[:, None]
+
+
+def random_unit(rng, n):
+    return normalized(rng.standard_normal((n, 3)))
+
+
+def random_in_unit_disk(rng, n):
+    r = np.sqrt(rng.random(n))
+    phi = 2 * np.pi * rng.random(n)
+    return r * np.cos(phi), r * np.sin(phi)
+
+
+def reflect(d, n):
+    return d - 2 * dot(d, n)[:, None] * n
+
+
+def refract(uv, n, ri):
+    cos_theta = np.minimum(-dot(uv, n), 1)
+    r_out_perp = ri[:, None] * (uv + cos_theta[:, None] * n)
+    r_out_par = -np.sqrt(np.abs(1 - dot(r_out_perp, r_out_perp)))[:, None] * n
+    return r_out_perp + r_out_par
+
+
+class Hits:
+    def __init__(self, p, normal, front, u, v, mat, width, footprint):
+        self.p = p
+        self.normal = normal
+        self.front = front
+        self.u = u
+        self.v = v
+        self.mat = mat
+        self.width = width
+        self.footprint = footprint
+
+    def take(self, sel):
+        return Hits(
+            self.p[sel],
+            self.normal[sel],
+            self.front[sel],
+            self.u[sel],
+            self.v[sel],
+            self.mat[sel],
+            self.width[sel],
+            self.footprint[sel],
+        )
+
+
+class PackedScene:
+    def __init__(self, world, lights=None):
+        spheres, quads = [], []
+        self.materials = []
+        mat_ids = {}
+        packed = {}
+        for obj in bvh.flatten(world):
+            if isinstance(obj, shapes.Sphere):
+                packed[id(obj)] = 0, len(spheres)
+                spheres.append(obj)
+            elif isinstance(obj, shapes.Quad):
+                packed[id(obj)] = 1, len(quads)
+                quads.append(obj)
+            else:
+                raise ValueError(
+                    f"can't pack {obj.__class__.__name__} for wavefront rendering"
+                )
+            if id(obj.material) not in mat_ids:
+                mat_ids[id(obj.material)] = len(self.materials)
+                self.materials.append(obj.material)
+
+        def pack(objs, attr):
+            return np.array([tuple(getattr(o, attr)) for o in objs]).reshape(-1, 3)
+
+        self.sphere_center = pack(spheres, "center")
+        self.sphere_radius = np.array([s.radius for s in spheres], float)
+        self.sphere_mat = np.array([mat_ids[id(s.material)] for s in spheres], int)
+        self.sphere_extent = np.array([s.uv_extent for s in spheres], float)
+        self.quad_q = pack(quads, "q")
+        self.quad_u = pack(quads, "u")
+        self.quad_v = pack(quads, "v")
+        self.quad_w = pack(quads, "w")
+        self.quad_normal = pack(quads, "normal")
+        self.quad_d = np.array([q.d for q in quads], float)
+        self.quad_mat = np.array([mat_ids[id(q.material)] for q in quads], int)
+        self.quad_extent = np.array([q.uv_extent for q in quads], float)
+        self.quad_area = np.array([q.area for q in quads], float)
+
+        # lights as (kind, index) pairs, and which primitives are lights
+        lights = [packed[id(obj)] for obj in (lights.prims if lights else ())]
+        self.light_count = len(lights)
+        self.light_kind = np.array([k for k, _ in lights], np.int8)
+        self.light_index = np.array([i for _, i in lights], int)
+        self.sphere_light = np.zeros(len(spheres), bool)
+        self.quad_light = np.zeros(len(quads), bool)
+        for kind, index in lights:
+            (self.quad_light if kind else self.sphere_light)[index] = True
+
+    def intersect(self, orig, dirs, tmin=0.001):
+        # kind is -1 for a miss, 0 for a sphere and 1 for a quad
+        n = len(orig)
+        closest = np.full(n, np.inf)
+        kind = np.full(n, -1, np.int8)
+        index = np.zeros(n, int)
+        a = dot(dirs, dirs)
+        if stats.current is not None:
+            for name, count in (("Sphere", self.sphere_radius), ("Quad", self.quad_d)):
+                if len(count):
+                    stats.current.count_prims(name, n * len(count))
+        for k in range(len(self.sphere_radius)):
+            oc = self.sphere_center[k] - orig
+            h = dot(dirs, oc)
+            c = dot(oc, oc) - self.sphere_radius[k] ** 2
+            d = h * h - a * c
+            sqrtd = np.sqrt(np.maximum(d, 0))
+            root = (h - sqrtd) / a
+            root = np.where(
+                (root <= tmin) | (closest <= root), (h + sqrtd) / a, root
+            )
+            hit = (d >= 0) & (tmin < root) & (root < closest)
+            closest[hit] = root[hit]
+            kind[hit] = 0
+            index[hit] = k
+        for k in range(len(self.quad_d)):
+            dn = dirs @ self.quad_normal[k]
+            parallel = np.abs(dn) < 1e-8
+            t = (self.quad_d[k] - orig @ self.quad_normal[k]) / np.where(
+                parallel, 1, dn
+            )
+            cand = np.nonzero(~parallel & (tmin < t) & (t < closest))[0]
+            if not len(cand):
+                continue
+            alpha, beta = self.quad_uv(
+                k, orig[cand] + t[cand, None] * dirs[cand]
+            )
+            hit = cand[(0 < alpha) & (alpha < 1) & (0 < beta) & (beta < 1)]
+            closest[hit] = t[hit]
+            kind[hit] = 1
+            index[hit] = k
+        return closest, kind, index
+
+    def quad_uv(self, k, p):
+        hp = p - self.quad_q[k]
+        alpha = np.cross(hp, self.quad_v[k]) @ self.quad_w[k]
+        beta = np.cross(self.quad_u[k], hp) @ self.quad_w[k]
+        return alpha, beta
+
+    def surface(self, orig, dirs, t, kind, index, width, spread):
+        n = len(t)
+        p = orig + t[:, None] * dirs
+        outward = np.empty((n, 3))
+        u, v = np.empty(n), np.empty(n)
+        mat = np.empty(n, int)
+        extent = np.empty(n)
+        s = kind == 0
+        k = index[s]
+        outward[s] = (p[s] - self.sphere_center[k]) / self.sphere_radius[k, None]
+        mat[s] = self.sphere_mat[k]
+        extent[s] = self.sphere_extent[k]
+        q = ~s
+        k = index[q]
+        outward[q] = self.quad_normal[k]
+        mat[q] = self.quad_mat[k]
+        extent[q] = self.quad_extent[k]
+        hp = p[q] - self.quad_q[k]
+        u[q] = dot(np.cross(hp, self.quad_v[k]), self.quad_w[k])
+        v[q] = dot(np.cross(self.quad_u[k], hp), self.quad_w[k])
+        front = dot(dirs, outward) < 0
+        normal = np.where(front[:, None], outward, -outward)
+        # spheres take their uv from the face normal, like Sphere.getuv
+        theta = np.arccos(np.clip(-normal[s, 1], -1, 1))
+        phi = np.arctan2(-normal[s, 2], normal[s, 0]) + np.pi
+        u[s] = phi / (2 * np.pi)
+        v[s] = theta / np.pi
+        # the ray cone's footprint, like shapes.set_footprint
+        length = np.sqrt(dot(dirs, dirs))
+        width = width + spread * t * length
+        cos = np.maximum(np.abs(dot(dirs, normal)) / length, shapes.MIN_COS)
+        return Hits(p, normal, front, u, v, mat, width, width / (cos * extent))
+
+
+    def light_pdf(self, orig, dirs, t, kind, index):
+        # like lights.Lights.pdf: the density of light sampling picking dirs
+        # from orig towards the hit points, 0 for hits that aren't on lights
+        pdf = np.zeros(len(t))
+        s = kind == 0
+        s[s] = self.sphere_light[index[s]]
+        k = index[s]
+        oc = self.sphere_center[k] - orig[s]
+        dist_sq = np.maximum(dot(oc, oc), 1e-300)
+        r_sq = self.sphere_radius[k] ** 2
+        cos_max = np.sqrt(np.maximum(1 - r_sq / dist_sq, 0))
+        solid_angle = 2 * np.pi * (1 - cos_max)
+        pdf[s] = np.where(
+            (dist_sq > r_sq) & (solid_angle > 0), 1 / np.maximum(solid_angle, 1e-300), 0
+        )
+        q = kind == 1
+        q[q] = self.quad_light[index[q]]
+        k = index[q]
+        length_sq = dot(dirs[q], dirs[q])
+        cos = np.abs(dot(dirs[q], self.quad_normal[k])) / np.sqrt(length_sq)
+        pdf[q] = np.where(
+            cos >= 1e-8,
+            t[q] ** 2 * length_sq / (np.maximum(cos, 1e-8) * self.quad_area[k]),
+            0,
+        )
+        return pdf / max(self.light_count, 1)
+
+    def sample_lights(self, orig, rng):
+        # like lights.Lights.sample: a light per ray and a direction to it,
+        # with a mask of rays that could sample one
+        n = len(orig)
+        light = rng.integers(self.light_count, size=n)
+        kind, index = self.light_kind[light], self.light_index[light]
+        dirs = np.zeros((n, 3))
+        valid = np.ones(n, bool)
+        q = kind == 1
+        k = index[q]
+        a, b = rng.random(len(k)), rng.random(len(k))
+        dirs[q] = (
+            self.quad_q[k]
+            + a[:, None] * self.quad_u[k]
+            + b[:, None] * self.quad_v[k]
+            - orig[q]
+        )
+        s = ~q
+        k = index[s]
+        oc = self.sphere_center[k] - orig[s]
+        dist_sq = np.maximum(dot(oc, oc), 1e-300)
+        r_sq = self.sphere_radius[k] ** 2
+        valid[s] = dist_sq > r_sq
+        cos_max = np.sqrt(np.maximum(1 - r_sq / dist_sq, 0))
+        z = 1 + rng.random(len(k)) * (cos_max - 1)
+        phi = 2 * np.pi * rng.random(len(k))
+        sin = np.sqrt(np.maximum(1 - z * z, 0))
+        w = oc / np.sqrt(dist_sq)[:, None]
+        # the basis of vec3.onb
+        other = np.where(np.abs(w[:, :1]) > 0.9, (0.0, 1.0, 0.0), (1.0, 0.0, 0.0))
+        v = normalized(np.cross(w, other))
+        u = np.cross(w, v)
+        dirs[s] = (
+            u * (np.cos(phi) * sin)[:, None]
+            + v * (np.sin(phi) * sin)[:, None]
+            + w * z[:, None]
+        )
+        return kind, index, dirs, valid
+
+
+def mis_weight(pdf, other):
+    # lights.mis_weight, with a weight of 1 wherever pdf is 0
+    pdf_sq = pdf * pdf
+    return np.where(pdf > 0, pdf_sq / np.maximum(pdf_sq + other * other, 1e-300), 1)
+
+
+def sample_lights(scene, hits, attenuation, rng):
+    # like Camera.sample_light, for a batch of diffuse hits
+    n = len(hits.p)
+    direct = np.zeros((n, 3))
+    kind, index, dirs, valid = scene.sample_lights(hits.p, rng)
+    cos = dot(dirs, hits.normal)
+    sel = np.nonzero(valid & (cos > 0))[0]
+    if not len(sel):
+        return direct
+    if stats.current is not None:
+        stats.current.shadow_rays += len(sel)
+    t, hit_kind, hit_index = scene.intersect(hits.p[sel], dirs[sel])
+    visible = (hit_kind == kind[sel]) & (hit_index == index[sel])
+    sel, t, hit_kind, hit_index = (
+        sel[visible],
+        t[visible],
+        hit_kind[visible],
+        hit_index[visible],
+    )
+    orig, dirs = hits.p[sel], dirs[sel]
+    light_pdf = scene.light_pdf(orig, dirs, t, hit_kind, hit_index)
+    ok = light_pdf > 0
+    sel, orig, dirs, t, hit_kind, hit_index, light_pdf = (
+        a[ok] for a in (sel, orig, dirs, t, hit_kind, hit_index, light_pdf)
+    )
+    if not len(sel):
+        return direct
+    no_cone = np.zeros(len(t))
+    light_hits = scene.surface(orig, dirs, t, hit_kind, hit_index, no_cone, 0.0)
+    le = shade(scene, dirs, light_hits, rng)[0]
+    scatter_pdf = cos[sel] / np.sqrt(dot(dirs, dirs)) / np.pi
+    s = mis_weight(light_pdf, scatter_pdf) * scatter_pdf / light_pdf
+    direct[sel] = attenuation[sel] * le * s[:, None]
+    return direct
+
+
+def shade_lambertian(m, dirs, hits, rng):
+    scatter_dir = hits.normal + random_unit(rng, len(dirs))
+    near_zero = np.all(np.abs(scatter_dir) < 1e-8, axis=1)
+    scatter_dir[near_zero] = hits.normal[near_zero]
+    attenuation = m.albedo.sample_array(hits.u, hits.v, hits.p, hits.footprint)
+    cos = dot(scatter_dir, hits.normal) / np.sqrt(dot(scatter_dir, scatter_dir))
+    pdf = np.maximum(cos, 0) / np.pi
+    return None, np.ones(len(dirs), bool), attenuation, scatter_dir, pdf
+
+
+def shade_metal(m, dirs, hits, rng):
+    scatter_dir = normalized(reflect(dirs, hits.normal))
+    scatter_dir += m.fuzz * random_unit(rng, len(dirs))
+    attenuation = m.albedo.sample_array(hits.u, hits.v, hits.p, hits.footprint)
+    scattered = dot(scatter_dir, hits.normal) > 0
+    return None, scattered, attenuation, scatter_dir, np.zeros(len(dirs))
+
+
+def shade_dielectric(m, dirs, hits, rng):
+    ri = np.where(hits.front, 1 / m.refraction_index, m.refraction_index)
+    udir = normalized(dirs)
+    cos_theta = np.minimum(-dot(udir, hits.normal), 1)
+    sin_theta = np.sqrt(np.maximum(1 - cos_theta**2, 0))
+    reflects = (ri * sin_theta > 1) | (
+        material.reflectance(cos_theta, ri) > rng.random(len(dirs))
+    )
+    scatter_dir = np.where(
+        reflects[:, None],
+        reflect(udir, hits.normal),
+        refract(udir, hits.normal, ri),
+    )
+    attenuation = m.albedo.sample_array(hits.u, hits.v, hits.p, hits.footprint)
+    return None, np.ones(len(dirs), bool), attenuation, scatter_dir, np.zeros(len(dirs))
+
+
+def shade_diffuse_light(m, dirs, hits, rng):
+    emitted = m.texture.sample_array(hits.u, hits.v, hits.p, hits.footprint)
+    emitted = emitted * m.energy_multiplier
+    n = len(dirs)
+    return emitted, np.zeros(n, bool), np.zeros((n, 3)), dirs, np.zeros(n)
+
+
+def shade_scalar(m, dirs, hits, rng):
+    # materials without a batched shader fall back to their scalar methods
+    n = len(dirs)
+    emitted = np.empty((n, 3))
+    scattered = np.zeros(n, bool)
+    attenuation = np.zeros((n, 3))
+    scatter_dir = np.zeros((n, 3))
+    pdf = np.zeros(n)
+    for i in range(n):
+        p = vec3.array(hits.p[i])
+        hr = shapes.HitResult(
+            p,
+            vec3.array(hits.normal[i]),
+            None,
+            bool(hits.front[i]),
+            m,
+            hits.u[i],
+            hits.v[i],
+        )
+        hr.width, hr.footprint = hits.width[i], hits.footprint[i]
+        did_scatter, att, r = m.scatter(ray.Ray(p, vec3.array(dirs[i])), hr)
+        if did_scatter:
+            scattered[i] = True
+            attenuation[i] = tuple(att)
+            scatter_dir[i] = tuple(r.dir)
+            pdf[i] = m.pdf(hr, r.dir)
+        emitted[i] = tuple(m.emit(hr.u, hr.v, p, hr.footprint))
+    return emitted, scattered, attenuation, scatter_dir, pdf
+
+
+SHADERS = {
+    material.Lambertian: shade_lambertian,
+    material.Metal: shade_metal,
+    material.Dielectric: shade_dielectric,
+    material.DiffuseLight: shade_diffuse_light,
+}
+
+
+def shade(scene, dirs, hits, rng):
+    n = len(dirs)
+    emitted = np.zeros((n, 3))
+    scattered = np.zeros(n, bool)
+    attenuation = np.zeros((n, 3))
+    scatter_dir = np.zeros((n, 3))
+    # density of each scatter direction, 0 where it can't be combined with
+    # light samples
+    pdf = np.zeros(n)
+    for m in np.unique(hits.mat):
+        sel = np.nonzero(hits.mat == m)[0]
+        mat = scene.materials[m]
+        e, s, a, d, p = SHADERS.get(type(mat), shade_scalar)(
+            mat, dirs[sel], hits.take(sel), rng
+        )
+        if e is not None:
+            emitted[sel] = e
+        scattered[sel] = s
+        attenuation[sel] = a
+        scatter_dir[sel] = d
+        pdf[sel] = p
+    return emitted, scattered, attenuation, scatter_dir, pdf
+
+
+def trace(cam, scene, orig, dirs, rng, features=None):
+    # features, if given, gets each ray's first hit albedo, normal and depth
+    # as in Camera.first_hit
+    # every ray's cone keeps the camera's spread, only its width changes
+    width = np.zeros(len(orig))
+    # the density of the diffuse bounce behind each ray, as in Camera.ray_color
+    pdf = np.zeros(len(orig))
+    radiance = np.zeros((len(orig), 3))
+    throughput = np.ones((len(orig), 3))
+    alive = np.arange(len(orig))
+    background = np.array(tuple(cam.background), float)
+    for depth in range(cam.max_bounces):
+        if not len(alive):
+            break
+        if stats.current is not None:
+            stats.current.count_rays(depth, len(alive))
+        t, kind, index = scene.intersect(orig, dirs)
+        hit = kind >= 0
+        radiance[alive[~hit]] += throughput[~hit] * background
+        if features is not None and depth == 0:
+            features[~hit, 0:3] = background
+            features[~hit, 3:6] = -normalized(dirs[~hit])
+            features[~hit, 6] = 0
+        alive, orig, dirs, throughput = alive[hit], orig[hit], dirs[hit], throughput[hit]
+        t, kind, index, pdf = t[hit], kind[hit], index[hit], pdf[hit]
+        hits = scene.surface(orig, dirs, t, kind, index, width[hit], cam.pixel_spread)
+        emitted, scattered, attenuation, scatter_dir, scatter_pdf = shade(
+            scene, dirs, hits, rng
+        )
+        if features is not None and depth == 0:
+            features[alive, 0:3] = np.where(scattered[:, None], attenuation, 1)
+            features[alive, 3:6] = hits.normal
+            features[alive, 6] = t * np.sqrt(dot(dirs, dirs))
+        if scene.light_count:
+            light_pdf = scene.light_pdf(orig, dirs, t, kind, index)
+            emitted *= mis_weight(pdf, light_pdf)[:, None]
+            diffuse = np.nonzero(scattered & (scatter_pdf > 0))[0]
+            if depth + 1 < cam.max_bounces and len(diffuse):
+                direct = sample_lights(
+                    scene, hits.take(diffuse), attenuation[diffuse], rng
+                )
+                radiance[alive[diffuse]] += throughput[diffuse] * direct
+        radiance[alive] += throughput * emitted
+        # dead rays are compacted away before the next bounce
+        alive = alive[scattered]
+        orig = hits.p[scattered]
+        dirs = scatter_dir[scattered]
+        width = hits.width[scattered]
+        pdf = scatter_pdf[scattered]
+        throughput = throughput[scattered] * attenuation[scattered]
+        if cam.roulette_depth is not None and depth + 1 >= cam.roulette_depth:
+            # russian roulette, as in Camera.ray_color
+            q = np.minimum(throughput.max(axis=1), 1)
+            survive = rng.random(len(q)) < q
+            alive, orig, dirs = alive[survive], orig[survive], dirs[survive]
+            width, pdf = width[survive], pdf[survive]
+            throughput = throughput[survive] / q[survive, None]
+    return radiance
+
+
+def render_tile(cam, scene, tile, rng):
+    x0, y0, x1, y1 = tile
+    jj, ii = np.mgrid[y0:y1, x0:x1]
+    ii, jj = ii.ravel(), jj.ravel()
+    total = np.zeros((len(ii), 3))
+    linear = np.zeros((len(ii), 3))
+    # the aov sums, laid out as in Camera.render_tile
+    aovs = np.zeros((len(ii), 8)) if cam.aovs else None
+    # samples are traced a batch at a time so memory doesn't grow with spp
+    per_batch = max(BATCH // len(ii), 1)
+    for start in range(0, cam.samples_per_pixel, per_batch):
+        spp = min(per_batch, cam.samples_per_pixel - start)
+        features = np.empty((len(ii) * spp, 8)) if cam.aovs else None
+        color = sample_pixels(
+            cam, scene, np.repeat(ii, spp), np.repeat(jj, spp), rng, features
+        )
+        linear += color.reshape(len(ii), spp, 3).sum(axis=1)
+        # clamped one sample at a time, as in Camera.pixel_sums
+        color = np.clip(color, framebuffer.DISPLAY.start, framebuffer.DISPLAY.end)
+        total += color.reshape(len(ii), spp, 3).sum(axis=1)
+        if cam.aovs:
+            features[:, 7] = (color @ adaptive.LUMINANCE) ** 2
+            aovs += features.reshape(len(ii), spp, 8).sum(axis=1)
+    shape = (y1 - y0, x1 - x0)
+    pixels = (total / cam.samples_per_pixel).reshape(*shape, 3)
+    linear = (linear / cam.samples_per_pixel).reshape(*shape, 3)
+    if aovs is None:
+        return pixels, linear, None
+    return pixels, linear, framebuffer.split_aovs(aovs.reshape(*shape, 8))
+
+
+def sample_pixels(cam, scene, ii, jj, rng, features=None):
+    n = len(ii)
+    offset = rng.random((n, 2)) - 0.5
+    center = np.array(tuple(cam.camera_center), float)
+    pixel_pos = (
+        np.array(tuple(cam.pixel_start), float)
+        + (ii + offset[:, 0])[:, None] * tuple(cam.pixel_delta_u)
+        + (jj + offset[:, 1])[:, None] * tuple(cam.pixel_delta_v)
+    )
+    if cam.defocus_angle <= 0:
+        orig = np.broadcast_to(center, (n, 3))
+    else:
+        px, py = random_in_unit_disk(rng, n)
+        orig = (
+            center
+            + px[:, None] * tuple(cam.defocus_disk_u)
+            + py[:, None] * tuple(cam.defocus_disk_v)
+        )
+    return trace(cam, scene, orig, pixel_pos - center, rng, features)
@@ -0,0 +1,112 @@
+import pickle
+import random
+import pytest
+from raytracing import aabb, bvh, material, ray, shapes, vec3
+
+GRAY = material.Lambertian(vec3.Vec3(0.5, 0.5, 0.5))
+
+
+def spheres(n=300, seed=0):
+    # a loose cloud, and a tight clump off to one side, so the splits differ
+    rng = random.Random(seed)
+    out = []
+    for k in range(n):
+        spread = 10 if k % 3 else 1
+        center = [rng.uniform(-spread, spread) for _ in range(3)]
+        center[0] += 0 if k % 3 else 20
+        out.append(shapes.Sphere(vec3.Vec3(*center), rng.uniform(0.1, 0.8), GRAY))
+    return out
+
+
+def rays(n=1000, seed=1):
+    rng = random.Random(seed)
+    for _ in range(n):
+        # from anywhere around the spheres toward somewhere among them
+        origin = vec3.Vec3(*(rng.uniform(-25, 35) for _ in range(3)))
+        target = vec3.Vec3(*(rng.uniform(-10, 20) for _ in range(3)))
+        yield ray.Ray(origin, target - origin)
+
+
+def closest(world, r):
+    did_hit, rec = world.hit(r, 0.001, float("inf"))
+    return (rec.obj, rec.t) if did_hit else None
+
+
+def test_sah_and_median_trees_hit_the_same():
+    prims = spheres()
+    sah = bvh.BVH(list(prims), 0, len(prims))
+    median = bvh.BVH(list(prims), 0, len(prims), split="median")
+    results = [(closest(sah, r), closest(median, r)) for r in rays()]
+    assert all(a == b for a, b in results)
+    # enough of the rays hit something to mean anything
+    assert sum(a is not None for a, _ in results) > 100
+
+
+def test_expected_cost():
+    # a leaf is one box test and a test per primitive in it; no plane
+    # separates spheres with one center, so these make one
+    prims = [shapes.Sphere(vec3.Vec3(1, 2, 3), r, GRAY) for r in (1, 2, 3)]
+    leaf = bvh.BVH(prims, 0, 3)
+    assert leaf.prims is not None
+    assert leaf.expected_cost() == pytest.approx(
+        bvh.TRAVERSAL_COST + 3 * bvh.INTERSECT_COST
+    )
+    # the SAH split is chosen to make this low, the median split isn't
+    prims = spheres()
+    sah = bvh.BVH(list(prims), 0, len(prims))
+    median = bvh.BVH(list(prims), 0, len(prims), split="median")
+    assert sah.expected_cost() < median.expected_cost()
+    assert sah.cost_report()["expected_cost"] == sah.expected_cost()
+
+
+def test_unknown_split():
+    with pytest.raises(ValueError):
+        bvh.BVH(spheres(4), 0, 4, split="middle")
+
+
+@pytest.mark.parametrize("split", ["sah", "median"])
+def test_flat_bvh_hits_like_the_tree_it_flattens(split):
+    prims = spheres()
+    tree = bvh.BVH(list(prims), 0, len(prims), split=split)
+    flat = tree.compile()
+    assert all(closest(flat, r) == closest(tree, r) for r in rays())
+    # unpickled copies rebuild the lists they traverse, and hit copies of
+    # the spheres at the same distances
+    copy = pickle.loads(pickle.dumps(flat))
+    for r in rays(200):
+        a, b = closest(copy, r), closest(flat, r)
+        assert (a and a[1]) == (b and b[1])
+
+
+def slab_entry(box, r, tmin, tmax):
+    # the textbook slab test, dividing by the direction on every call
+    for axis, o, d in zip(box.axes, tuple(r.origin), tuple(r.dir)):
+        if d == 0:
+            if not axis.start <= o <= axis.end:
+                return None
+            continue
+        t0, t1 = sorted(((axis.start - o) / d, (axis.end - o) / d))
+        tmin, tmax = max(tmin, t0), min(tmax, t1)
+        if tmax <= tmin:
+            return None
+    return tmin
+
+
+def test_slab_test_matches_the_textbook_one():
+    rng = random.Random(2)
+    for _ in range(2000):
+        box = aabb.AABB.from_points(
+            [rng.uniform(-2, 2) for _ in range(3)],
+            [rng.uniform(-2, 2) for _ in range(3)],
+        )
+        # a third of the direction components are 0, which makes the
+        # inverse direction infinite
+        d = [0.0 if rng.random() < 1 / 3 else rng.gauss(0, 1) for _ in range(3)]
+        if not any(d):
+            continue
+        origin = vec3.Vec3(*(rng.uniform(-4, 4) for _ in range(3)))
+        r = ray.Ray(origin, vec3.Vec3(*d))
+        expected = slab_entry(box, r, 0.001, 100)
+        assert box.hit(r, 0.001, 100) == (expected is not None)
+        if expected is not None:
+            assert box.entry(r, 0.001, 100) == pytest.approx(expected)
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import pytest
+from raytracing import __main__ as cli
+from raytracing import scenecache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Recorder:
+    # stands in for the camera scenecache.scene returns, and keeps what
+    # main asked of it
+    def __init__(self):
+        self.calls = []
+
+    def scene(self, name, seed, cache_dir, use_bvh, **overrides):
+        self.calls.append((name, seed, cache_dir, use_bvh, overrides))
+        return self, None
+
+    def render(self, world, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+
+@pytest.mark.parametrize(
+    "argv, message",
+    [
+        (["simple_light", "-w", "0"], "--width can't be 0"),
+        (["simple_light", "--spp", "-2"], "--spp can't be -2"),
+        (["simple_light", "--max-bounces", "-1"], "--max-bounces can't be -1"),
+        (["simple_light", "--roulette-depth", "0"], "--roulette-depth can't be 0"),
+        (["simple_light", "--tile-size", "0"], "--tile-size can't be 0"),
+        (["simple_light", "-j", "0"], "--workers can't be 0"),
+        (["simple_light", "--sampler", "grid"], "invalid choice: 'grid'"),
+        (["nowhere"], "unknown scene 'nowhere'"),
+        ([], "pick a scene"),
+    ],
+)
+def test_bad_arguments(capsys, argv, message):
+    with pytest.raises(SystemExit) as excinfo:
+        cli.main(argv)
+    assert excinfo.value.code == 2
+    assert message in capsys.readouterr().err
+
+
+def test_connect_needs_a_key(capsys, monkeypatch):
+    monkeypatch.delenv("RAYTRACING_AUTHKEY", raising=False)
+    with pytest.raises(SystemExit):
+        cli.main(["--connect", "localhost:5000"])
+    assert "--connect needs --authkey" in capsys.readouterr().err
+
+
+def test_list(capsys):
+    cli.main(["--list"])
+    assert "simple_light" in capsys.readouterr().out.split()
+
+
+def test_options_reach_the_camera_and_render(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(scenecache, "scene", recorder.scene)
+    cli.main(
+        "quads -w 40 --max-bounces 0 --roulette-depth 3 --sampler sobol"
+        " --light-sampling --scene-seed 5 --no-cache --mode wavefront -j 2"
+        " --tile-size 16 --seed 9 -o out.pfm -q".split()
+    )
+    scene, render = recorder.calls
+    assert scene == (
+        "quads",
+        5,
+        None,
+        True,
+        {
+            "image_width": 40,
+            "max_bounces": 0,
+            "roulette_depth": 3,
+            "sampler": "sobol",
+            "light_sampling": True,
+        },
+    )
+    args, kwargs = render
+    assert args == ("wavefront", 2, 16, 9, False, "out.pfm", None)
+    assert kwargs == {"progress": False}
+
+
+def test_unset_options_keep_the_scenes_settings(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(scenecache, "scene", recorder.scene)
+    cli.main(["simple_light"])
+    name, seed, cache_dir, use_bvh, overrides = recorder.calls[0]
+    assert (seed, cache_dir, use_bvh) == (0, scenecache.CACHE_DIR, True)
+    assert overrides == {}
+
+
+@pytest.mark.parametrize("argv", [["--help"], ["simple_light", "-w", "0"]])
+def test_help_and_bad_arguments_dont_import_numpy(argv):
+    code = (
+        "import sys\n"
+        "from raytracing import __main__\n"
+        "try:\n"
+        f"    __main__.main({argv!r})\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print('numpy' in sys.modules)\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True
+    )
+    assert out.stdout.split()[-1] == "False"
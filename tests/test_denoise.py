@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from raytracing import denoise
+
+H = W = 32
+
+
+def halves(left, right, channels=3):
+    a = np.empty((H, W, channels) if channels else (H, W))
+    a[:, : W // 2] = left
+    a[:, W // 2 :] = right
+    return a
+
+
+def noisy(left, right, sigma=0.1):
+    # the color, and the variance of its luminance
+    rng = np.random.default_rng(0)
+    color = halves(left, right) + rng.normal(0, sigma, (H, W, 3))
+    return color, np.full((H, W), sigma * sigma)
+
+
+def edge(image):
+    # the mean of the columns either side of the middle
+    return image[:, W // 2 - 1].mean(), image[:, W // 2].mean()
+
+
+FACING = halves((0, 0, 1), (0, 0, 1))
+TURNED = halves((0, 0, 1), (1, 0, 0))
+WHITE = np.ones((H, W, 3))
+
+
+def test_flat_regions_are_smoothed():
+    color, variance = noisy(0.5, 0.5)
+    out = denoise.atrous(color, WHITE, FACING, np.ones((H, W)), variance)
+    assert out.std() < color.std() / 5
+    assert out.mean() == pytest.approx(color.mean(), abs=0.01)
+
+
+def test_normal_edges_arent_blurred_across():
+    color, variance = noisy(0.2, 0.8)
+    left, right = edge(denoise.atrous(color, WHITE, TURNED, np.ones((H, W)), variance))
+    assert left == pytest.approx(0.2, abs=0.015)
+    assert right == pytest.approx(0.8, abs=0.015)
+    # with one normal everywhere the noise hides the edge and it bleeds
+    left, right = edge(denoise.atrous(color, WHITE, FACING, np.ones((H, W)), variance))
+    assert left > 0.23 and right < 0.77
+
+
+def test_depth_edges_arent_blurred_across():
+    color, variance = noisy(0.2, 0.8)
+    out = denoise.atrous(color, WHITE, FACING, halves(1, 5, channels=0), variance)
+    left, right = edge(out)
+    assert left == pytest.approx(0.2, abs=0.025)
+    assert right == pytest.approx(0.8, abs=0.025)
+
+
+def test_albedo_edges_are_kept():
+    # the same lighting over two albedos, which the filter divides out
+    albedo = halves(0.2, 0.8)
+    rng = np.random.default_rng(1)
+    color = 0.5 * albedo * (1 + rng.normal(0, 0.2, (H, W, 3)))
+    variance = np.full((H, W), 0.01)
+    out = denoise.atrous(color, albedo, FACING, np.ones((H, W)), variance)
+    left, right = edge(out)
+    assert left == pytest.approx(0.1, abs=0.01)
+    assert right == pytest.approx(0.4, abs=0.02)
+    assert out[:, : W // 2].std() < color[:, : W // 2].std() / 5
@@ -0,0 +1,32 @@
+import numpy as np
+from raytracing import framebuffer, vec3
+
+
+def test_to_rgb_matches_the_per_pixel_conversion():
+    # gamma_corrected then asrgb of the clamped color, as pixels were written
+    rng = np.random.default_rng(0)
+    image = rng.uniform(-0.2, 1.2, (5, 7, 3))
+    expected = [
+        tuple(vec3.Vec3(*np.clip(c, 0, 0.999).tolist()).gamma_corrected().asrgb())
+        for c in image.reshape(-1, 3)
+    ]
+    rgb = framebuffer.to_rgb(image)
+    assert rgb.dtype == np.uint8
+    assert [tuple(c) for c in rgb.reshape(-1, 3).tolist()] == expected
+
+
+def test_saved_images_span_several_bands(tmp_path):
+    # taller than a band, so the rows are written in more than one
+    w, h = 3, framebuffer.BAND_ROWS + 5
+    fb = framebuffer.Framebuffer(w, h)
+    fb.sums[:] = np.linspace(0, 1, w * h * 3).reshape(h, w, 3)
+    fb.linear[:] = fb.sums * 4
+    fb.counts[:] = 2
+    path = tmp_path / "image.ppm"
+    fb.save(str(path))
+    assert path.read_bytes() == f"P6\n{w} {h}\n255\n".encode() + fb.to_rgb().tobytes()
+    # pfm rows go bottom to top
+    path = tmp_path / "image.pfm"
+    fb.save(str(path))
+    data = np.frombuffer(path.read_bytes()[-w * h * 12 :], "<f4").reshape(h, w, 3)
+    assert np.allclose(data[::-1], fb.linear_image())
@@ -0,0 +1,85 @@
+import math
+import random
+import numpy as np
+import pytest
+from raytracing import instance, material, ray, shapes, vec3
+
+GRAY = material.Lambertian(vec3.Vec3(0.5, 0.5, 0.5))
+UNIT = shapes.Sphere(vec3.Vec3(0, 0, 0), 1, GRAY)
+
+
+def hit(world, origin, target):
+    origin = vec3.Vec3(*origin)
+    r = ray.Ray(origin, vec3.Vec3(*target) - origin)
+    return world.hit(r, 0.001, math.inf)
+
+
+def test_copies_hit_like_the_spheres_they_stand_for():
+    # a unit sphere moved and uniformly scaled is just another sphere
+    rng = random.Random(0)
+    places = [
+        ([rng.uniform(-10, 10) for _ in range(3)], rng.uniform(0.2, 1.5))
+        for _ in range(100)
+    ]
+    copies = instance.Instances(
+        UNIT, [instance.translate(*c) @ instance.scale(s) for c, s in places]
+    )
+    spheres = shapes.HittableList(
+        [shapes.Sphere(vec3.Vec3(*c), s, GRAY) for c, s in places]
+    )
+    hits = 0
+    for _ in range(300):
+        origin = [rng.uniform(-15, 15) for _ in range(3)]
+        target = [rng.uniform(-10, 10) for _ in range(3)]
+        (a, ra), (b, rb) = hit(copies, origin, target), hit(spheres, origin, target)
+        assert a == b
+        if a:
+            hits += 1
+            assert ra.t == pytest.approx(rb.t)
+            assert tuple(ra.p) == pytest.approx(tuple(rb.p))
+            assert tuple(ra.normal) == pytest.approx(tuple(rb.normal))
+            assert ra.front_face == rb.front_face
+            assert ra.obj is copies
+    assert hits > 50
+
+
+def test_normals_go_through_the_inverse_transpose():
+    # a unit sphere stretched to x^2 / 4 + y^2 + z^2 = 1 and moved up 3;
+    # its normal at (2 cos a, sin a, 0) is along (cos a / 2, sin a, 0),
+    # not along the point as the transformed normal would have it
+    ellipsoid = instance.Instance(
+        UNIT, instance.translate(0, 3, 0) @ instance.scale(2, 1, 1)
+    )
+    for a in (0.3, 0.9, 2.0, 4.0):
+        point = np.array([2 * math.cos(a), 3 + math.sin(a), 0])
+        normal = np.array([math.cos(a) / 2, math.sin(a), 0])
+        normal /= np.linalg.norm(normal)
+        did_hit, rec = hit(ellipsoid, point + 5 * normal, point)
+        assert did_hit
+        assert tuple(rec.p) == pytest.approx(tuple(point))
+        assert tuple(rec.normal) == pytest.approx(tuple(normal))
+        assert rec.front_face
+
+
+def test_rotated_copies():
+    # a unit square in z = 0 turned a quarter about y faces +x
+    square = shapes.Quad(
+        vec3.Vec3(-1, -1, 0), vec3.Vec3(2, 0, 0), vec3.Vec3(0, 2, 0), GRAY
+    )
+    turned = instance.Instance(
+        square, instance.translate(5, 0, 0) @ instance.rotate((0, 1, 0), 90)
+    )
+    did_hit, rec = hit(turned, (9, 0.5, 0.5), (5, 0.5, 0.5))
+    assert did_hit
+    assert rec.t == pytest.approx(1)
+    assert tuple(rec.p) == pytest.approx((5, 0.5, 0.5))
+    assert abs(rec.normal.x) == pytest.approx(1)
+    # the square's old place is empty
+    assert not hit(turned, (0, 0, 4), (0, 0, 0))[0]
+
+
+def test_bad_transforms():
+    with pytest.raises(ValueError):
+        instance.Instances(UNIT, [])
+    with pytest.raises(ValueError):
+        instance.Instance(UNIT, instance.scale(1, 0, 1))
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+from raytracing import material, mesh, ray, vec3
+
+GRAY = material.Lambertian(vec3.Vec3(0.5, 0.5, 0.5))
+
+# a unit square at z = 0 as one quad, with uvs and normals
+SQUARE = """\
+# comments, groups and materials are skipped
+o square
+mtllib square.mtl
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 1 1
+vt 0 1
+vn 0 0 1
+usemtl gray
+f 1/1/1 2/2/1 3/3/1 4/4/1
+"""
+
+
+def load(tmp_path, text, name="mesh.obj"):
+    path = tmp_path / name
+    path.write_text(text)
+    return mesh.load_obj(str(path), GRAY)
+
+
+def triangles(m):
+    # the mesh's triangles as sets of corners, whatever order the BVH put them in
+    corners = m.vertices[m.faces]
+    return sorted(sorted(map(tuple, tri.tolist())) for tri in corners)
+
+
+def test_polygons_become_fans_of_triangles(tmp_path):
+    m = load(tmp_path, SQUARE)
+    assert len(m) == 2
+    assert triangles(m) == [
+        [(0, 0, 0), (0, 1, 0), (1, 1, 0)],
+        [(0, 0, 0), (1, 0, 0), (1, 1, 0)],
+    ]
+    assert m.uvs.shape == (4, 2) and m.normals.shape == (1, 3)
+    assert (m.normal_faces == 0).all()
+
+
+def test_negative_indices_count_back(tmp_path):
+    # the same square, with its face written relative to the last vertex,
+    # which takes the line by line path
+    text = SQUARE.replace(
+        "f 1/1/1 2/2/1 3/3/1 4/4/1", "f -4/-4/-1 -3/-3/-1 -2/-2/-1 -1/-1/-1"
+    )
+    relative, absolute = load(tmp_path, text, "relative.obj"), load(tmp_path, SQUARE)
+    assert triangles(relative) == triangles(absolute)
+    assert np.array_equal(np.sort(relative.uv_faces), np.sort(absolute.uv_faces))
+
+
+@pytest.mark.parametrize(
+    "face, normals, uvs",
+    [
+        ("1 2 3", False, False),
+        ("1/1 2/2 3/3", False, True),
+        ("1//1 2//1 3//1", True, False),
+    ],
+)
+def test_face_forms(tmp_path, face, normals, uvs):
+    text = SQUARE.split("usemtl")[0] + f"f {face}\n"
+    m = load(tmp_path, text)
+    assert len(m) == 1
+    assert (m.normals is not None) == normals
+    assert (m.uvs is not None) == uvs
+
+
+def test_chunks_dont_change_the_mesh(tmp_path, monkeypatch):
+    # a grid of quads read a few lines at a time, so faces come in chunks
+    # after the vertices they use
+    n = 6
+    lines = [f"v {x} {y} 0" for y in range(n + 1) for x in range(n + 1)]
+    for y in range(n):
+        for x in range(n):
+            k = y * (n + 1) + x + 1
+            lines.append(f"f {k} {k + 1} {k + n + 2} {k + n + 1}")
+    text = "\n".join(lines) + "\n"
+    whole = load(tmp_path, text, "whole.obj")
+    monkeypatch.setattr(mesh, "CHUNK", 5)
+    chunked = load(tmp_path, text, "chunked.obj")
+    assert len(whole) == len(chunked) == 2 * n * n
+    assert triangles(whole) == triangles(chunked)
+
+
+def test_bad_faces_name_their_line(tmp_path):
+    with pytest.raises(ValueError, match=r"mesh.obj:5"):
+        load(tmp_path, "v 0 0 0\nv 1 0 0\nv 0 1 0\n\nf 1 2\n")
+    with pytest.raises(ValueError):
+        load(tmp_path, "v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 4\n")
+
+
+def test_loaded_mesh_is_hit(tmp_path):
+    m = load(tmp_path, SQUARE)
+    r = ray.Ray(vec3.Vec3(0.25, 0.75, 2), vec3.Vec3(0, 0, -1))
+    did_hit, rec = m.hit(r, 0.001, float("inf"))
+    assert did_hit
+    assert rec.t == pytest.approx(2)
+    assert (rec.u, rec.v) == pytest.approx((0.25, 0.75))
+    r = ray.Ray(vec3.Vec3(1.5, 0.5, 2), vec3.Vec3(0, 0, -1))
+    assert not m.hit(r, 0.001, float("inf"))[0]
+
+
+def nearest_triangle(m, r, tmin=0.001):
+    # Moller-Trumbore on every triangle at once, without the BVH
+    o, d = np.array(tuple(r.origin)), np.array(tuple(r.dir))
+    p0, e1, e2 = m.tri[:, :3], m.tri[:, 3:6], m.tri[:, 6:]
+    p = np.cross(d, e2)
+    det = np.einsum("ij,ij->i", e1, p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inv = 1 / det
+        s = o - p0
+        u = np.einsum("ij,ij->i", s, p) * inv
+        q = np.cross(s, e1)
+        v = (q @ d) * inv
+        t = np.einsum("ij,ij->i", e2, q) * inv
+    ok = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > tmin)
+    if not ok.any():
+        return None
+    index = np.flatnonzero(ok)[np.argmin(t[ok])]
+    return index, t[index]
+
+
+def test_mesh_hits_the_nearest_triangle():
+    rng = np.random.default_rng(3)
+    corners = rng.uniform(-5, 5, (300, 1, 3)) + rng.uniform(-1, 1, (300, 3, 3))
+    m = mesh.Mesh(corners.reshape(-1, 3), np.arange(900).reshape(-1, 3), GRAY)
+    hits = 0
+    for _ in range(500):
+        origin = vec3.Vec3(*rng.uniform(-10, 10, 3))
+        r = ray.Ray(origin, vec3.Vec3(*rng.uniform(-5, 5, 3)) - origin)
+        expected = nearest_triangle(m, r)
+        did_hit, rec = m.hit(r, 0.001, float("inf"))
+        assert did_hit == (expected is not None)
+        if did_hit:
+            hits += 1
+            assert rec.index == expected[0]
+            assert rec.t == pytest.approx(expected[1])
+    assert hits > 100
@@ -0,0 +1,199 @@
+import json
+import random
+import numpy as np
+import pytest
+from raytracing import distributed, framebuffer, scenecache, scenes, stats, trace
+
+
+def scene(name="simple_light", width=24, spp=8, **cam):
+    random.seed(0)
+    return scenes.SCENES[name](image_width=width, samples_per_pixel=spp, **cam)
+
+
+def render(cam, world, **kwargs):
+    kwargs.setdefault("tile_size", 8)
+    kwargs.setdefault("seed", 1)
+    return cam.render_tiles(world, progress=False, **kwargs)
+
+
+def test_scalar_and_wavefront_agree():
+    # different random streams, so only the expected image is the same;
+    # compared over blocks, which averages the noise of their pixels down
+    means = {}
+    for mode in ("scalar", "wavefront"):
+        cam, world = scene(width=32, spp=64)
+        image = render(cam, world, mode=mode).linear_image()
+        h, w = image.shape[0] // 8, image.shape[1] // 8
+        blocks = image[: 8 * h, : 8 * w].reshape(h, 8, w, 8, 3)
+        means[mode] = blocks.mean(axis=(1, 3))
+    scalar, wavefront = means["scalar"], means["wavefront"]
+    assert abs(scalar.mean() - wavefront.mean()) < 0.05 * scalar.mean()
+    assert np.allclose(wavefront, scalar, rtol=0.15, atol=0.03)
+
+
+@pytest.mark.parametrize("mode", ["scalar", "wavefront"])
+def test_worker_count_doesnt_change_the_image(mode):
+    cam, world = scene()
+    one = render(cam, world, mode=mode, workers=1)
+    two = render(cam, world, mode=mode, workers=2)
+    assert one.sums.tobytes() == two.sums.tobytes()
+    assert one.linear.tobytes() == two.linear.tobytes()
+
+
+def test_adaptive_sampling_is_deterministic():
+    cam, world = scene(spp=16, noise_threshold=0.05, min_samples_per_pixel=4)
+    one = render(cam, world, workers=1)
+    two = render(cam, world, workers=2)
+    # noisy pixels got more samples than the rest
+    assert one.counts.min() < one.counts.max()
+    assert np.array_equal(one.counts, two.counts)
+    assert one.sums.tobytes() == two.sums.tobytes()
+
+
+@pytest.mark.parametrize("mode", ["scalar", "wavefront"])
+def test_collecting_aovs_doesnt_change_the_image(mode):
+    images = []
+    for aovs in (False, True):
+        cam, world = scene(aovs=aovs)
+        images.append(render(cam, world, mode=mode))
+    assert not images[0].aovs and images[1].aovs
+    assert images[0].sums.tobytes() == images[1].sums.tobytes()
+    assert images[0].linear.tobytes() == images[1].linear.tobytes()
+    # which the collected aovs can denoise
+    denoised = images[1].denoised().image()
+    assert denoised.shape == images[1].image().shape
+    assert np.isfinite(denoised).all()
+
+
+@pytest.mark.parametrize("mode", ["scalar", "wavefront"])
+def test_worker_count_doesnt_change_the_stats(mode):
+    # the world prebuilt, so the scalar path's FlatBVH counts its nodes too
+    cam, world = scenecache.scene(
+        "simple_light", 0, None, image_width=24, samples_per_pixel=4
+    )
+    counts = []
+    for workers in (1, 2):
+        with stats.collect() as st:
+            render(cam, world, mode=mode, workers=workers)
+        counts.append(st.as_dict())
+    assert counts[0] == counts[1]
+    assert counts[0]["rays"] >= cam.iw * cam.ih * cam.samples_per_pixel
+    assert counts[0]["ray_primitive_tests"]
+    # the wavefront tracer tests packed primitives without a tree
+    assert bool(counts[0]["bvh_nodes_visited"]) == (mode == "scalar")
+
+
+def test_ldr_output_clamps_samples_and_pfm_keeps_them(tmp_path):
+    cam, world = scene()
+    fb = render(cam, world)
+    # the light is 4 times brighter than white
+    assert fb.image().max() <= framebuffer.DISPLAY.end
+    assert fb.linear_image().max() > 1
+    path = tmp_path / "image.pfm"
+    fb.save(str(path))
+    data = np.frombuffer(path.read_bytes()[-fb.width * fb.height * 12 :], "<f4")
+    assert data.max() == pytest.approx(fb.linear_image().max())
+    path = tmp_path / "image.ppm"
+    fb.save(str(path))
+    assert path.read_bytes().endswith(fb.to_rgb().tobytes())
+
+
+def test_resumed_checkpoint_matches_a_straight_render(tmp_path, monkeypatch):
+    cam, world = scene()
+    straight = render(cam, world, passes=2)
+
+    # the first render is cut short after a few tiles, which checkpoints them
+    done = []
+
+    def interrupted(job):
+        if len(done) == 5:
+            raise KeyboardInterrupt
+        done.append(job)
+        return render_job(job)
+
+    render_job = trace.render_job
+    monkeypatch.setattr(trace, "render_job", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        render(cam, world, passes=2, checkpoint=tmp_path)
+    monkeypatch.setattr(trace, "render_job", render_job)
+
+    resumed = render(cam, world, passes=2, checkpoint=tmp_path)
+    assert np.array_equal(resumed.counts, straight.counts)
+    assert np.array_equal(resumed.sums, straight.sums)
+    assert np.array_equal(resumed.linear, straight.linear)
+
+
+def test_checkpoint_refuses_other_settings(tmp_path):
+    cam, world = scene()
+    render(cam, world, checkpoint=tmp_path)
+    cam, world = scene(spp=4)
+    with pytest.raises(ValueError, match="samples_per_pixel=8, not 4"):
+        render(cam, world, checkpoint=tmp_path)
+
+
+@pytest.mark.parametrize("key", ["aovs", "seed", "done"])
+def test_checkpoint_refuses_state_without_a_key(tmp_path, key):
+    cam, world = scene()
+    render(cam, world, checkpoint=tmp_path)
+    path = tmp_path / "state.json"
+    state = json.loads(path.read_text())
+    del state[key]
+    path.write_text(json.dumps(state))
+    with pytest.raises(ValueError, match=key):
+        render(cam, world, checkpoint=tmp_path)
+
+
+def test_distributed_render_matches_a_local_one(tmp_path):
+    # workers build their world from the scene cache, so this one does too
+    cam, world = scenecache.scene(
+        "simple_light", 0, str(tmp_path), image_width=16, samples_per_pixel=8
+    )
+    local = render(cam, world)
+    with distributed.Coordinator("simple_light", timeout=60) as coordinator:
+        distributed.start_workers(
+            2, coordinator.address, coordinator.authkey, str(tmp_path)
+        )
+        remote = render(cam, world, workers=coordinator)
+    assert local.sums.tobytes() == remote.sums.tobytes()
+
+
+def mean_with_and_without_light_sampling(mode, spp, **settings):
+    means = []
+    for light_sampling in (False, True):
+        cam, world = scene(
+            "simple_light2", 16, spp, light_sampling=light_sampling, **settings
+        )
+        means.append(render(cam, world, mode=mode).linear_image().mean())
+    return means
+
+
+@pytest.mark.parametrize("mode, spp", [("scalar", 32), ("wavefront", 128)])
+def test_light_sampling_keeps_the_mean(mode, spp):
+    # simple_light2's noise albedo reaches 2, so paths caught between its
+    # spheres gain energy; a few bounces keep the variance of both bounded
+    bsdf, nee = mean_with_and_without_light_sampling(
+        mode, spp, max_bounces=4, roulette_depth=None
+    )
+    assert nee == pytest.approx(bsdf, rel=0.04)
+
+
+@pytest.mark.parametrize("mode", ["scalar", "wavefront"])
+def test_light_sampling_stops_at_the_last_bounce(mode):
+    # a light sample there would be a segment past max_bounces
+    bsdf, nee = mean_with_and_without_light_sampling(mode, 8, max_bounces=1)
+    assert nee == bsdf
+
+
+@pytest.mark.parametrize(
+    "mode, spp, rel", [("scalar", 128, 0.05), ("wavefront", 256, 0.02)]
+)
+def test_roulette_keeps_the_mean(mode, spp, rel):
+    # paths may end after their first segment, and the ones that go on carry
+    # what the others would have, so only the noise changes
+    means = []
+    for roulette_depth in (None, 1):
+        cam, world = scene(
+            "simple_light", 16, spp, max_bounces=8, roulette_depth=roulette_depth
+        )
+        means.append(render(cam, world, mode=mode).linear_image().mean())
+    assert means[1] == pytest.approx(means[0], rel=rel)
@@ -0,0 +1,58 @@
+import random
+import pytest
+from raytracing import samplers
+
+SAMPLES = [(i, j, s) for j in range(3) for i in range(4) for s in range(8)]
+
+
+def draw(sampler, order):
+    # every sample's pixel offset, lens and first scatter dimensions
+    values = {}
+    for i, j, s in order:
+        sampler.start(i, j, s)
+        values[i, j, s] = sampler.get_2d(), sampler.get_2d(), sampler.get_1d()
+    return values
+
+
+@pytest.mark.parametrize("name", sorted(samplers.SAMPLERS))
+def test_same_seed_same_samples(name):
+    runs = []
+    for _ in range(2):
+        random.seed(7)
+        sampler = samplers.SAMPLERS[name](8)
+        sampler.reseed()
+        runs.append(draw(sampler, SAMPLES))
+    assert runs[0] == runs[1]
+
+
+@pytest.mark.parametrize("name", ["halton", "sobol"])
+def test_samples_dont_depend_on_the_order_pixels_are_drawn(name):
+    sampler = samplers.SAMPLERS[name](8, seed=3)
+    assert draw(sampler, SAMPLES) == draw(sampler, SAMPLES[::-1])
+
+
+@pytest.mark.parametrize("name", sorted(samplers.SAMPLERS))
+def test_samples_are_in_the_unit_interval(name):
+    random.seed(0)
+    for values in draw(samplers.SAMPLERS[name](8, seed=5), SAMPLES).values():
+        (a, b), (c, d), e = values
+        assert all(0 <= x < 1 for x in (a, b, c, d, e))
+
+
+@pytest.mark.parametrize("name", ["stratified", "halton", "sobol"])
+def test_a_pixels_samples_cover_the_strata(name):
+    # with 16 samples, each of the 16 intervals of the first dimension
+    # gets exactly one
+    random.seed(0)
+    sampler = samplers.SAMPLERS[name](16, seed=11)
+    strata = []
+    for s in range(16):
+        sampler.start(2, 5, s)
+        strata.append(int(sampler.get_1d() * 16))
+    assert sorted(strata) == list(range(16))
+
+
+def test_samples_can_be_drawn_before_start():
+    for name in samplers.SAMPLERS:
+        x, y = samplers.SAMPLERS[name](4).get_2d()
+        assert 0 <= x < 1 and 0 <= y < 1
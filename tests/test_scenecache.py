@@ -0,0 +1,60 @@
+import os
+import shutil
+from raytracing import scenecache, trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def image(world, settings):
+    cam = trace.Camera(**dict(settings, image_width=16, samples_per_pixel=4))
+    return cam.render_tiles(world, tile_size=8, seed=1, progress=False)
+
+
+def test_loaded_scene_renders_like_the_built_one(tmp_path):
+    world, settings, files = scenecache.build("simple_light", 3)
+    scenecache.save(str(tmp_path), world, settings, files)
+    cached = scenecache.load(str(tmp_path))
+    assert cached is not None
+    built, loaded = image(world, settings), image(*cached)
+    assert built.sums.tobytes() == loaded.sums.tobytes()
+
+
+def test_same_seed_same_key():
+    assert scenecache.key("random", 1) == scenecache.key("random", 1)
+    assert scenecache.key("random", 1) != scenecache.key("random", 2)
+    assert scenecache.key("random", 1) != scenecache.key("random", 1, False)
+
+
+def test_changed_inputs_invalidate_the_cache(tmp_path, monkeypatch):
+    # the globe reads its texture by a relative path, so it is copied next
+    # to where the scene is built
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(ROOT, "world.png"), "world.png")
+    world, settings, files = scenecache.build("globe")
+    assert os.path.abspath("world.png") in files
+    scenecache.save("cache", world, settings, files)
+    assert scenecache.load("cache") is not None
+    st = os.stat("world.png")
+    os.utime("world.png", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert scenecache.load("cache") is None
+
+
+def test_nothing_cached(tmp_path):
+    assert scenecache.load(str(tmp_path)) is None
+
+
+def test_scene_is_built_once_then_loaded(tmp_path, monkeypatch):
+    builds = []
+    build = scenecache.build
+    monkeypatch.setattr(
+        scenecache, "build", lambda *args: builds.append(args) or build(*args)
+    )
+    images = []
+    for _ in range(2):
+        cam, world = scenecache.scene(
+            "simple_light", 3, str(tmp_path), image_width=16, samples_per_pixel=4
+        )
+        assert cam.iw == 16
+        images.append(cam.render_tiles(world, tile_size=8, seed=1, progress=False))
+    assert len(builds) == 1
+    assert images[0].sums.tobytes() == images[1].sums.tobytes()
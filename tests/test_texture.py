@@ -0,0 +1,182 @@
+import math
+import os
+import numpy as np
+import pytest
+from PIL import Image as PILImage
+from raytracing import material, perlin, ray, shapes, texcache, texture, trace, vec3
+
+
+def png(tmp_path, name, size=8, color=(255, 0, 0)):
+    path = str(tmp_path / name)
+    PILImage.new("RGB", (size, size), color).save(path)
+    return path
+
+
+def test_cache_shares_images_and_drops_the_least_recently_used(tmp_path):
+    a, b, c = (png(tmp_path, f"{name}.png") for name in "abc")
+    # an 8x8 image and its mips take 255 bytes, the budget fits two
+    cache = texcache.TextureCache(budget=2 * 255 + 10)
+    levels = cache.get(a)
+    assert texcache.nbytes(levels) == 255
+    assert [level.shape[:2] for level in levels] == [(8, 8), (4, 4), (2, 2), (1, 1)]
+    cache.get(b)
+    assert cache.get(a) is levels
+    cache.get(c)
+    assert [key[0] for key in cache.entries] == [a, c]
+    assert cache.size == 2 * 255 <= cache.budget
+
+
+def test_an_image_over_the_budget_is_still_kept(tmp_path):
+    cache = texcache.TextureCache(budget=100)
+    cache.get(png(tmp_path, "a.png"))
+    cache.get(png(tmp_path, "b.png"))
+    assert len(cache.entries) == 1 and cache.size == 255
+
+
+def test_float32_store(tmp_path):
+    cache = texcache.TextureCache(dtype=np.float32)
+    levels = cache.get(png(tmp_path, "a.png", color=(255, 51, 0)))
+    assert levels[0].dtype == np.float32
+    assert texcache.nbytes(levels) == 4 * 255
+    assert np.allclose(levels[-1][0, 0], (1, 0.2, 0))
+    with pytest.raises(ValueError):
+        texcache.TextureCache(dtype=np.float64)
+
+
+def test_changed_files_are_decoded_again(tmp_path):
+    cache = texcache.TextureCache()
+    path = png(tmp_path, "a.png")
+    old = cache.get(path)
+    png(tmp_path, "a.png", color=(0, 0, 255))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert tuple(cache.get(path)[0][0, 0]) == (0, 0, 255)
+    assert tuple(old[0][0, 0]) == (255, 0, 0)
+
+
+def noise_image(tmp_path, size=16):
+    # random texels, so every mip level looks different
+    data = np.random.default_rng(0).integers(0, 256, (size, size, 3), np.uint8)
+    path = str(tmp_path / "noise.png")
+    PILImage.fromarray(data).save(path)
+    return texture.Image(path)
+
+
+@pytest.mark.parametrize(
+    "footprint, level",
+    [(0, 0), (1 / 16, 0), (2 / 16, 1), (3.9 / 16, 1), (4 / 16, 2), (1, 4), (9, 4)],
+)
+def test_mip_level_follows_the_footprint(tmp_path, footprint, level):
+    # a level's texels are about as wide as the footprint, in uv units
+    tex = noise_image(tmp_path)
+    u, v = np.array([0.3, 0.72]), np.array([0.6, 0.05])
+    expected = tex.lookup(level, u, v)
+    scalar = [tuple(tex.sample(a, b, None, footprint)) for a, b in zip(u, v)]
+    assert np.allclose(scalar, expected)
+    assert np.allclose(tex.sample_array(u, v, None, np.full(2, footprint)), expected)
+
+
+def test_footprint_follows_the_ray_cone():
+    # a 2x2 quad, so a footprint is half the cone's width at the hit
+    quad = shapes.Quad(
+        vec3.Vec3(-1, -1, 0),
+        vec3.Vec3(2, 0, 0),
+        vec3.Vec3(0, 2, 0),
+        material.Lambertian(vec3.Vec3(0.5, 0.5, 0.5)),
+    )
+    for distance in (1, 8):
+        r = ray.Ray(vec3.Vec3(0, 0, distance), vec3.Vec3(0, 0, -1), 0.0, 0.01)
+        rec = quad.hit(r, 0.001, math.inf)[1]
+        assert rec.width == pytest.approx(0.01 * distance)
+        assert rec.footprint == pytest.approx(0.01 * distance / 2)
+    # 2 away at 60 degrees from the normal, which stretches the footprint twice
+    r = ray.Ray(vec3.Vec3(0, math.sqrt(3), 1), vec3.Vec3(0, -math.sqrt(3), -1), 0, 0.01)
+    rec = quad.hit(r, 0.001, math.inf)[1]
+    assert rec.width == pytest.approx(0.02)
+    assert rec.footprint == pytest.approx(0.02)
+
+
+def test_cameras_only_spread_rays_when_filtering():
+    assert trace.Camera(image_width=40).pixel_spread == 0
+    cam = trace.Camera(image_width=40, texture_filtering=True)
+    assert cam.pixel_spread == pytest.approx(cam.pixel_delta_u.length / cam.focus_dist)
+
+
+def scalar_noise(noise, point):
+    # Perlin.noise as it was, a lattice corner at a time
+    i, j, k = (math.floor(x) for x in point)
+    u, v, w = (x - math.floor(x) for x in point)
+    uu, vv, ww = (t * t * (3 - 2 * t) for t in (u, v, w))
+    total = 0
+    for di in range(2):
+        for dj in range(2):
+            for dk in range(2):
+                g = noise.rv[
+                    noise.px[(i + di) & 255]
+                    ^ noise.py[(j + dj) & 255]
+                    ^ noise.pz[(k + dk) & 255]
+                ]
+                total += (
+                    (di * uu + (1 - di) * (1 - uu))
+                    * (dj * vv + (1 - dj) * (1 - vv))
+                    * (dk * ww + (1 - dk) * (1 - ww))
+                    * (g.x * (u - di) + g.y * (v - dj) + g.z * (w - dk))
+                )
+    return total
+
+
+def scalar_turb(noise, point, depth):
+    return abs(sum(0.5**n * scalar_noise(noise, point * 2**n) for n in range(depth)))
+
+
+def test_noise_arrays_match_the_scalar_noise():
+    noise = perlin.Perlin(seed=4)
+    points = np.random.default_rng(0).uniform(-20, 20, (300, 3))
+    expected = [scalar_noise(noise, p) for p in points]
+    assert np.allclose(noise.noise_array(points), expected, rtol=0, atol=1e-12)
+    expected = [scalar_turb(noise, p, 7) for p in points]
+    assert np.allclose(noise.turb_array(points, 7), expected, rtol=0, atol=1e-12)
+    point = vec3.Vec3(*points[0])
+    assert noise.noise(point) == pytest.approx(scalar_noise(noise, points[0]))
+    assert noise.turb(point, 7) == pytest.approx(scalar_turb(noise, points[0], 7))
+
+
+@pytest.mark.parametrize("mode", ["normal", "turb", "sine"])
+def test_noise_texture_samples_arrays_like_points(mode):
+    tex = texture.Noise(scale=4, mode=mode, seed=1)
+    p = np.random.default_rng(1).uniform(-3, 3, (200, 3))
+    expected = [tuple(tex.sample(0, 0, vec3.Vec3(*q))) for q in p.tolist()]
+    assert np.allclose(tex.sample_array(None, None, p), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("tolerance", [0.02, 0.005])
+def test_baked_noise_stays_within_the_tolerance(tolerance):
+    exact = texture.Noise(scale=2, seed=3)
+    baked = texture.Noise(scale=2, seed=3)
+    baked.bake(((0, 0, 0), (1, 1, 1)), 4, tolerance, cache_dir=None)
+    # refined past the 4 samples a side it started from
+    assert baked.grid.shape[0] > 4
+    # other points than the ones the grid was checked at
+    p = np.random.default_rng(5).uniform(0, 1, (20000, 3))
+    error = baked.sample_array(None, None, p) - exact.sample_array(None, None, p)
+    assert np.abs(error).max() <= tolerance
+    q = vec3.Vec3(0.3, 0.6, 0.9)
+    assert tuple(baked.sample(0, 0, q)) == pytest.approx(
+        tuple(exact.sample(0, 0, q)), abs=tolerance
+    )
+    # and outside the box nothing changes
+    p = np.random.default_rng(6).uniform(1.5, 3, (100, 3))
+    assert np.array_equal(
+        baked.sample_array(None, None, p), exact.sample_array(None, None, p)
+    )
+
+
+def test_baked_noise_is_read_back_from_the_cache(tmp_path):
+    box = ((0, 0, 0), (1, 1, 1))
+    first = texture.Noise(scale=2, seed=3).bake(box, 8, 0.02, tmp_path)
+    assert len(os.listdir(tmp_path)) == 1
+    second = texture.Noise(scale=2, seed=3).bake(box, 8, 0.02, tmp_path)
+    assert np.array_equal(first.grid.values, second.grid.values)
+    # another seed is another grid
+    texture.Noise(scale=2, seed=4).bake(box, 8, 0.02, tmp_path)
+    assert len(os.listdir(tmp_path)) == 2